@@ -0,0 +1,84 @@
+"""
+Local mock of the chat completions endpoint, shared by the benchmarks
+
+Every input text is returned as is, after a simulated latency (none by
+default, see reply_seconds), and the time the first request arrived is
+recorded. Clients are pointed at it with OPENAI_BASE_URL (see serve).
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def reply_content(src_text: str) -> str:
+    """
+    Content of the reply to an input text
+    """
+    return json.dumps({"skip": False, "tgt_text": src_text})
+
+
+def reply_seconds(content: str) -> float:
+    """
+    Simulated latency of a reply: base_seconds plus its tokens at
+    tokens_per_second (no generation time when not set)
+    """
+    seconds = MockCompletions.base_seconds
+    if MockCompletions.tokens_per_second:
+        seconds += len(content) / 4 / MockCompletions.tokens_per_second
+    return seconds
+
+
+class MockCompletions(BaseHTTPRequestHandler):
+    """
+    Chat completions endpoint returning every input text as is
+    """
+    first_request: float | None = None
+    base_seconds = 0.0
+    tokens_per_second: float | None = None
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """
+        Answers a chat completion request with its src_text
+        """
+        if MockCompletions.first_request is None:
+            MockCompletions.first_request = time.perf_counter()
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        src_text = json.loads(body["messages"][-1]["content"]).get("src_text", "")
+        content = reply_content(src_text)
+        seconds = reply_seconds(content)
+        if seconds:
+            time.sleep(seconds)
+        data = json.dumps({
+            "id": "mock", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{
+                "index": 0, "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content}
+            }],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve() -> ThreadingHTTPServer:
+    """
+    Starts the mock endpoint on a free port, in a background thread
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockCompletions)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def base_url(server: ThreadingHTTPServer) -> str:
+    """
+    OPENAI_BASE_URL of a mock endpoint
+    """
+    return f"http://127.0.0.1:{server.server_address[1]}/v1"
@@ -0,0 +1,151 @@
+"""
+Benchmark of word.cleanup_bad_runs against the original (quadratic) version
+
+    python benchmarks/cleanup_runs.py --runs 100 200 400 800 1600 6400
+
+Paragraphs of n runs are built from fragments exercising every merge rule.
+Both versions are first checked to leave identical XML on random paragraphs,
+then timed; the time per run of the single pass stays flat as n grows.
+"""
+
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+from docx import Document
+from docx.text.paragraph import Paragraph
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from weaver import word  # pylint: disable=wrong-import-position
+
+FRAGMENTS = [
+    "Hello", " world", "ends.", "U.S.", "U.S. ", "Inc", "CA.", "A.", ".", ", and", "(1)",
+    "(a", "b)", "The", " ", "", "\t", "\n", "\tindented", "a\tb", "x\r", "\xa0", "non-break",
+]
+
+
+def legacy_cleanup_bad_runs(para):
+    """
+    cleanup_bad_runs before the single pass rewrite
+    """
+    def check_country_abbr(para, jx) -> bool:
+        try:
+            is_country_abbr = (para.runs[jx-1].text.strip().endswith('.') &
+                               para.runs[jx-1].text.strip()[-2].isupper())
+        except Exception:  # pylint: disable=broad-except
+            is_country_abbr = False
+        return is_country_abbr
+
+    def check_special_end_cases(para, jx) -> bool:
+        try:
+            is_special_case = (para.runs[jx-1].text.strip().endswith('.') &
+                               para.runs[jx].text.strip().startswith(','))
+        except Exception:  # pylint: disable=broad-except
+            is_special_case = False
+        return is_special_case
+
+    for jx, _ in reversed(list(enumerate(para.runs))):
+        if jx == 0:
+            break
+        try:
+            if (
+                (not para.runs[jx - 1].text.strip().endswith("."))
+                | check_country_abbr(para, jx)
+                | check_special_end_cases(para, jx)
+            ) & (para.runs[jx - 1].text not in ["\n", "\t"]):
+                if (not para.runs[jx].text.startswith("\t")) & (
+                    not para.runs[jx].text.startswith("\n")
+                ):
+                    if (para.runs[jx].text not in ["\n", "\t"]) & (
+                        para.runs[jx - 1].text not in ["\n", "\t"]
+                    ):
+                        if (jx - 1 == 0) and (para.runs[jx - 1].text == ""):
+                            continue
+                        if not all(
+                            [
+                                para.runs[jx].text[0] == "(",
+                                para.runs[jx].text[-1] == ")",
+                            ]
+                        ):
+                            if not all(
+                                [
+                                    para.runs[jx - 1].text.strip().endswith("U.S."),
+                                    para.runs[jx].text.strip()[0].isupper(),
+                                ]
+                            ):
+                                para.runs[jx - 1].text = (
+                                    para.runs[jx - 1].text + para.runs[jx].text
+                                )
+                                para._p.remove(para.runs[jx]._r)  # pylint: disable=protected-access
+        except IndexError:
+            continue
+
+
+def build_paragraph(document, n_runs: int, rng: random.Random):
+    """
+    Paragraph of n_runs random fragments
+    """
+    paragraph = document.add_paragraph()
+    for _ in range(n_runs):
+        paragraph.add_run(rng.choice(FRAGMENTS))
+    return paragraph
+
+
+def check_equivalence(trials: int, seed: int):
+    """
+    Asserts both versions leave the same XML on random paragraphs
+    """
+    rng = random.Random(seed)
+    document = Document()
+    for _ in range(trials):
+        paragraph = build_paragraph(document, rng.randint(0, 12), rng)
+        p = paragraph._p  # pylint: disable=protected-access
+        expected, actual = copy.deepcopy(p), copy.deepcopy(p)
+        legacy_cleanup_bad_runs(Paragraph(expected, paragraph._parent))  # pylint: disable=protected-access
+        word.cleanup_bad_runs(Paragraph(actual, paragraph._parent))  # pylint: disable=protected-access
+        assert expected.xml == actual.xml, (expected.xml, actual.xml)
+
+
+def time_cleanup(cleanup_fn, n_runs: int, repeats: int, seed: int) -> float:
+    """
+    Best time (seconds) of cleanup_fn on a paragraph of n_runs runs
+    """
+    best = float("inf")
+    for ix in range(repeats):
+        paragraph = build_paragraph(Document(), n_runs, random.Random(seed + ix))
+        start = time.perf_counter()
+        cleanup_fn(paragraph)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    """
+    Checks the two versions agree, then times them on growing paragraphs
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, nargs="+", default=[100, 200, 400, 800, 1600])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--trials", type=int, default=2000, help="Random equivalence checks")
+    parser.add_argument(
+        "--legacy-max-runs", type=int, default=800, help="Largest paragraph timed with the original"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    check_equivalence(trials=args.trials, seed=args.seed)
+    print(f"Equivalent on {args.trials} random paragraphs\n")
+    print(f"{'runs':>6} {'single pass':>12} {'us/run':>8} {'legacy':>10} {'us/run':>8}")
+    for n_runs in args.runs:
+        fast = time_cleanup(word.cleanup_bad_runs, n_runs, args.repeats, args.seed)
+        line = f"{n_runs:>6} {fast:>11.4f}s {fast / n_runs * 1e6:>8.1f}"
+        if n_runs <= args.legacy_max_runs:
+            slow = time_cleanup(legacy_cleanup_bad_runs, n_runs, args.repeats, args.seed)
+            line += f" {slow:>9.3f}s {slow / n_runs * 1e6:>8.1f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
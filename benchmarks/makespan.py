@@ -0,0 +1,123 @@
+"""
+Benchmark of the work queue schedulers (see weaver.scheduling)
+
+    python benchmarks/makespan.py --segments 300 --concurrency 16 --long-share 0.1
+
+A document-like list of segments (mostly short runs, headers and cells, with
+a share of long clauses gathered towards its end) is generated through the
+async dispatch against a local mock of the chat completions endpoint, whose
+latency grows with the length of the reply. For each scheduler, prints the
+makespan (time until every segment is done), the time until the first half of
+the document is ready, and the makespan over its lower bound: the longest
+request, or the total request time divided by the concurrency.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from _mock import MockCompletions, base_url, reply_content, reply_seconds, serve
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from weaver import dispatch, ratelimit  # pylint: disable=wrong-import-position
+from weaver.dedupe import SegmentKey  # pylint: disable=wrong-import-position
+from weaver.scheduling import SCHEDULERS  # pylint: disable=wrong-import-position
+
+MODEL_NAME = "gpt-4o"
+WORDS = [
+    "the", "agreement", "party", "shall", "notice", "term", "payment", "clause", "within", "days"
+]
+
+
+def build_segments(count: int, long_share: float, seed: int) -> list[str]:
+    """
+    Segments in document order: short runs (2 to 12 words) with long clauses
+    (80 to 250 words), the clauses more likely the further in the document
+    """
+    rng = random.Random(seed)
+    segments = []
+    for ix in range(count):
+        is_long = rng.random() < long_share * 2 * (ix + 1) / count
+        length = rng.randint(80, 250) if is_long else rng.randint(2, 12)
+        segments.append(f"{ix} " + " ".join(rng.choice(WORDS) for _ in range(length)))
+    return segments
+
+
+def request_seconds(src_text: str) -> float:
+    """
+    Latency the mock endpoint gives a segment
+    """
+    return reply_seconds(reply_content(src_text))
+
+
+def run(keys: list[SegmentKey], concurrency: int, schedule: str) -> dict:
+    """
+    Generates the segments with a scheduler, timing when each is done
+    """
+    done: dict[SegmentKey, float] = {}
+    start = time.perf_counter()
+    dispatch.generate_transformations(
+        keys=keys,
+        concurrency=concurrency,
+        on_result=lambda key, _: done.setdefault(key, time.perf_counter() - start),
+        schedule=schedule
+    )
+    return {
+        "makespan": max(done.values()),
+        "first_half": max(done[key] for key in keys[:len(keys) // 2])
+    }
+
+
+def main():
+    """
+    Times every scheduler on the same segments against the mock endpoint
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--segments", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--long-share", type=float, default=0.1, help="Share of long clauses")
+    parser.add_argument(
+        "--base-seconds", type=float, default=0.3, help="Simulated latency of any request"
+    )
+    parser.add_argument(
+        "--tokens-per-second", type=float, default=100.0, help="Simulated generation speed"
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    MockCompletions.base_seconds = args.base_seconds
+    MockCompletions.tokens_per_second = args.tokens_per_second
+
+    server = serve()
+    os.environ["OPENAI_API_KEY"] = "benchmark"
+    os.environ["OPENAI_BASE_URL"] = base_url(server)
+    # Budgets Large Enough To Only Measure The Schedule
+    ratelimit.configure_rate_limiter(
+        model_name=MODEL_NAME, requests_per_minute=10**6, tokens_per_minute=10**9,
+        max_concurrency=args.concurrency
+    )
+
+    segments = build_segments(args.segments, args.long_share, args.seed)
+    keys = [
+        SegmentKey(MODEL_NAME, "Benchmark", "Return the text as is.", text) for text in segments
+    ]
+    seconds = [request_seconds(text) for text in segments]
+    lower_bound = max(*seconds, sum(seconds) / args.concurrency)
+    print(
+        f"{len(keys)} segments ({sum(len(text.split()) > 50 for text in segments)} long), "
+        f"concurrency {args.concurrency}, lower bound {lower_bound:.2f}s"
+    )
+    print(f"{'schedule':>9} {'makespan':>9} {'1st half':>9} {'/ bound':>8}")
+    for schedule in SCHEDULERS:
+        runs = [run(keys, args.concurrency, schedule) for _ in range(args.repeats)]
+        makespan = min(result["makespan"] for result in runs)
+        first_half = min(result["first_half"] for result in runs)
+        print(
+            f"{schedule:>9} {makespan:>8.2f}s {first_half:>8.2f}s {makespan / lower_bound:>8.2f}"
+        )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
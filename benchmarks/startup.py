@@ -0,0 +1,151 @@
+"""
+Benchmark of cold starts: import time and time to the first LLM request
+
+    python benchmarks/startup.py --repeats 5 --budget-import-ms 600
+        --budget-first-request-ms 1500
+
+Every measure runs in a fresh interpreter. A small document is woven against
+a local mock of the chat completions endpoint, started by the benchmark, and
+the first request is timed from the moment the interpreter is launched. The
+same is done after importing pandas and openai up front, as the package used
+to. Exits with 1 when a median is over its budget.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from _mock import MockCompletions, base_url, serve
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+# Imported Up Front With --eager, As The Package Used To
+EAGER_MODULES = ["pandas", "openai"]
+HEAVY_MODULES = ["pandas", "openai", "httpx", "tiktoken", "docx", "pydantic_settings", "tqdm"]
+
+
+def child(args):
+    """
+    Measured process: imports the package (after the heavy dependencies with
+    --eager), then weaves the document, printing its timings as JSON
+    """
+    start = time.perf_counter()
+    if args.eager:
+        for name in EAGER_MODULES:
+            importlib.import_module(name)
+    sys.path.insert(0, ROOT)
+    from weaver.weaver import DocxWeaver  # pylint: disable=import-outside-toplevel
+    imported = time.perf_counter()
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    weaver = DocxWeaver(
+        filename=args.document,
+        purpose="Benchmark",
+        paragraph_prompt="Return the text as is.",
+        table_prompt=None,
+        mode="transform_only"
+    )
+    weaver.weave_document(output_fn=args.output)
+    print(json.dumps({
+        "import_ms": (imported - start) * 1000,
+        "weave_ms": (time.perf_counter() - imported) * 1000,
+        "loaded": loaded
+    }))
+
+
+def build_document(path: str, paragraphs: int):
+    """
+    Small document of short paragraphs
+    """
+    from docx import Document  # pylint: disable=import-outside-toplevel
+    document = Document()
+    for ix in range(paragraphs):
+        document.add_paragraph(f"Paragraph number {ix} of the startup benchmark.")
+    document.save(path)
+
+
+def measure(document: str, output: str, url: str, eager: bool) -> dict:
+    """
+    Timings of one cold start, with the time to the first request measured
+    from the launch of the interpreter
+    """
+    MockCompletions.first_request = None
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": url,
+        "PYTHONDONTWRITEBYTECODE": "",
+    }
+    command = [sys.executable, __file__, "--child", "--document", document, "--output", output]
+    launched = time.perf_counter()
+    completed = subprocess.run(
+        command + (["--eager"] if eager else []),
+        env=env, capture_output=True, text=True, check=True
+    )
+    timings = json.loads(completed.stdout.strip().splitlines()[-1])
+    timings["first_request_ms"] = (MockCompletions.first_request - launched) * 1000
+    return timings
+
+
+def main():
+    """
+    Runs the measured processes (or is one, with --child) and checks the budgets
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument(
+        "--paragraphs", type=int, default=5, help="Paragraphs of the woven document"
+    )
+    parser.add_argument("--budget-import-ms", type=float, default=600.0)
+    parser.add_argument("--budget-first-request-ms", type=float, default=1500.0)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--eager", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--document", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return 0
+
+    server = serve()
+    with tempfile.TemporaryDirectory() as tmp:
+        document = os.path.join(tmp, "startup.docx")
+        build_document(document, args.paragraphs)
+        results = {}
+        for label, eager in [("lazy", False), ("eager", True)]:
+            runs = [
+                measure(document, os.path.join(tmp, "woven.docx"), base_url(server), eager)
+                for _ in range(args.repeats)
+            ]
+            results[label] = {
+                name: statistics.median(run[name] for run in runs)
+                for name in ["import_ms", "first_request_ms", "weave_ms"]
+            }
+            results[label]["loaded"] = runs[-1]["loaded"]
+    server.shutdown()
+
+    print(f"{'':>6} {'import':>9} {'1st request':>12} {'weave':>9}  loaded at import")
+    for label, result in results.items():
+        print(
+            f"{label:>6} {result['import_ms']:>7.0f}ms {result['first_request_ms']:>10.0f}ms "
+            f"{result['weave_ms']:>7.0f}ms  {', '.join(result['loaded'])}"
+        )
+    over = [
+        f"{name} {results['lazy'][name]:.0f}ms > {budget:.0f}ms"
+        for name, budget in [
+            ("import_ms", args.budget_import_ms), ("first_request_ms", args.budget_first_request_ms)
+        ]
+        if results["lazy"][name] > budget
+    ]
+    if over:
+        print("Over Budget: " + "; ".join(over))
+        return 1
+    print("Within Budget")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
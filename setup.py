@@ -20,4 +20,10 @@ setup(
     ),
     packages=find_packages(),
     install_requires=requirements,
+    entry_points={
+        "console_scripts": [
+            "docx-weaver=weaver.cli:main",
+            "docx-weaver-server=weaver.server:main",
+        ],
+    },
 )
@@ -0,0 +1,206 @@
+"""
+Shared fixtures: a local mock of the chat completions endpoint, rate limiters
+with budgets out of the way, and small Word documents
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable
+import json
+import os
+import re
+import threading
+import time
+import pytest
+from docx import Document
+from weaver import ratelimit, word
+
+MODEL_NAMES = ["gpt-4-turbo", "gpt-3.5-turbo", "gpt-4o"]
+# Budgets large enough for the limiters never to hold a test back
+LARGE_BUDGETS = {name: 10**9 for name in MODEL_NAMES}
+SPAN_TAG = re.compile(r"(</?s\d+>)")
+
+
+def shout(text: str) -> str:
+    """
+    Default transformation of the mock: upper case, leaving span markers as they are
+    """
+    return "".join(
+        part if SPAN_TAG.fullmatch(part) else part.upper() for part in SPAN_TAG.split(text)
+    )
+
+
+class MockLLM:
+    """
+    State of the mock endpoint, reset for every test
+    transform: Callable[[str], str | None] - Reply to an input text (None to skip it)
+    fail: int - Next requests answered with `status` instead of a reply
+    status: int - Status code of failed requests
+    delay: float - Seconds before every reply
+    drop_last: bool - Batch replies leave out their last segment
+    invalid_models: set[str] - Models replying with JSON not matching the schema
+    requests: list[dict] - Bodies of the requests received
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Back to replying with shout, at once, to every request
+        """
+        self.transform: Callable[[str], str | None] = shout
+        self.fail = 0
+        self.status = 500
+        self.delay = 0.0
+        self.drop_last = False
+        self.invalid_models: set[str] = set()
+        self.requests: list[dict] = []
+        self.lock = threading.Lock()
+
+    def texts(self) -> list[str]:
+        """
+        Input texts of every request received, in order (segments of batches flattened)
+        """
+        texts = []
+        for body in self.requests:
+            content = json.loads(body["messages"][-1]["content"])
+            if "segments" in content:
+                texts.extend(segment["text"] for segment in content["segments"])
+            else:
+                texts.append(content["src_text"])
+        return texts
+
+    def reply(self, body: dict) -> tuple[int, dict[str, Any]]:
+        """
+        Status and JSON reply to a request
+        """
+        with self.lock:
+            self.requests.append(body)
+            if self.fail > 0:
+                self.fail -= 1
+                return self.status, {"error": {"message": "mock failure", "type": "server_error"}}
+        if self.delay:
+            time.sleep(self.delay)
+        content = json.loads(body["messages"][-1]["content"])
+        if body["model"] in self.invalid_models:
+            reply: dict[str, Any] = {"text": "invalid"}
+        elif "segments" in content:
+            segments = content["segments"][:-1] if self.drop_last else content["segments"]
+            reply = {"results": [
+                {"id": segment["id"], **self._result(segment["text"])} for segment in segments
+            ]}
+        else:
+            reply = self._result(content["src_text"])
+        message = json.dumps(reply, ensure_ascii=False)
+        finish_reason = "stop"
+        completion_tokens = len(message) // 4 + 1
+        if body.get("max_tokens") is not None and completion_tokens > body["max_tokens"]:
+            message = message[:body["max_tokens"] * 4]
+            completion_tokens = body["max_tokens"]
+            finish_reason = "length"
+        return 200, {
+            "id": "mock", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{
+                "index": 0, "finish_reason": finish_reason,
+                "message": {"role": "assistant", "content": message}
+            }],
+            "usage": {
+                "prompt_tokens": 10, "completion_tokens": completion_tokens,
+                "total_tokens": 10 + completion_tokens
+            }
+        }
+
+    def _result(self, text: str) -> dict[str, Any]:
+        tgt_text = self.transform(text)
+        return {"skip": tgt_text is None, "tgt_text": tgt_text or ""}
+
+
+class MockCompletions(BaseHTTPRequestHandler):
+    """
+    Chat completions endpoint answering from the server's MockLLM
+    """
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """
+        Answers a chat completion request
+        """
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        status, reply = self.server.mock.reply(body)
+        data = json.dumps(reply).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def mock_server():
+    """
+    Mock endpoint the OpenAI clients of the whole session are pointed at
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockCompletions)
+    server.mock = MockLLM()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    environ = {
+        "OPENAI_API_KEY": "test",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{server.server_address[1]}/v1",
+        "OPENAI_REQUESTS_PER_MINUTE": json.dumps(LARGE_BUDGETS),
+        "OPENAI_TOKENS_PER_MINUTE": json.dumps(LARGE_BUDGETS),
+    }
+    previous = {name: os.environ.get(name) for name in environ}
+    os.environ.update(environ)
+    word.get_client.cache_clear()
+    yield server
+    server.shutdown()
+    for name, value in previous.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+    word.get_client.cache_clear()
+
+
+@pytest.fixture
+def mock_llm(mock_server) -> MockLLM:  # pylint: disable=redefined-outer-name
+    """
+    Mock endpoint state, reset for the test
+    """
+    mock_server.mock.reset()
+    return mock_server.mock
+
+
+@pytest.fixture(autouse=True)
+def rate_limiters(monkeypatch):
+    """
+    Fresh process-wide limiters with large budgets (retries back off quickly)
+    """
+    monkeypatch.setattr(ratelimit, "_limiters", {})
+    for name in MODEL_NAMES:
+        limiter = ratelimit.configure_rate_limiter(
+            model_name=name, requests_per_minute=10**9, tokens_per_minute=10**9
+        )
+        limiter.base_delay = 0.01
+
+
+@pytest.fixture
+def make_document(tmp_path) -> Callable[..., str]:
+    """
+    Saves a document of body paragraphs (and table rows), returning its path
+    """
+    def _make(
+        paragraphs: list[str], rows: list[list[str]] | None = None, name: str = "in.docx"
+    ) -> str:
+        document = Document()
+        for text in paragraphs:
+            document.add_paragraph(text)
+        if rows:
+            table = document.add_table(rows=len(rows), cols=len(rows[0]))
+            for row, texts in zip(table.rows, rows):
+                for cell, text in zip(row.cells, texts):
+                    cell.text = text
+        path = str(tmp_path / name)
+        document.save(path)
+        return path
+    return _make
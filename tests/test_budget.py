@@ -0,0 +1,52 @@
+"""
+Tests of the output token budgets and of truncated replies
+"""
+
+from weaver import metrics, word
+
+
+def generate(src_text: str) -> str | None:
+    """
+    Transformation of src_text with gpt-4o
+    """
+    return word.generate_transformation(
+        src_text=src_text, prompt="Translate", purpose="Test", model_name="gpt-4o"
+    )
+
+
+def test_output_budget_grows_with_the_text(monkeypatch):
+    """
+    Budgets leave room for the text to expand, up to MAX_OUTPUT_TOKENS
+    """
+    monkeypatch.setattr(word, "get_encoding", lambda model_name: None)
+    assert word.output_token_budget("x" * 40, "gpt-4o") == (
+        int(11 * word.OUTPUT_EXPANSION) + word.OUTPUT_OVERHEAD_TOKENS
+    )
+    assert word.output_token_budget("x" * 100_000, "gpt-4o") == word.MAX_OUTPUT_TOKENS
+
+
+def test_truncated_replies_are_retried_with_a_larger_budget(mock_llm):
+    """
+    A reply cut off at max_tokens is sent again with twice the budget, and
+    the wasted tokens are counted
+    """
+    mock_llm.transform = lambda text: text.upper() * 20
+    collector = metrics.WeaveMetrics()
+    with collector.activate():
+        assert generate("short text") == "SHORT TEXT" * 20
+    budgets = [body["max_tokens"] for body in mock_llm.requests]
+    assert len(budgets) >= 2
+    assert all(budget * 2 == larger for budget, larger in zip(budgets, budgets[1:]))
+    counters = collector.to_dict()["counters"]
+    assert counters["truncated_requests"] == len(budgets) - 1
+    assert counters["truncated_tokens"] > 0
+
+
+def test_truncated_at_the_largest_budget_fails(mock_llm, monkeypatch):
+    """
+    Once MAX_OUTPUT_TOKENS was tried, the transformation fails
+    """
+    monkeypatch.setattr(word, "MAX_OUTPUT_TOKENS", 64)
+    mock_llm.transform = lambda text: text * 100
+    assert generate("short text") is None
+    assert [body["max_tokens"] for body in mock_llm.requests][-1] == 64
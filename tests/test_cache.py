@@ -0,0 +1,111 @@
+"""
+Tests of the persistent transformation cache
+"""
+
+import types
+import pytest
+from weaver import cache as cache_module
+from weaver.cache import TransformCache
+from weaver.weaver import DocxWeaver
+
+
+@pytest.fixture(name="clock")
+def fixture_clock(monkeypatch) -> list[float]:
+    """
+    Time seen by the cache, moved forward by the tests
+    """
+    now = [1000.0]
+    monkeypatch.setattr(cache_module, "time", types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def put(cache: TransformCache, src_text: str):
+    """
+    Caches the upper case of src_text
+    """
+    cache.put(
+        model_name="gpt-4o", purpose="Test", prompt="P",
+        src_text=src_text, tgt_text=src_text.upper()
+    )
+
+
+def get(cache: TransformCache, src_text: str) -> str | None:
+    """
+    Cached transformation of src_text
+    """
+    return cache.get(model_name="gpt-4o", purpose="Test", prompt="P", src_text=src_text)
+
+
+def test_keys_cover_every_input():
+    """
+    Keys differ with any of model, purpose, prompt and text
+    """
+    key = TransformCache.make_key("gpt-4o", "Test", "P", "text")
+    assert key == TransformCache.make_key("gpt-4o", "Test", "P", "text")
+    for other in [("gpt-4-turbo", "Test", "P", "text"), ("gpt-4o", "Other", "P", "text"),
+                  ("gpt-4o", "Test", "Q", "text"), ("gpt-4o", "Test", "P", "Text")]:
+        assert TransformCache.make_key(*other) != key
+
+
+@pytest.mark.usefixtures("clock")
+def test_hits_and_misses(tmp_path):
+    """
+    Stored transformations are read back and counted
+    """
+    cache = TransformCache(str(tmp_path / "cache.sqlite"))
+    assert get(cache, "a") is None
+    put(cache, "a")
+    assert get(cache, "a") == "A"
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1}
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    """
+    Entries older than the ttl are neither read nor kept
+    """
+    cache = TransformCache(str(tmp_path / "cache.sqlite"), ttl=60)
+    put(cache, "a")
+    clock[0] += 59
+    assert get(cache, "a") == "A"
+    assert cache.contains(model_name="gpt-4o", purpose="Test", prompt="P", src_text="a")
+    clock[0] += 2
+    assert get(cache, "a") is None
+    assert not cache.contains(model_name="gpt-4o", purpose="Test", prompt="P", src_text="a")
+    cache.evict()
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    """
+    Past max_entries, the entries read or written longest ago go first
+    """
+    cache = TransformCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    for text in ["a", "b", "c"]:
+        put(cache, text)
+        clock[0] += 1
+    # Reading "a" makes "b" the least recently used
+    assert get(cache, "a") == "A"
+    cache.evict()
+    assert [get(cache, text) for text in ["a", "b", "c"]] == ["A", None, "C"]
+
+
+def test_cache_is_shared_between_instances(tmp_path):
+    """
+    Entries are stored in the file, for every process using it
+    """
+    path = str(tmp_path / "cache.sqlite")
+    put(TransformCache(path), "a")
+    assert get(TransformCache(path), "a") == "A"
+
+
+def test_second_weave_is_served_from_cache(mock_llm, make_document, tmp_path):
+    """
+    Weaving a document again sends nothing to the LLM
+    """
+    filename = make_document(["First clause", "Second clause"])
+    for ix in range(2):
+        DocxWeaver(
+            filename=filename, purpose="Test", paragraph_prompt="Translate", table_prompt=None,
+            mode="transform_only", cache_path=str(tmp_path / "cache.sqlite")
+        ).weave_document(output_fn=str(tmp_path / f"out{ix}.docx"))
+    assert mock_llm.texts() == ["First clause", "Second clause"]
@@ -0,0 +1,69 @@
+"""
+Tests of the docx-weaver command
+"""
+
+import json
+import os
+from docx import Document
+from weaver import cli
+
+ARGS = ["--mode", "transform_only", "--purpose", "Test", "--paragraph-prompt", "Translate"]
+
+
+def test_find_documents_skips_lock_files(tmp_path):
+    """
+    Directories and patterns expand to sorted .docx files, without Word's lock files
+    """
+    for name in ["b.docx", "a.docx", "~$a.docx", "notes.txt"]:
+        (tmp_path / name).write_bytes(b"")
+    assert cli.find_documents([str(tmp_path)]) == [
+        str(tmp_path / "a.docx"), str(tmp_path / "b.docx")
+    ]
+    assert cli.find_documents([str(tmp_path / "b*")]) == [str(tmp_path / "b.docx")]
+    assert cli.output_filename("in/a.docx", "out", "-fr") == os.path.join("out", "a-fr.docx")
+
+
+def test_weaves_a_folder_with_a_manifest(mock_llm, make_document, tmp_path):
+    """
+    Every document is woven by the worker pool, and recorded in the manifest
+    in input order; a broken document fails alone, with exit code 1
+    """
+    make_document(["First clause"], name="a.docx")
+    make_document(["Second clause"], name="b.docx")
+    (tmp_path / "c.docx").write_bytes(b"not a document")
+    output_dir = tmp_path / "out"
+    exit_code = cli.main([str(tmp_path), "--output-dir", str(output_dir), "--workers", "2", *ARGS])
+    assert exit_code == 1
+    with open(output_dir / "manifest.jsonl", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert [(os.path.basename(record["input"]), record["status"]) for record in records] == [
+        ("a.docx", "ok"), ("b.docx", "ok"), ("c.docx", "failed")
+    ]
+    assert records[0]["segments"]["unique"] == 1
+    assert Document(str(output_dir / "b-woven.docx")).paragraphs[0].text == "SECOND CLAUSE"
+    assert sorted(mock_llm.texts()) == ["First clause", "Second clause"]
+
+
+def test_documents_sharing_a_name_keep_their_paths(mock_llm, make_document, tmp_path):
+    """
+    Documents with the same name in different folders are woven to different
+    outputs, under their path relative to the folder holding them all
+    """
+    for folder, text in [("a", "First clause"), ("b", "Second clause")]:
+        (tmp_path / folder).mkdir()
+        make_document([text], name=os.path.join(folder, "x.docx"))
+    filenames = cli.find_documents([str(tmp_path / "*" / "x.docx")])
+    output_dir = tmp_path / "out"
+    assert cli.output_filenames(filenames, str(output_dir), "-woven") == [
+        str(output_dir / "a" / "x-woven.docx"), str(output_dir / "b" / "x-woven.docx")
+    ]
+    assert cli.output_filenames(filenames[:1], str(output_dir), "-woven") == [
+        str(output_dir / "x-woven.docx")
+    ]
+    exit_code = cli.main([
+        str(tmp_path / "*" / "x.docx"), "--output-dir", str(output_dir), "--workers", "2", *ARGS
+    ])
+    assert exit_code == 0
+    assert Document(str(output_dir / "a" / "x-woven.docx")).paragraphs[0].text == "FIRST CLAUSE"
+    assert Document(str(output_dir / "b" / "x-woven.docx")).paragraphs[0].text == "SECOND CLAUSE"
+    assert sorted(mock_llm.texts()) == ["First clause", "Second clause"]
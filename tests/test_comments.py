@@ -0,0 +1,86 @@
+"""
+Tests of the bulk writing of comments
+"""
+
+from docx import Document
+from docx.oxml.ns import qn
+from weaver import comments
+from weaver.weaver import DocxWeaver
+
+
+def comment_ids(paragraph, tag: str) -> list[str]:
+    """
+    Ids of the comment elements of a kind in a paragraph
+    """
+    return [
+        element.get(qn("w:id"))
+        for element in paragraph._p.iter(qn(tag))  # pylint: disable=protected-access
+    ]
+
+
+def comment_texts(document) -> list[str]:
+    """
+    Text of every comment of a document, in order
+    """
+    part = document.part._comments_part.element  # pylint: disable=protected-access
+    return [
+        "".join(t.text for t in comment.iter(qn("w:t")))
+        for comment in part.findall(qn("w:comment"))
+    ]
+
+
+def test_writer_matches_run_add_comment(make_document, tmp_path):
+    """
+    Queued comments get ids after those already in the document, and the same
+    range markers and reference as run.add_comment
+    """
+    document = Document(make_document(["First", "Second", "Third"]))
+    first, second, third = document.paragraphs
+    first.runs[0].add_comment("Existing", author=comments.COMMENT_AUTHOR)
+    writer = comments.CommentWriter()
+    comments.add_comment(second.runs[0], second.runs[0], "Queued 1", writer=writer)
+    comments.add_comment(third.runs[0], third.runs[0], "Queued 2", writer=writer)
+    assert len(writer) == 2
+    assert not comment_ids(second, "w:commentReference")
+    assert writer.flush() == 2
+    assert not writer
+    assert writer.flush() == 0
+
+    path = str(tmp_path / "out.docx")
+    document.save(path)
+    saved = Document(path)
+    for paragraph, comment_id in zip(saved.paragraphs, ["0", "1", "2"]):
+        for tag in ["w:commentRangeStart", "w:commentRangeEnd", "w:commentReference"]:
+            assert comment_ids(paragraph, tag) == [comment_id], tag
+    part = saved.part._comments_part.element  # pylint: disable=protected-access
+    written = part.findall(qn("w:comment"))
+    assert [comment.get(qn("w:id")) for comment in written] == ["0", "1", "2"]
+    assert comment_texts(saved) == ["Existing", "Queued 1", "Queued 2"]
+    assert {comment.get(qn("w:author")) for comment in written} == {comments.COMMENT_AUTHOR}
+
+
+def test_add_comment_without_writer_writes_at_once(make_document):
+    """
+    Without a writer, the comment is in the document on return
+    """
+    document = Document(make_document(["Only"]))
+    run = document.paragraphs[0].runs[0]
+    comments.add_comment(run, run, "Now")
+    assert comment_ids(document.paragraphs[0], "w:commentReference") == ["0"]
+
+
+def test_weave_comments_every_transformed_run(mock_llm, make_document, tmp_path):
+    """
+    In comments mode, runs keep their text and are commented with the reply
+    """
+    output_fn = str(tmp_path / "out.docx")
+    DocxWeaver(
+        filename=make_document(["Scope of works", "Deliverables"]), purpose="Test",
+        paragraph_prompt="Translate", table_prompt=None, mode="comments_only"
+    ).weave_document(output_fn=output_fn)
+    assert mock_llm.requests
+    document = Document(output_fn)
+    assert [paragraph.text for paragraph in document.paragraphs] == [
+        "Scope of works", "Deliverables"
+    ]
+    assert comment_texts(document) == ["SCOPE OF WORKS", "DELIVERABLES"]
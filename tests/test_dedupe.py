@@ -0,0 +1,48 @@
+"""
+Tests of the document-wide deduplication of segments
+"""
+
+from docx import Document
+from weaver import word
+from weaver.dedupe import SegmentIndex, prepare_segment
+from weaver.weaver import DocxWeaver
+
+
+def test_occurrences_share_their_normalized_key():
+    """
+    Outer punctuation is left out of the key and re-applied per occurrence
+    """
+    key, transforms_dict = prepare_segment("(Payment terms)", "Translate", "Test", "gpt-4o")
+    assert key == prepare_segment("Payment terms", "Translate", "Test", "gpt-4o")[0]
+    assert key.src_text == "Payment terms"
+    assert word.reapply_src_text_transforms("Conditions", transforms_dict) == "(Conditions)"
+    assert key != prepare_segment("Payment terms", "Summarize", "Test", "gpt-4o")[0]
+
+
+def test_index_stats():
+    """
+    Occurrences, unique segments and repeats are counted
+    """
+    index = SegmentIndex()
+    keys = [prepare_segment(text, "P", "Test", "gpt-4o")[0] for text in ["a b", "c d", "(a b)"]]
+    for key in keys:
+        index.add(key)
+    assert index.stats() == {"occurrences": 3, "unique": 2, "duplicates": 1, "max_repeats": 2}
+
+
+def test_repeated_segments_are_sent_once(mock_llm, make_document, tmp_path):
+    """
+    A segment repeated across the document costs one request, and each
+    occurrence keeps its own punctuation
+    """
+    filename = make_document(["Payment terms", "(Payment terms)", "Payment terms", "Scope of work"])
+    output_fn = str(tmp_path / "out.docx")
+    weave_result = DocxWeaver(
+        filename=filename, purpose="Test", paragraph_prompt="Translate", table_prompt=None,
+        mode="transform_only"
+    ).weave_document(output_fn=output_fn)
+    assert mock_llm.texts() == ["Payment terms", "Scope of work"]
+    assert [paragraph.text for paragraph in Document(output_fn).paragraphs] == [
+        "PAYMENT TERMS", "(PAYMENT TERMS)", "PAYMENT TERMS", "SCOPE OF WORK"
+    ]
+    assert weave_result["segments"]["duplicates"] == 2
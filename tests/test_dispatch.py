@@ -0,0 +1,91 @@
+"""
+Tests of the concurrent dispatch of transformations
+"""
+
+from docx import Document
+from weaver import dispatch, word
+from weaver.dedupe import SegmentKey
+from weaver.weaver import DocxWeaver
+
+PARAGRAPHS = [f"Clause {ix} of the agreement" for ix in range(12)]
+
+
+def make_keys(texts: list[str], prompt: str = "Translate") -> list[SegmentKey]:
+    """
+    Keys of texts sharing a prompt
+    """
+    return [SegmentKey("gpt-4o", "Test", prompt, text) for text in texts]
+
+
+def weave(filename: str, output_fn: str, **kwargs) -> list[str]:
+    """
+    Texts of the body paragraphs of a woven document
+    """
+    weaver = DocxWeaver(
+        filename=filename, purpose="Test", paragraph_prompt="Translate", table_prompt=None,
+        mode="transform_only", **kwargs
+    )
+    weaver.weave_document(output_fn=output_fn)
+    return [paragraph.text for paragraph in Document(output_fn).paragraphs]
+
+
+def test_generate_transformations_returns_every_key(mock_llm):
+    """
+    Every key gets its result, and on_result is called once for each
+    """
+    keys = make_keys(PARAGRAPHS)
+    completed = []
+    results = dispatch.generate_transformations(
+        keys=keys, concurrency=4, on_result=lambda key, _: completed.append(key)
+    )
+    assert results == {key: key.src_text.upper() for key in keys}
+    assert sorted(completed) == sorted(keys)
+    assert len(mock_llm.requests) == len(keys)
+
+
+def test_concurrent_weave_matches_sequential(mock_llm, make_document, tmp_path):
+    """
+    Weaving with concurrency gives the same document as weaving run by run
+    """
+    filename = make_document(PARAGRAPHS)
+    sequential = weave(filename, str(tmp_path / "sequential.docx"))
+    concurrent = weave(filename, str(tmp_path / "concurrent.docx"), concurrency=8)
+    assert concurrent == sequential == [text.upper() for text in PARAGRAPHS]
+    assert len(mock_llm.requests) == 2 * len(PARAGRAPHS)
+
+
+def test_pack_batches_stays_within_budget():
+    """
+    Batches keep document order and their token budget (a longer segment
+    gets a batch of its own)
+    """
+    keys = make_keys([f"segment number {ix}" for ix in range(20)] + ["word " * 200])
+    batches = dispatch.pack_batches(keys=keys, batch_tokens=30)
+    assert [key for batch in batches for key in batch] == keys
+    assert len(batches) > 1
+    for batch in batches:
+        tokens = sum(word.count_tokens(key.src_text, key.model_name) for key in batch)
+        assert tokens <= 30 or len(batch) == 1
+    assert batches[-1] == [keys[-1]]
+
+
+def test_pack_batches_groups_by_prompt():
+    """
+    Segments of different prompts never share a batch
+    """
+    keys = make_keys(["a", "b"], prompt="P") + make_keys(["c"], prompt="Q")
+    keys += make_keys(["d"], prompt="P")
+    batches = dispatch.pack_batches(keys=keys, batch_tokens=1000)
+    assert batches == [[keys[0], keys[1], keys[3]], [keys[2]]]
+
+
+def test_segments_missing_from_a_batch_are_retried_alone(mock_llm):
+    """
+    A batch reply leaving out a segment is completed by a single request
+    """
+    mock_llm.drop_last = True
+    keys = make_keys(["first", "second", "third"])
+    results = dispatch.generate_transformations(keys=keys, concurrency=1, batch_tokens=1000)
+    assert results == {key: key.src_text.upper() for key in keys}
+    assert len(mock_llm.requests) == 2
+    assert mock_llm.texts() == ["first", "second", "third", "third"]
@@ -0,0 +1,70 @@
+"""
+Tests of re-weaving revised documents from an earlier weave result
+"""
+
+import json
+from docx import Document
+from weaver import incremental
+from weaver.weaver import DocxWeaver
+
+
+def weave(filename: str, output_fn: str, **kwargs) -> dict:
+    """
+    Weave result of a document in transform_only mode
+    """
+    return DocxWeaver(
+        filename=filename, purpose="Test", paragraph_prompt="Translate", table_prompt="Translate",
+        mode="transform_only"
+    ).weave_document(output_fn=output_fn, **kwargs)
+
+
+def test_fingerprint_depends_on_the_context():
+    """
+    The same runs woven with another prompt, purpose or model are another unit
+    """
+    base = incremental.fingerprint(["a"], "Translate", "Test", "gpt-4o")
+    assert base == incremental.fingerprint(["a"], "Translate", "Test", "gpt-4o")
+    assert base != incremental.fingerprint(["a"], "Summarize", "Test", "gpt-4o")
+    assert base != incremental.fingerprint(["a"], "Translate", "Test", "gpt-4-turbo")
+    assert base != incremental.fingerprint(["a", ""], "Translate", "Test", "gpt-4o")
+
+
+def test_revision_only_sends_new_and_edited_paragraphs(mock_llm, make_document, tmp_path):
+    """
+    Unchanged paragraphs and cells reuse their outputs wherever they moved to
+    """
+    first = make_document(
+        ["Scope of work", "Payment terms", "Term of the agreement"], rows=[["Fees", "Total"]],
+        name="v1.docx"
+    )
+    previous = weave(first, str(tmp_path / "v1-woven.docx"))
+    previous_fn = str(tmp_path / "v1.json")
+    with open(previous_fn, "w", encoding="utf-8") as f:
+        json.dump(previous, f)
+
+    revised = make_document(
+        ["Payment terms", "Scope of works", "Term of the agreement"], rows=[["Fees", "Totals"]],
+        name="v2.docx"
+    )
+    for previous_result in [previous, previous_fn]:
+        mock_llm.reset()
+        output_fn = str(tmp_path / "v2-woven.docx")
+        result = weave(revised, output_fn, previous=previous_result)
+        assert sorted(mock_llm.texts()) == ["Scope of works", "Totals"]
+        assert [paragraph.text for paragraph in Document(output_fn).paragraphs] == [
+            "PAYMENT TERMS", "SCOPE OF WORKS", "TERM OF THE AGREEMENT"
+        ]
+        assert result["incremental"]["unchanged"] == 3
+        assert result["incremental"]["runs_reused"] == 3
+
+
+def test_table_results_can_be_reused(mock_llm, make_document, tmp_path):
+    """
+    A result with a table of runs is as good as a nested one
+    """
+    filename = make_document(["Scope of work", "Payment terms"])
+    previous = weave(filename, str(tmp_path / "first.docx"), results="table")
+    mock_llm.reset()
+    result = weave(filename, str(tmp_path / "second.docx"), previous=previous)
+    assert not mock_llm.requests
+    assert result["incremental"]["runs_reused"] == 2
@@ -0,0 +1,74 @@
+"""
+Tests of the progress journal and of resuming a weave from it
+"""
+
+import json
+from docx import Document
+from weaver.journal import Journal, load_journal
+from weaver.weaver import DocxWeaver
+
+PARAGRAPHS = ["Scope of work", "Payment terms", "Term of agreement", "Governing law"]
+
+
+def weave(filename: str, output_fn: str, journal_path: str, resume: bool = False) -> dict:
+    """
+    Weave result of a document in transform_only mode, journaled
+    """
+    return DocxWeaver(
+        filename=filename, purpose="Test", paragraph_prompt="Translate", table_prompt=None,
+        mode="transform_only"
+    ).weave_document(output_fn=output_fn, journal_path=journal_path, resume=resume)
+
+
+def test_truncated_lines_are_ignored_and_terminated(tmp_path):
+    """
+    A line cut short by a crash is skipped when loading, and entries appended
+    on resume start on a line of their own
+    """
+    path = str(tmp_path / "journal.jsonl")
+    journal = Journal(path)
+    journal.record(("paragraphs", "0", "runs", "0"), "hash0", "A")
+    journal.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"path": ["paragraphs", "1"')
+    assert load_journal(path) == {(("paragraphs", "0", "runs", "0"), "hash0"): "A"}
+
+    journal = Journal(path, resume=True)
+    journal.record(("paragraphs", "2", "runs", "0"), "hash2", "C")
+    journal.close()
+    assert load_journal(path) == {
+        (("paragraphs", "0", "runs", "0"), "hash0"): "A",
+        (("paragraphs", "2", "runs", "0"), "hash2"): "C",
+    }
+    assert not load_journal(str(tmp_path / "missing.jsonl"))
+
+
+def test_resumed_weave_replays_the_journal(mock_llm, make_document, tmp_path):
+    """
+    Runs journaled before the crash are replayed, only the others are sent again
+    """
+    filename = make_document(PARAGRAPHS)
+    journal_path = str(tmp_path / "out.docx.journal.jsonl")
+    result = weave(filename, str(tmp_path / "first.docx"), journal_path)
+    assert result["journal"]["recorded"] == len(PARAGRAPHS)
+
+    # Keep The First Two Entries And Half Of The Third, As If The Weave Crashed
+    with open(journal_path, encoding="utf-8") as f:
+        lines = f.readlines()
+    kept = {json.loads(line)["output"] for line in lines[:2]}
+    with open(journal_path, "w", encoding="utf-8") as f:
+        f.writelines(lines[:2])
+        f.write(lines[2][:10])
+
+    mock_llm.reset()
+    output_fn = str(tmp_path / "resumed.docx")
+    result = weave(filename, output_fn, journal_path, resume=True)
+    assert result["journal"]["replayed"] == 2
+    assert {text.upper() for text in mock_llm.texts()} | kept == {
+        text.upper() for text in PARAGRAPHS
+    }
+    assert len(mock_llm.texts()) == 2
+    assert [paragraph.text for paragraph in Document(output_fn).paragraphs] == [
+        text.upper() for text in PARAGRAPHS
+    ]
+    assert len(load_journal(journal_path)) == len(PARAGRAPHS)
@@ -0,0 +1,74 @@
+"""
+Tests of the performance metrics of a weave
+"""
+
+from types import SimpleNamespace
+from weaver import metrics
+from weaver.weaver import DocxWeaver
+
+
+def usage(prompt: int, completion: int, cached: int = 0) -> SimpleNamespace:
+    """
+    Completion usage as returned by the client
+    """
+    return SimpleNamespace(
+        prompt_tokens=prompt, completion_tokens=completion, total_tokens=prompt + completion,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=cached)
+    )
+
+
+def test_collector_records_spans_requests_and_counters():
+    """
+    Only the current collector records, spans also go to its hooks
+    """
+    spans = []
+    collector = metrics.WeaveMetrics(hooks=[spans.append])
+    with metrics.timed("outside"):
+        metrics.increment("ignored")
+    with collector.activate():
+        with metrics.timed("save", part="body"):
+            pass
+        with metrics.usage_scope() as scope:
+            metrics.record_request(0.3, "ok", usage=usage(10, 5, cached=4), model_name="gpt-4o")
+        metrics.record_request(120.0, "throttled")
+        metrics.increment("cache_hits", 2)
+    data = collector.to_dict()
+    assert [(span.name, span.attributes) for span in spans] == [("save", {"part": "body"})]
+    assert data["stages"]["save"]["calls"] == 1
+    assert data["requests"] == {
+        "attempts": 2, "ok": 1, "throttled": 1, "truncated": 0, "errors": 0
+    }
+    assert data["tokens"] == {"prompt": 10, "completion": 5, "total": 15, "cached": 4}
+    assert data["latency"]["buckets"]["0.5"] == 1 and data["latency"]["buckets"]["+Inf"] == 1
+    assert data["counters"] == {"cache_hits": 2}
+    assert data["models"]["gpt-4o"]["attempts"] == 1
+    assert scope == {"requests": 1, "latency": 0.3, "prompt_tokens": 10, "completion_tokens": 5}
+
+
+def test_merge_and_export():
+    """
+    Metrics of several weaves add up, and are exported in the Prometheus format
+    """
+    collector = metrics.WeaveMetrics()
+    with collector.activate():
+        metrics.record_request(1.0, "ok", usage=usage(10, 5), model_name="gpt-4o")
+    data = collector.to_dict()
+    merged = metrics.merge_metrics([data, data])
+    assert merged["requests"]["attempts"] == 2
+    assert merged["latency"]["sum"] == 2.0
+    assert merged["models"]["gpt-4o"]["prompt_tokens"] == 20
+    text = metrics.to_prometheus(merged, labels={"document": 'a "b"'})
+    assert 'docx_weaver_requests_total{document="a \\"b\\"",outcome="ok"} 2' in text
+
+
+def test_weave_result_has_metrics(mock_llm, make_document, tmp_path):
+    """
+    A weave reports its stages and one attempt per request sent
+    """
+    filename = make_document(["Scope of work", "Payment terms"])
+    result = DocxWeaver(
+        filename=filename, purpose="Test", paragraph_prompt="Translate", table_prompt=None,
+        mode="transform_only"
+    ).weave_document(output_fn=str(tmp_path / "out.docx"))
+    assert result["metrics"]["requests"]["ok"] == len(mock_llm.requests) == 2
+    assert {"cleanup_bad_runs", "save"} <= set(result["metrics"]["stages"])
@@ -0,0 +1,49 @@
+"""
+Tests of saving woven documents by copying their unchanged parts
+"""
+
+import zipfile
+from docx import Document
+from weaver import package
+
+
+def read_entries(filename: str) -> dict[str, bytes]:
+    """
+    Uncompressed content of every entry of a package
+    """
+    with zipfile.ZipFile(filename) as z:
+        assert z.testzip() is None
+        return {name: z.read(name) for name in z.namelist()}
+
+
+def test_unchanged_parts_are_copied(make_document, tmp_path):
+    """
+    Only the edited parts are compressed again, and the package holds the same
+    parts as one saved by python-docx
+    """
+    source_fn = make_document(["Scope of work"])
+    document = Document(source_fn)
+    document.paragraphs[0].text = "Edited"
+    output_fn = str(tmp_path / "out.docx")
+    stats = package.save_document(document, output_fn=output_fn, source_fn=source_fn)
+    expected_fn = str(tmp_path / "expected.docx")
+    document.save(expected_fn)
+
+    assert read_entries(output_fn) == read_entries(expected_fn)
+    assert Document(output_fn).paragraphs[0].text == "Edited"
+    assert stats["copied"] > 0 and stats["written"] >= 1
+    with zipfile.ZipFile(source_fn) as source, zipfile.ZipFile(output_fn) as output:
+        assert output.getinfo("word/document.xml").CRC != source.getinfo("word/document.xml").CRC
+        styles = source.getinfo("word/styles.xml"), output.getinfo("word/styles.xml")
+        assert styles[0].compress_size == styles[1].compress_size
+
+
+def test_saving_over_the_source_falls_back_to_document_save(make_document):
+    """
+    The source can't be copied from while it is being overwritten
+    """
+    source_fn = make_document(["Scope of work"])
+    document = Document(source_fn)
+    document.paragraphs[0].text = "Edited"
+    assert package.save_document(document, output_fn=source_fn, source_fn=source_fn) is None
+    assert Document(source_fn).paragraphs[0].text == "Edited"
@@ -0,0 +1,79 @@
+"""
+Tests of the dry-run planning of weaves
+"""
+
+import pytest
+from weaver import planning
+from weaver.weaver import DocxWeaver
+
+PARAGRAPHS = ["Scope of works", "Deliverables", "Scope of works", "12"]
+
+
+def make_weaver(filename: str, **kwargs) -> DocxWeaver:
+    """
+    Weaver transforming the paragraphs of a document
+    """
+    return DocxWeaver(
+        filename=filename, purpose="Test", paragraph_prompt="Translate", table_prompt=None,
+        mode="transform_only", **kwargs
+    )
+
+
+@pytest.mark.parametrize("batch_tokens", [None, 1000])
+def test_plan_counts_the_requests_of_the_weave(mock_llm, make_document, tmp_path, batch_tokens):
+    """
+    The plan sends nothing, and counts the segments and requests the weave then makes
+    """
+    filename = make_document(PARAGRAPHS)
+    plan = make_weaver(filename, batch_tokens=batch_tokens).plan(concurrency=2)
+    assert not mock_llm.requests
+    assert (plan["runs"], plan["skipped"], plan["segments"]) == (4, 1, 2)
+    assert plan["parts"] == {"paragraphs": {"runs": 4, "skipped": 1, "segments": 2}}
+    assert plan["requests"] == (2 if batch_tokens is None else 1)
+    model = plan["models"]["gpt-4o"]
+    assert (model["requests"], model["segments"]) == (plan["requests"], 2)
+    assert model["reserved_tokens"] > model["prompt_tokens"] > 0
+    assert plan["wall_time"]["bound"] == "latency"
+
+    make_weaver(filename, batch_tokens=batch_tokens).weave_document(
+        output_fn=str(tmp_path / "out.docx")
+    )
+    assert len(mock_llm.requests) == plan["requests"]
+    assert sorted(mock_llm.texts()) == ["Deliverables", "Scope of works"]
+
+
+def test_wall_time_is_bound_by_the_tightest_budget():
+    """
+    A per-minute budget exceeded bounds the duration beyond the free first minute
+    """
+    models = {"gpt-4o": {"requests": 120, "reserved_tokens": 1000, "request_seconds": 60.0}}
+    wall_time = planning.project_wall_time(
+        models, concurrency=4, requests_per_minute={"gpt-4o": 40},
+        tokens_per_minute={"gpt-4o": 10**6}
+    )
+    assert wall_time["bound"] == "gpt-4o:requests"
+    assert wall_time["seconds"] == 120.0
+    assert wall_time["bounds"]["latency"] == 15.0
+    assert wall_time["bounds"]["gpt-4o:tokens"] == 0.0
+
+
+def test_merge_plans_sums_documents(make_document):
+    """
+    Counts of several documents add up, and share the wall time projection
+    """
+    plans = [
+        make_weaver(make_document(PARAGRAPHS, name=name)).plan(concurrency=1)
+        for name in ["a.docx", "b.docx"]
+    ]
+    merged = planning.merge_plans(
+        plans, concurrency=2, requests_per_minute={}, tokens_per_minute={}
+    )
+    assert merged["documents"] == 2
+    assert (merged["runs"], merged["segments"], merged["requests"]) == (8, 4, 4)
+    assert merged["parts"]["paragraphs"] == {"runs": 8, "skipped": 2, "segments": 4}
+    model = merged["models"]["gpt-4o"]
+    assert model["prompt_tokens"] == 2 * plans[0]["models"]["gpt-4o"]["prompt_tokens"]
+    assert model["cost"] == pytest.approx(2 * plans[0]["models"]["gpt-4o"]["cost"])
+    assert merged["wall_time"]["bounds"]["latency"] == pytest.approx(
+        plans[0]["wall_time"]["bounds"]["latency"], abs=1e-3
+    )
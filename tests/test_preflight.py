@@ -0,0 +1,49 @@
+"""
+Tests of the pre-flight classification of segments
+"""
+
+import copy
+from weaver import preflight, word
+
+TEXTS = [
+    "Scope of work", "  Payment terms\t", "12", "(1)", "A", "Acme Inc.", "ACME LTD. and partners",
+    "SUMMARY OF FINDINGS", "one two three four five", "\"Quoted text\"", "(Payment terms)",
+    "Deliverables:", "Notes;", "US$ 100 MILLION", "\nNew line", "Price: US$ 5", "étude détaillée",
+    "<s1>Net </s1><s2>revenue</s2>", "<s1>1</s1><s2>2</s2>", "", "\xa0",
+]
+
+
+def test_compiled_rules_match_the_per_run_checks():
+    """
+    Texts prepared one by one with the compiled rules get the same skip and
+    preparation as with the per-run checks
+    """
+    expected = {
+        text: None if word.check_formats_not_to_translate(copy.deepcopy(text))
+        else word.parse_and_prepare_src_text_transforms(text)
+        for text in TEXTS
+    }
+    assert preflight.prepare_segments(TEXTS) == expected
+    assert expected["12"] is None and expected["Acme Inc."] is None
+    assert expected["<s1>1</s1><s2>2</s2>"] is None
+    assert expected["SUMMARY OF FINDINGS"][0] == "summary of findings"
+
+
+def test_column_wise_preparation_matches_the_default_path():
+    """
+    Texts classified with pandas get the same skip and preparation as prepare_segments
+    """
+    frame = preflight.classify_segments(TEXTS + TEXTS[:3])
+    assert len(frame) == len(TEXTS) + 3
+    assert preflight.frame_segments(frame) == preflight.prepare_segments(TEXTS)
+
+
+def test_preflight_stats():
+    """
+    Skipped runs are counted per occurrence
+    """
+    texts = ["Scope of work", "12", "12", "Scope of work"]
+    assert preflight.preflight_stats(texts, preflight.prepare_segments(texts)) == {
+        "runs": 4, "skipped": 2, "skip_rate": 0.5
+    }
+    assert preflight.preflight_stats([], {})["skip_rate"] == 0.0
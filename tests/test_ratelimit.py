@@ -0,0 +1,227 @@
+"""
+Tests of the shared rate limiter and retry scheduling
+"""
+
+from types import SimpleNamespace
+from typing import Callable
+import time
+import pytest
+from weaver import ratelimit, word
+
+
+def generate(src_text: str = "some text") -> str | None:
+    """
+    Transformation of src_text through the shared gpt-4o limiter
+    """
+    return word.generate_transformation(
+        src_text=src_text, prompt="Translate", purpose="Test", model_name="gpt-4o"
+    )
+
+
+def test_token_bucket_waits_for_overdrafts():
+    """
+    Reservations within the budget are free, overdrafts wait for the refill
+    """
+    bucket = ratelimit.TokenBucket(per_minute=60)
+    now = bucket.updated
+    assert bucket.reserve(60, now) == 0.0
+    assert bucket.reserve(30, now) == pytest.approx(30.0)
+    # A Minute Later The Debt Is Paid And The Bucket Full Again
+    assert bucket.reserve(0, now + 90) == 0.0
+    assert bucket.level == pytest.approx(60.0)
+
+
+@pytest.mark.parametrize("value, seconds", [
+    ("1s", 1.0), ("6m0s", 360.0), ("20ms", 0.02), ("1h2m", 3720.0), ("", None), ("soon", None)
+])
+def test_parse_reset(value, seconds):
+    """
+    Reset durations of the rate-limit headers
+    """
+    assert ratelimit.parse_reset(value) == seconds
+
+
+def test_parse_retry_after_prefers_milliseconds():
+    """
+    retry-after-ms wins over retry-after, unparsable values are ignored
+    """
+    assert ratelimit.parse_retry_after({"retry-after-ms": "250", "retry-after": "3"}) == 0.25
+    assert ratelimit.parse_retry_after({"retry-after": "3"}) == 3.0
+    assert ratelimit.parse_retry_after({"retry-after": "later"}) is None
+    assert ratelimit.parse_retry_after(None) is None
+
+
+def test_throttling_halves_concurrency_then_grows_it_back(mock_llm):
+    """
+    Every throttled attempt halves the requests in flight (AIMD), each
+    success adds to it, and the request is retried until it goes through
+    """
+    mock_llm.fail = 2
+    mock_llm.status = 429
+    limiter = ratelimit.get_rate_limiter("gpt-4o")
+    limiter.configure(requests_per_minute=10**9, tokens_per_minute=10**9, max_concurrency=64)
+    assert generate() == "SOME TEXT"
+    stats = limiter.stats()
+    assert (stats["throttled"], stats["retried"], stats["requests"]) == (2, 2, 3)
+    assert stats["concurrency"] == pytest.approx(16 + 1 / 16, abs=0.01)
+
+
+def test_server_errors_are_retried_up_to_max_attempts(mock_llm):
+    """
+    Server errors are retried, and the request fails (None) once out of attempts
+    """
+    mock_llm.fail = 10
+    limiter = ratelimit.get_rate_limiter("gpt-4o")
+    limiter.max_attempts = 3
+    assert generate() is None
+    assert limiter.stats()["failed"] == 1
+    assert len(mock_llm.requests) == 3
+
+
+def test_client_errors_are_not_retried(mock_llm):
+    """
+    Errors of the request itself (4xx other than 408/409/429) fail at once
+    """
+    mock_llm.fail = 1
+    mock_llm.status = 400
+    assert generate() is None
+    assert len(mock_llm.requests) == 1
+    assert ratelimit.get_rate_limiter("gpt-4o").stats()["retried"] == 0
+
+
+def test_limiters_are_shared_and_reconfigured_in_place():
+    """
+    One limiter per model, keeping its counters when configured again
+    """
+    limiter = ratelimit.get_rate_limiter("gpt-4o")
+    limiter.counts["requests"] = 5
+    configured = ratelimit.configure_rate_limiter(
+        model_name="gpt-4o", requests_per_minute=10, tokens_per_minute=1000, max_concurrency=4
+    )
+    assert configured is limiter
+    assert limiter.requests_bucket.capacity == 10.0
+    assert limiter.stats()["requests"] == 5
+    assert limiter.stats()["concurrency"] == 4
+    assert set(ratelimit.rate_limit_stats()) >= {"gpt-4o"}
+
+
+def fake_raw(text: str, total_tokens: int | None = None) -> SimpleNamespace:
+    """
+    Raw response of a fake request, parsing to a completion of text (with
+    usage if total_tokens is given)
+    """
+    usage = None if total_tokens is None else SimpleNamespace(total_tokens=total_tokens)
+    return SimpleNamespace(headers={}, parse=lambda: SimpleNamespace(text=text, usage=usage))
+
+
+def hedged_limiter(hedge_budget: float) -> ratelimit.RateLimiter:
+    """
+    Limiter hedging past the median of 20 fast latencies
+    """
+    limiter = ratelimit.configure_rate_limiter(
+        model_name="gpt-4o", requests_per_minute=10**9, tokens_per_minute=10**9,
+        request_timeout=5.0, hedge_quantile=0.5, hedge_budget=hedge_budget
+    )
+    limiter.latencies.extend([0.01] * ratelimit.HEDGE_MIN_SAMPLES)
+    return limiter
+
+
+def slow_then_fast(
+    calls: list[dict], total_tokens: int | None = None
+) -> Callable[..., SimpleNamespace]:
+    """
+    Request taking 1s the first time and replying at once after that
+    """
+    def request_fn(**kwargs) -> SimpleNamespace:
+        calls.append(kwargs)
+        if len(calls) == 1:
+            time.sleep(1.0)
+            return fake_raw("primary", total_tokens)
+        return fake_raw("hedge", total_tokens)
+    return request_fn
+
+
+@pytest.fixture(name="frozen_clock")
+def fixture_frozen_clock(monkeypatch):
+    """
+    Token buckets of the limiters never refill during the test
+    """
+    monkeypatch.setattr(ratelimit, "time", SimpleNamespace(
+        monotonic=lambda: 0.0, perf_counter=time.perf_counter, sleep=time.sleep
+    ))
+
+
+def budget_limiter(max_concurrency: int) -> ratelimit.RateLimiter:
+    """
+    Hedging limiter with 1000 tokens per minute
+    """
+    limiter = ratelimit.RateLimiter(
+        requests_per_minute=1000, tokens_per_minute=1000, max_concurrency=max_concurrency,
+        request_timeout=5.0, hedge_quantile=0.5, hedge_budget=1.0
+    )
+    limiter.latencies.extend([0.01] * ratelimit.HEDGE_MIN_SAMPLES)
+    return limiter
+
+
+def test_slow_requests_are_hedged():
+    """
+    A request pending past the latency quantile is duplicated, and the first
+    response wins
+    """
+    limiter = hedged_limiter(hedge_budget=1.0)
+    calls: list[dict] = []
+    start = time.perf_counter()
+    result = limiter.call(
+        request_fn=slow_then_fast(calls), parse_fn=lambda completion: completion.text, tokens=1
+    )
+    assert result == "hedge"
+    assert time.perf_counter() - start < 0.9
+    assert calls == [{"timeout": 5.0}] * 2
+    assert (limiter.stats()["hedged"], limiter.stats()["hedge_wins"]) == (1, 1)
+
+
+def test_hedges_are_capped_by_their_budget():
+    """
+    Without hedge budget left, the slow request is simply awaited
+    """
+    limiter = hedged_limiter(hedge_budget=0.0)
+    calls: list[dict] = []
+    result = limiter.call(
+        request_fn=slow_then_fast(calls), parse_fn=lambda completion: completion.text, tokens=1
+    )
+    assert result == "primary"
+    assert len(calls) == 1
+    assert limiter.stats()["hedged"] == 0
+
+
+@pytest.mark.usefixtures("frozen_clock")
+def test_refused_hedges_take_no_budget():
+    """
+    A hedge refused for want of a slot leaves the buckets as the primary left them
+    """
+    limiter = budget_limiter(max_concurrency=1)
+    result = limiter.call(
+        request_fn=slow_then_fast([]), parse_fn=lambda completion: completion.text, tokens=900
+    )
+    assert result == "primary"
+    assert limiter.stats()["hedged"] == 0
+    assert (limiter.requests_bucket.level, limiter.tokens_bucket.level) == (999.0, 100.0)
+
+
+@pytest.mark.usefixtures("frozen_clock")
+def test_hedge_losers_keep_their_slot_and_refund_their_tokens():
+    """
+    The losing primary holds its slot until it is done, then both requests
+    got back what they reserved but did not use
+    """
+    limiter = budget_limiter(max_concurrency=2)
+    result = limiter.call(
+        request_fn=slow_then_fast([], total_tokens=10),
+        parse_fn=lambda completion: completion.text, tokens=100
+    )
+    assert result == "hedge"
+    assert limiter.in_flight == 1
+    assert limiter.tokens_bucket.level == 890.0
+    time.sleep(1.2)
+    assert limiter.in_flight == 0
+    assert limiter.tokens_bucket.level == 980.0
@@ -0,0 +1,55 @@
+"""
+Tests of the columnar weave results
+"""
+
+import pytest
+from weaver import incremental
+from weaver.results import RESULT_COLUMNS, ResultTable
+from weaver.weaver import DocxWeaver
+
+
+def test_rows_default_their_usage():
+    """
+    Rows are appended column-wise, with zero cost unless given
+    """
+    table = ResultTable()
+    table.append(
+        path="paragraphs/0/runs/0", part="body", unit="paragraphs/0", fingerprint="f",
+        original="a", translation="A", output="A", translated=True, requests=1, latency=0.5
+    )
+    assert len(table) == 1
+    row = next(iter(table))
+    assert list(row) == RESULT_COLUMNS
+    assert (row["requests"], row["prompt_tokens"]) == (1, 0)
+    with pytest.raises(KeyError):
+        table.append(path="paragraphs/1/runs/0")
+
+
+def test_table_results_of_a_weave(mock_llm, make_document, tmp_path):
+    """
+    One row per run in document order, convertible to a DataFrame
+    """
+    filename = make_document(["Scope of work", "Payment terms", "12"])
+    result = DocxWeaver(
+        filename=filename, purpose="Test", paragraph_prompt="Translate", table_prompt=None,
+        mode="transform_only"
+    ).weave_document(output_fn=str(tmp_path / "out.docx"), results="table")
+    table = result["runs"]
+    assert isinstance(table, ResultTable)
+    frame = table.to_frame()
+    assert frame["path"].tolist() == [f"paragraphs/{ix}/runs/0" for ix in range(3)]
+    assert frame["translated"].tolist() == [True, True, False]
+    assert frame["translation"].tolist()[:2] == ["SCOPE OF WORK", "PAYMENT TERMS"]
+    assert frame["requests"].sum() == len(mock_llm.requests)
+
+
+def test_parquet_round_trip(tmp_path):
+    """
+    Tables written to Parquet are read back as previous results
+    """
+    pytest.importorskip("pyarrow")
+    table = ResultTable()
+    table.append(**{name: "x" for name in RESULT_COLUMNS if name != "translated"}, translated=True)
+    path = str(tmp_path / "runs.parquet")
+    table.to_parquet(path)
+    assert incremental.load_previous(path)["runs"]["translated"].tolist() == [True]
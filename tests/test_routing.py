@@ -0,0 +1,74 @@
+"""
+Tests of the routing of simple segments to a fast model
+"""
+
+from docx import Document
+from weaver import routing
+from weaver.dedupe import SegmentKey
+from weaver.weaver import DocxWeaver
+
+LONG_PARAGRAPH = (
+    "The supplier shall deliver the services described in the statement of work within the "
+    "agreed timeline and report on their progress every month"
+)
+
+
+def test_simple_segments_are_routed_to_the_fast_model():
+    """
+    Short segments (longer ones in tables and headers/footers) go to the fast
+    model first, unless one of their occurrences is not simple
+    """
+    router = routing.ModelRouter(model_name="gpt-4o", fast_model_name="gpt-3.5-turbo")
+    assert router.is_simple("Scope of work", "body", in_table=False)
+    assert router.is_simple("12.5% - 2024", "body", in_table=False)
+    assert not router.is_simple(LONG_PARAGRAPH, "body", in_table=False)
+    assert not router.is_simple("<s1>Net </s1><s2>revenue</s2>", "body", in_table=False)
+    heading, long = [
+        SegmentKey("gpt-4o", "Test", "Translate", text) for text in ["Scope", LONG_PARAGRAPH]
+    ]
+    router.add(heading, "body", in_table=False)
+    router.add(long, "body", in_table=False)
+    assert router.cascade(heading) == ["gpt-3.5-turbo", "gpt-4o"]
+    assert router.cascade(long) == ["gpt-4o"]
+    assert router.stats()["fast_share"] == 0.5
+
+
+def test_invalid_fast_replies_escalate(mock_llm, make_document, tmp_path):
+    """
+    A fast model reply failing validation is not retried but escalated to the configured model
+    """
+    mock_llm.invalid_models = {"gpt-3.5-turbo"}
+    filename = make_document(["Scope of work", LONG_PARAGRAPH])
+    output_fn = str(tmp_path / "out.docx")
+    result = DocxWeaver(
+        filename=filename, purpose="Test", paragraph_prompt="Translate", table_prompt=None,
+        mode="transform_only", fast_model_name="gpt-3.5-turbo"
+    ).weave_document(output_fn=output_fn)
+    assert [body["model"] for body in mock_llm.requests].count("gpt-3.5-turbo") == 1
+    assert [body["model"] for body in mock_llm.requests].count("gpt-4o") == 2
+    assert [paragraph.text for paragraph in Document(output_fn).paragraphs] == [
+        "SCOPE OF WORK", LONG_PARAGRAPH.upper()
+    ]
+    assert result["routing"]["fast_segments"] == 1
+    assert result["metrics"]["counters"]["escalations"] == 1
+
+
+def test_model_report():
+    """
+    Shares, latency, throughput and cost per model
+    """
+    models = {
+        "gpt-4o": {
+            "attempts": 3, "ok": 3, "seconds": 3.0, "prompt_tokens": 1_000_000,
+            "completion_tokens": 300
+        },
+        "local": {
+            "attempts": 1, "ok": 1, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0
+        },
+    }
+    report = routing.model_report(models, prices={"gpt-4o": (5.0, 15.0)})
+    assert report["gpt-4o"] == {
+        "calls": 3, "call_share": 0.75, "mean_latency": 1.0, "tokens_per_second": 100.0,
+        "cost": 5.0045
+    }
+    assert report["local"]["cost"] is None and report["local"]["tokens_per_second"] == 0.0
@@ -0,0 +1,89 @@
+"""
+Tests of the schedulers of the transformation work queue
+"""
+
+import pytest
+from weaver import dispatch, scheduling
+from weaver.dedupe import SegmentKey
+
+# Short runs, then a long clause near the end, in document order
+TEXTS = ["Title", "Scope of works", "Term", "Notice " * 40, "Signature"]
+
+
+def make_batches(texts: list[str]) -> list[list[SegmentKey]]:
+    """
+    One batch of one segment per text
+    """
+    return [[SegmentKey("gpt-4o", "Test", "Translate", text)] for text in texts]
+
+
+def batch_texts(batches: list[list[SegmentKey]]) -> list[str]:
+    """
+    Text of the first segment of each batch
+    """
+    return [batch[0].src_text for batch in batches]
+
+
+@pytest.mark.parametrize("schedule", list(scheduling.SCHEDULERS))
+def test_schedulers_reorder_every_batch(schedule):
+    """
+    Every scheduler returns each batch once, without changing the list it is given
+    """
+    batches = make_batches(TEXTS)
+    ordered = scheduling.get_scheduler(schedule)(batches, 2)
+    assert sorted(batch_texts(ordered)) == sorted(TEXTS)
+    assert batch_texts(batches) == TEXTS
+
+
+def test_fifo_keeps_document_order():
+    """
+    fifo sends the batches as they come
+    """
+    assert batch_texts(scheduling.schedule_fifo(make_batches(TEXTS), 2)) == TEXTS
+
+
+def test_lpt_sends_longest_first():
+    """
+    lpt sends the long clause first, ties keeping their document order
+    """
+    ordered = batch_texts(scheduling.schedule_lpt(make_batches(TEXTS), 2))
+    assert ordered[0] == TEXTS[3]
+    assert ordered.index("Title") < ordered.index("Term")
+    tokens = [
+        scheduling.estimate_output_tokens(batch)
+        for batch in scheduling.schedule_lpt(make_batches(TEXTS), 2)
+    ]
+    assert tokens == sorted(tokens, reverse=True)
+
+
+def test_deadline_moves_long_clauses_forward_only():
+    """
+    deadline starts the long clause early, but keeps the first short runs ahead of it
+    """
+    ordered = batch_texts(scheduling.schedule_deadline(make_batches(TEXTS), 2))
+    assert ordered[0] == "Title"
+    assert ordered.index(TEXTS[3]) < ordered.index("Term")
+    assert ordered[-1] == "Signature"
+
+
+def test_get_scheduler_accepts_callables():
+    """
+    Callables are used as is, and unknown names are rejected
+    """
+    assert scheduling.get_scheduler(scheduling.schedule_lpt) is scheduling.schedule_lpt
+    assert scheduling.get_scheduler("deadline") is scheduling.schedule_deadline
+    with pytest.raises(AssertionError):
+        scheduling.get_scheduler("random")
+
+
+@pytest.mark.parametrize("schedule", list(scheduling.SCHEDULERS))
+def test_dispatch_sends_in_schedule_order(mock_llm, schedule):
+    """
+    With one worker, requests are sent in the scheduled order and every
+    segment gets its result
+    """
+    keys = [batch[0] for batch in make_batches(TEXTS)]
+    results = dispatch.generate_transformations(keys=keys, concurrency=1, schedule=schedule)
+    assert {key.src_text: results[key] for key in keys} == {text: text.upper() for text in TEXTS}
+    expected = batch_texts(scheduling.SCHEDULERS[schedule](make_batches(TEXTS), 1))
+    assert mock_llm.texts() == expected
@@ -0,0 +1,138 @@
+"""
+Tests of the local weave service and its HTTP API
+"""
+
+from http.client import HTTPConnection
+from urllib.parse import urlencode
+import json
+import os
+import queue
+import threading
+import time
+import pytest
+from docx import Document
+from weaver.server import PLACEHOLDER_API_KEY, WeaveServer, WeaveService, use_endpoint
+
+PARAMS = {"mode": "transform_only", "purpose": "Test", "paragraph_prompt": "Translate"}
+
+
+@pytest.fixture(name="service")
+def fixture_service(tmp_path):
+    """
+    Service with one worker and room for one queued job
+    """
+    service = WeaveService(work_dir=str(tmp_path / "jobs"), workers=1, queue_size=1)
+    yield service
+    service.close()
+
+
+def wait_for(service: WeaveService, job_id: str, statuses: list[str]) -> dict:
+    """
+    Job once it reaches one of statuses
+    """
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        job = service.get(job_id)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.01)
+    raise TimeoutError(job_id)
+
+
+@pytest.mark.parametrize("params", [
+    {**PARAMS, "color": "red"},
+    {**PARAMS, "mode": "rewrite"},
+    {"mode": "transform_only", "purpose": "Test"},
+    {**PARAMS, "model": "gpt-5"},
+    {**PARAMS, "fast_model": "gpt-5"},
+    {**PARAMS, "granularity": "sentence"},
+    {**PARAMS, "schedule": "random"},
+    {**PARAMS, "concurrency": "0"},
+    {**PARAMS, "batch_tokens": "many"},
+])
+def test_submit_rejects_invalid_parameters(service, make_document, params):
+    """
+    Invalid jobs are refused before anything is queued
+    """
+    with open(make_document(["Scope of work"]), "rb") as f:
+        data = f.read()
+    with pytest.raises(ValueError):
+        service.submit(data, params)
+    with pytest.raises(ValueError):
+        service.submit(b"not a docx", PARAMS)
+    assert not service.jobs
+
+
+def test_submissions_beyond_the_queue_are_refused(service, mock_llm, make_document):
+    """
+    With the worker busy and the queue full, jobs are refused and forgotten
+    """
+    mock_llm.delay = 0.3
+    with open(make_document(["Scope of work"]), "rb") as f:
+        data = f.read()
+    running = service.submit(data, PARAMS)
+    wait_for(service, running["id"], ["running"])
+    queued = service.submit(data, PARAMS)
+    with pytest.raises(queue.Full):
+        service.submit(data, PARAMS)
+    assert set(service.jobs) == {running["id"], queued["id"]}
+    assert not service.remove(queued["id"])
+    assert wait_for(service, queued["id"], ["done", "failed"])["status"] == "done"
+    assert service.stats()["done"] == 2
+
+
+def test_http_api(service, mock_llm, make_document, tmp_path):
+    """
+    Upload, poll, download and delete a job over HTTP
+    """
+    server = WeaveServer(("127.0.0.1", 0), service)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    connection = HTTPConnection("127.0.0.1", server.server_address[1], timeout=10)
+
+    def request(method: str, path: str, body: bytes | None = None) -> tuple[int, bytes]:
+        connection.request(method, path, body=body)
+        response = connection.getresponse()
+        return response.status, response.read()
+
+    try:
+        with open(make_document(["Scope of work"]), "rb") as f:
+            status, body = request("POST", f"/jobs?{urlencode(PARAMS)}", f.read())
+        assert status == 202
+        job_id = json.loads(body)["id"]
+        job = wait_for(service, job_id, ["done", "failed"])
+        assert job["status"] == "done" and len(mock_llm.requests) == 1
+
+        status, body = request("GET", f"/jobs/{job_id}")
+        assert status == 200 and json.loads(body)["status"] == "done"
+        status, body = request("GET", f"/jobs/{job_id}/output")
+        output_fn = tmp_path / "out.docx"
+        output_fn.write_bytes(body)
+        assert status == 200
+        assert Document(str(output_fn)).paragraphs[0].text == "SCOPE OF WORK"
+        assert request("GET", "/health")[0] == 200
+        assert request("POST", "/jobs?mode=rewrite", b"PK")[0] == 400
+        assert request("DELETE", f"/jobs/{job_id}")[0] == 200
+        assert request("GET", f"/jobs/{job_id}")[0] == 404
+    finally:
+        connection.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_mock_endpoint_needs_no_api_key(monkeypatch, mock_llm, make_document, tmp_path):
+    """
+    With a base URL and no OpenAI key, a placeholder key lets the service
+    start and weave against the endpoint
+    """
+    monkeypatch.delenv("OPENAI_API_KEY")
+    monkeypatch.setenv("OPENAI_BASE_URL", os.environ["OPENAI_BASE_URL"])
+    use_endpoint(os.environ["OPENAI_BASE_URL"])
+    assert os.environ["OPENAI_API_KEY"] == PLACEHOLDER_API_KEY
+    service = WeaveService(work_dir=str(tmp_path / "jobs"), workers=1, queue_size=1)
+    try:
+        with open(make_document(["Scope of work"]), "rb") as f:
+            job = service.submit(f.read(), PARAMS)
+        assert wait_for(service, job["id"], ["done", "failed"])["status"] == "done"
+    finally:
+        service.close()
+    assert mock_llm.texts() == ["Scope of work"]
@@ -0,0 +1,79 @@
+"""
+Tests of streamed weaves
+"""
+
+import os
+import time
+import pytest
+from weaver.weaver import DocxWeaver
+
+# Clauses growing longer towards the end of the document
+PARAGRAPHS = [f"Clause {ix}: " + "term " * (4 * ix) for ix in range(1, 21)]
+
+
+@pytest.fixture(name="weaver")
+def fixture_weaver(make_document) -> DocxWeaver:
+    """
+    Weaver of the clauses, two requests at a time
+    """
+    return DocxWeaver(
+        filename=make_document(PARAGRAPHS), purpose="Test", paragraph_prompt="Translate",
+        table_prompt=None, mode="transform_only", concurrency=2
+    )
+
+
+def test_runs_stream_in_document_order(mock_llm, weaver, tmp_path):
+    """
+    Run events come in document order, then the result once the output is saved
+    """
+    output_fn = str(tmp_path / "out.docx")
+    events = list(weaver.stream_document(output_fn=output_fn, save_interval=None))
+    runs = [event for event in events if event["event"] == "run"]
+    assert [event["path"] for event in runs] == [
+        f"paragraphs/{ix}/runs/0" for ix in range(len(PARAGRAPHS))
+    ]
+    assert all(event["translated"] for event in runs)
+    assert [event["elapsed"] for event in runs] == sorted(event["elapsed"] for event in runs)
+    assert events[-1]["event"] == "done"
+    assert "runs" not in events[-1]
+    assert os.path.exists(output_fn)
+    assert len(mock_llm.requests) == len(PARAGRAPHS)
+
+
+@pytest.mark.parametrize("schedule, first_sent", [
+    ("deadline", {"Clause 1", "Clause 2"}), ("lpt", {"Clause 20", "Clause 19"})
+])
+def test_first_run_comes_back_early(mock_llm, weaver, tmp_path, schedule, first_sent):
+    """
+    Streams send the start of the document first by default (lpt, the
+    weaver's schedule, sends it last), so the first run is out after a few requests
+    """
+    mock_llm.delay = 0.05
+    stream = weaver.stream_document(output_fn=str(tmp_path / "out.docx"), schedule=schedule)
+    sent = None
+    for event in stream:
+        if event["event"] == "run" and sent is None:
+            sent = len(mock_llm.requests)
+    # The Two Workers Send Their First Requests Together
+    assert {text.split(":")[0] for text in mock_llm.texts()[:2]} == first_sent
+    if schedule == "deadline":
+        assert sent <= 4
+    else:
+        assert sent >= len(PARAGRAPHS) - 2
+
+
+def test_closing_the_stream_cancels_the_weave(mock_llm, weaver, tmp_path):
+    """
+    Leaving the loop early stops sending requests (those in flight complete),
+    and the output is never saved
+    """
+    mock_llm.delay = 0.05
+    output_fn = str(tmp_path / "out.docx")
+    for event in weaver.stream_document(output_fn=output_fn):
+        assert event["event"] == "run"
+        break
+    sent = len(mock_llm.requests)
+    assert sent < len(PARAGRAPHS)
+    time.sleep(0.2)
+    assert len(mock_llm.requests) == sent
+    assert not os.path.exists(output_fn)
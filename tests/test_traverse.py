@@ -0,0 +1,129 @@
+"""
+Tests of the single-pass traversal of the document's stories
+"""
+
+import copy
+import zipfile
+import pytest
+from docx import Document
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from weaver import traverse
+from weaver.weaver import DocxWeaver
+
+HEADER_FOOTERS = [
+    "header", "footer", "first_page_header", "first_page_footer",
+    "even_page_header", "even_page_footer"
+]
+
+
+def add_page_field(paragraph):
+    """
+    Appends a PAGE field (begin, instruction, separate, "0", end runs) to a paragraph
+    """
+    for kind, text in [("begin", None), (None, " PAGE "), ("separate", None), (None, "0"),
+                       ("end", None)]:
+        run = paragraph.add_run()
+        if kind is not None:
+            fld_char = OxmlElement("w:fldChar")
+            fld_char.set(qn("w:fldCharType"), kind)
+            run._r.append(fld_char)  # pylint: disable=protected-access
+        elif text == " PAGE ":
+            instr_text = OxmlElement("w:instrText")
+            instr_text.text = text
+            run._r.append(instr_text)  # pylint: disable=protected-access
+        else:
+            run.text = text
+
+
+@pytest.fixture(name="paged_document")
+def fixture_paged_document(tmp_path) -> str:
+    """
+    Document with a labelled PAGE field and a bare one in every header/footer type
+    """
+    document = Document()
+    document.add_paragraph("Scope of work")
+    document.settings.odd_and_even_pages_header_footer = True
+    section = document.sections[0]
+    section.different_first_page_header_footer = True
+    for name in HEADER_FOOTERS:
+        story = getattr(section, name)
+        story.is_linked_to_previous = False
+        labelled = story.paragraphs[0]
+        labelled.add_run("Page ")
+        add_page_field(labelled)
+        add_page_field(story.add_paragraph())
+    path = str(tmp_path / "paged.docx")
+    document.save(path)
+    return path
+
+
+def test_page_fields_survive_in_every_header_and_footer(mock_llm, paged_document, tmp_path):
+    """
+    Field runs are never merged with their neighbours, and paragraphs with
+    nothing to transform keep their runs as they are
+    """
+    output_fn = str(tmp_path / "out.docx")
+    DocxWeaver(
+        filename=paged_document, purpose="Test", paragraph_prompt="Translate", table_prompt=None,
+        mode="transform_only"
+    ).weave_document(output_fn=output_fn)
+    assert sorted(set(mock_llm.texts())) == ["Page", "Scope of work"]
+
+    section = Document(output_fn).sections[0]
+    for name in HEADER_FOOTERS:
+        labelled, bare = getattr(section, name).paragraphs
+        # Header/Footer Runs Keep Their Original Text Appended
+        assert labelled.runs[0].text.startswith("PAGE "), name
+        for paragraph in [labelled, bare]:
+            assert [run.text for run in paragraph.runs][-4:] == ["", "", "0", ""], name
+            p = paragraph._p  # pylint: disable=protected-access
+            assert len(p.findall(".//" + qn("w:fldChar"))) == 3, name
+            assert p.find(".//" + qn("w:instrText")).text == " PAGE ", name
+    with zipfile.ZipFile(output_fn) as package:
+        parts = [fn for fn in package.namelist() if fn.startswith(("word/header", "word/footer"))]
+        assert len(parts) == 6
+        for fn in parts:
+            assert package.read(fn).count(b"w:instrText") == 4, fn
+
+
+def test_stories_are_walked_once_in_order(make_document):
+    """
+    Body runs come first, then each header/footer part once, every run at its result path
+    """
+    document = Document(make_document(["First", "Second"], rows=[["Cell"]]))
+    document.sections[0].header.paragraphs[0].text = "Header"
+    new_section = document.add_section()
+    new_section.header.is_linked_to_previous = True
+    items = list(traverse.iter_work_items(document, accept_paragraph=lambda *args: True))
+    runs = [(item.part, item.path, item.text) for item in items if item.kind == "run"]
+    assert runs == [
+        ("body", ("paragraphs", "0", "runs", "0"), "First"),
+        ("body", ("paragraphs", "1", "runs", "0"), "Second"),
+        (
+            "body", ("tables", "0", "rows", "0", "cells", "0", "paragraphs", "0", "runs", "0"),
+            "Cell"
+        ),
+        ("header", ("section_paragraphs", "0", "header_paragraphs", "0", "runs", "0"), "Header"),
+    ]
+    assert [item.path for item in items if item.kind == "cell"] == [
+        ("tables", "0", "rows", "0", "cells", "0")
+    ]
+
+
+def test_paragraph_granularity_marks_spans(make_document):
+    """
+    Body paragraphs are yielded whole with their formatting spans marked
+    """
+    document = Document(make_document(["Net "]))
+    paragraph = document.paragraphs[0]
+    bold = copy.deepcopy(paragraph.runs[0]._r)  # pylint: disable=protected-access
+    paragraph._p.append(bold)  # pylint: disable=protected-access
+    paragraph.runs[1].text = "revenue"
+    paragraph.runs[1].bold = True
+    items = list(traverse.iter_work_items(
+        document, accept_paragraph=lambda *args: True, paragraphs=True
+    ))
+    assert [(item.kind, item.text) for item in items] == [
+        ("paragraph", "<s1>Net </s1><s2>revenue</s2>")
+    ]
@@ -0,0 +1,208 @@
+"""
+Tests of the run level helpers: prompts and replies, run merging, spans
+"""
+
+import importlib.util
+import json
+import os
+import pytest
+from docx import Document
+from weaver import ratelimit, word
+from weaver.weaver import DocxWeaver
+
+
+def test_parse_batch_response_keeps_valid_entries():
+    """
+    Entries matching the schema are mapped by id (skipped ones to None),
+    the others are left out to be retried alone
+    """
+    message = json.dumps({"results": [
+        {"id": "0", "skip": False, "tgt_text": "A"},
+        {"id": "1", "skip": True, "tgt_text": ""},
+        {"id": "2", "tgt_text": "C"},
+        {"id": "3", "skip": False, "tgt_text": 4},
+    ]})
+    assert word.parse_batch_transformation_response(message) == {"0": "A", "1": None}
+
+
+@pytest.mark.parametrize("message", [None, "[]", json.dumps({"texts": []})])
+def test_parse_batch_response_rejects_replies_without_results(message):
+    """
+    Replies without a list of results are invalid
+    """
+    with pytest.raises(ValueError):
+        word.parse_batch_transformation_response(message)
+
+
+def load_benchmark(name: str):
+    """
+    Module of a benchmark script (the benchmarks aren't a package)
+    """
+    path = os.path.join(os.path.dirname(__file__), "..", "benchmarks", f"{name}.py")
+    spec = importlib.util.spec_from_file_location(f"benchmarks_{name}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_texts(texts: list[str]) -> list[str]:
+    """
+    Texts of the runs of a paragraph built from texts, once cleaned up
+    """
+    paragraph = Document().add_paragraph()
+    for text in texts:
+        paragraph.add_run(text)
+    word.cleanup_bad_runs(paragraph)
+    return [run.text for run in paragraph.runs]
+
+
+@pytest.mark.parametrize("texts, expected", [
+    (["Hello", " world"], ["Hello world"]),
+    (["ends.", " Next"], ["ends.", " Next"]),
+    (["U.S.", " and more"], ["U.S. and more"]),
+    (["U.S. ", "Congress"], ["U.S. ", "Congress"]),
+    (["Inc.", ", and"], ["Inc., and"]),
+    (["Item", "(1)"], ["Item", "(1)"]),
+    (["a", "\t", "b"], ["a", "\t", "b"]),
+    (["", "x"], ["", "x"]),
+])
+def test_cleanup_bad_runs_rules(texts, expected):
+    """
+    Runs join the previous one unless a merge rule keeps them apart
+    """
+    assert run_texts(texts) == expected
+
+
+def test_cleanup_bad_runs_matches_the_original_version():
+    """
+    The single pass leaves the same XML as the original version on random paragraphs
+    """
+    load_benchmark("cleanup_runs").check_equivalence(trials=500, seed=0)
+
+
+@pytest.mark.parametrize("tgt_text, expected", [
+    ("<s1>Résultat </s1><s2>net</s2>", ["Résultat ", "net"]),
+    ("<s2>net</s2> <s1>Résultat</s1>", ["Résultat", "net "]),
+    ("<S1>Résultat </S1>< s2 >net</ s2 >.", ["Résultat ", "net."]),
+    ("Le <s1>résultat</s1><s2>net</s2>", ["Le résultat", "net"]),
+    ("<s1>Résultat</s1><s2></s2>", ["Résultat", ""]),
+])
+def test_unmark_spans(tgt_text, expected):
+    """
+    Spans come back in source order, whatever the order, case and spacing of their markers
+    """
+    assert word.unmark_spans(tgt_text, ["Net ", "revenue"]) == expected
+
+
+def test_unmark_spans_keeps_dropped_whitespace_spans():
+    """
+    Whitespace only spans (tabs, spacing) may be left out by the model
+    """
+    assert word.unmark_spans("<s1>A</s1><s3>B</s3>", ["a", "\t", "b"]) == ["A", "\t", "B"]
+
+
+@pytest.mark.parametrize("tgt_text", [
+    "Résultat net",
+    "<s1>Résultat net</s1>",
+    "<s1>Résultat </s1><s2>net",
+    "<s1>Résultat <s2>net</s2></s1>",
+    "<s1>Résultat </s1><s2>net</s2><s3>!</s3>",
+    "<s1>Résultat </s1><s1>net</s1><s2></s2>",
+])
+def test_unmark_spans_rejects_markers_not_round_tripping(tgt_text):
+    """
+    Dropped, unknown, repeated or unbalanced markers raise instead of being written
+    """
+    with pytest.raises(ValueError):
+        word.unmark_spans(tgt_text, ["Net ", "revenue"])
+
+
+def test_transformation_replies_are_checked_against_their_spans():
+    """
+    Replies to a marked text are normalized, or rejected (and so retried or escalated)
+    """
+    src_text = "<s1>Net </s1><s2>revenue</s2>"
+    reply = json.dumps({"skip": False, "tgt_text": "<S1>NET </S1><S2>REVENUE</S2>"})
+    assert word.parse_transformation_response(reply, src_text=src_text) == (
+        "<s1>NET </s1><s2>REVENUE</s2>"
+    )
+    dropped = json.dumps({"skip": False, "tgt_text": "<s1>NET REVENUE</s1>"})
+    with pytest.raises(ValueError):
+        word.parse_transformation_response(dropped, src_text=src_text)
+    assert word.parse_transformation_response(dropped, src_text="Net revenue") == (
+        "<s1>NET REVENUE</s1>"
+    )
+    batch = json.dumps({"results": [
+        {"id": "0", "skip": False, "tgt_text": "<s1>NET REVENUE</s1>"},
+        {"id": "1", "skip": False, "tgt_text": "<s1>NET </s1><s2>REVENUE</s2>"},
+    ]})
+    segments = {"0": src_text, "1": src_text}
+    assert word.parse_batch_transformation_response(batch, segments=segments) == {
+        "1": "<s1>NET </s1><s2>REVENUE</s2>"
+    }
+
+
+def test_mangled_span_markers_are_retried(mock_llm, tmp_path):
+    """
+    At paragraph granularity, a reply dropping a span is sent again instead
+    of being written, and each span lands back in its own runs
+    """
+    document = Document()
+    paragraph = document.add_paragraph("Net ")
+    paragraph.add_run("revenue").bold = True
+    filename = str(tmp_path / "in.docx")
+    document.save(filename)
+    replies = iter(["<s1>NET REVENUE</s1>", "<S2>REVENUE</S2> <S1>NET</S1>"])
+    mock_llm.transform = lambda text: next(replies)
+    output_fn = str(tmp_path / "out.docx")
+    DocxWeaver(
+        filename=filename, purpose="Test", paragraph_prompt="Translate", table_prompt=None,
+        mode="transform_only", granularity="paragraph"
+    ).weave_document(output_fn=output_fn)
+    assert mock_llm.texts() == ["<s1>Net </s1><s2>revenue</s2>"] * 2
+    runs = Document(output_fn).paragraphs[0].runs
+    assert [(run.text, run.bold) for run in runs] == [("NET", None), ("REVENUE ", True)]
+
+
+def test_system_prefix_is_shared_by_every_segment():
+    """
+    Messages differ in the user message only, so the prefix can be served from the prompt cache
+    """
+    first = word.build_transformation_messages("Scope of work", "Translate", "Test")
+    second = word.build_transformation_messages("Payment terms", "Translate", "Test")
+    assert first[0] == second[0] and first[1] != second[1]
+    assert json.loads(second[1]["content"]) == {"src_text": "Payment terms"}
+
+
+def test_response_format_follows_the_model():
+    """
+    Structured outputs for the models supporting them, JSON mode for the others
+    """
+    assert word.response_format("gpt-4o", word.TRANSFORMATION_SCHEMA)["type"] == "json_schema"
+    assert word.response_format("gpt-3.5-turbo", word.TRANSFORMATION_SCHEMA) == {
+        "type": "json_object"
+    }
+
+
+@pytest.mark.parametrize("message", [
+    None, "not json", "[]", json.dumps({"tgt_text": "A"}),
+    json.dumps({"skip": "no", "tgt_text": "A"}),
+    json.dumps({"skip": False, "tgt_text": "A", "notes": ""}),
+])
+def test_parse_response_rejects_replies_off_the_schema(message):
+    """
+    Replies missing, adding or mistyping properties are invalid
+    """
+    with pytest.raises(ValueError):
+        word.parse_transformation_response(message)
+
+
+def test_invalid_replies_are_retried(mock_llm):
+    """
+    A reply failing validation is requested again
+    """
+    mock_llm.invalid_models = {"gpt-4o"}
+    assert word.generate_transformation(
+        src_text="Scope of work", prompt="Translate", purpose="Test", model_name="gpt-4o"
+    ) is None
+    assert len(mock_llm.requests) == ratelimit.get_rate_limiter("gpt-4o").max_attempts
@@ -0,0 +1,142 @@
+"""
+Persistent cache of transformations, stored in SQLite
+
+Entries are keyed by a hash of the model name, purpose, prompt and the
+prepared source text (the output of parse_and_prepare_src_text_transforms),
+so identical requests across runs and documents skip the LLM. The cache file
+can be shared by several processes.
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from . import metrics
+
+# Logger
+log = logging.getLogger(__name__)
+
+
+class TransformCache:
+    """
+    Content-addressed cache of generated transformations
+    path: str - Path to the SQLite file, shared between processes
+    max_entries: int - Least recently used entries are evicted past this size
+    ttl: float | None - Seconds before an entry expires (None = never)
+    """
+    def __init__(self, path: str, max_entries: int = 100_000, ttl: float | None = None):
+        assert max_entries > 0
+        assert ttl is None or ttl > 0
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        # WAL + busy timeout allow concurrent readers/writers across processes
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS transformations ("
+                "key TEXT PRIMARY KEY, tgt_text TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_accessed_at ON transformations (accessed_at)"
+            )
+        self.evict()
+
+    @staticmethod
+    def make_key(model_name: str, purpose: str, prompt: str, src_text: str) -> str:
+        """
+        Hash of everything that determines a transformation
+        """
+        payload = json.dumps([model_name, purpose, prompt, src_text], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _expiry(self) -> float:
+        return time.time() - self.ttl if self.ttl is not None else float("-inf")
+
+    def get(self, model_name: str, purpose: str, prompt: str, src_text: str) -> str | None:
+        """
+        Returns the cached transformation (or None), counting the hit/miss
+        """
+        key = self.make_key(model_name, purpose, prompt, src_text)
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT tgt_text FROM transformations WHERE key = ? AND created_at >= ?",
+                (key, self._expiry())
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.increment("cache_misses")
+                return None
+            self._conn.execute(
+                "UPDATE transformations SET accessed_at = ? WHERE key = ?",
+                (time.time(), key)
+            )
+            self.hits += 1
+        metrics.increment("cache_hits")
+        return row[0]
+
+    def contains(self, model_name: str, purpose: str, prompt: str, src_text: str) -> bool:
+        """
+        Checks for a live entry without counting or touching it
+        """
+        key = self.make_key(model_name, purpose, prompt, src_text)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM transformations WHERE key = ? AND created_at >= ?",
+                (key, self._expiry())
+            ).fetchone()
+        return row is not None
+
+    def put(self, model_name: str, purpose: str, prompt: str, src_text: str, tgt_text: str):
+        """
+        Stores a transformation, evicting old entries every so often
+        """
+        key = self.make_key(model_name, purpose, prompt, src_text)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO transformations VALUES (?, ?, ?, ?)",
+                (key, tgt_text, now, now)
+            )
+            self._puts += 1
+        if self._puts % 1000 == 0:
+            self.evict()
+
+    def evict(self):
+        """
+        Drops expired entries and the least recently used entries past max_entries
+        """
+        with self._lock, self._conn:
+            if self.ttl is not None:
+                self._conn.execute(
+                    "DELETE FROM transformations WHERE created_at < ?", (self._expiry(),)
+                )
+            self._conn.execute(
+                "DELETE FROM transformations WHERE key IN ("
+                "SELECT key FROM transformations ORDER BY accessed_at DESC "
+                "LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def stats(self) -> dict[str, int]:
+        """
+        Hit/miss counters for this instance and the current number of entries
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM transformations").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def close(self):
+        """
+        Closes the underlying connection
+        """
+        with self._lock:
+            self._conn.close()
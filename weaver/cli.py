@@ -0,0 +1,346 @@
+"""
+Command line interface for weaving many documents at once
+
+    docx-weaver contracts/ --mode transform_only
+        --purpose "You are translating contracts into french."
+        --paragraph-prompt "Convert the following paragraph into french."
+        --output-dir woven/ --workers 4 --concurrency 32
+
+Documents are spread over a pool of worker processes which share one limit
+on requests in flight, and a manifest with one record per document is written
+as JSON lines (or a JSON list if the path ends in .json). With --plan the
+documents are only planned (see DocxWeaver.plan): the manifest gets the plan
+of each document, and the plan of the whole batch is printed as JSON.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from . import metrics, planning, ratelimit
+from .settings import DocxWeaverSettings
+from .weaver import DocxWeaver
+
+# Logger
+log = logging.getLogger(__name__)
+
+# Sections of a weave result recorded for each document
+RESULT_SUMMARY_KEYS = [
+    "preflight", "segments", "routing", "models", "rate_limit", "cache", "journal", "metrics"
+]
+
+
+def find_documents(inputs: list[str]) -> list[str]:
+    """
+    Expands directories and glob patterns into a sorted list of .docx files,
+    skipping Word's lock files (~$*.docx)
+    """
+    filenames = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = glob.glob(os.path.join(item, "*.docx"))
+        else:
+            matches = glob.glob(item) or [item]
+        filenames.update(
+            fn for fn in matches
+            if fn.endswith(".docx") and not os.path.basename(fn).startswith("~$")
+        )
+    return sorted(filenames)
+
+
+def output_filename(filename: str, output_dir: str, suffix: str) -> str:
+    """
+    Output path for a document
+    """
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(output_dir, f"{stem}{suffix}.docx")
+
+
+def output_filenames(filenames: list[str], output_dir: str, suffix: str) -> list[str]:
+    """
+    Output paths for documents, all in output_dir unless two of them share a
+    name: then each keeps its path relative to the directory holding all of
+    them, so no two documents (or their journals) are written to the same file
+    """
+    outputs = [output_filename(filename, output_dir, suffix) for filename in filenames]
+    if len(set(map(os.path.normcase, outputs))) == len(outputs):
+        return outputs
+    dirnames = [os.path.dirname(os.path.abspath(filename)) for filename in filenames]
+    root = os.path.commonpath(dirnames)
+    return [
+        output_filename(
+            filename, os.path.normpath(os.path.join(output_dir, os.path.relpath(dirname, root))),
+            suffix
+        )
+        for filename, dirname in zip(filenames, dirnames)
+    ]
+
+
+def _init_worker(semaphore, workers: int, log_level: str):
+    """
+    Joins a worker process to the shared API budget
+    """
+    logging.basicConfig(
+        level=log_level, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    ratelimit.join_process_pool(semaphore=semaphore, workers=workers)
+
+
+def _make_weaver(job: dict) -> DocxWeaver:
+    """
+    Weaver of a job's document
+    """
+    return DocxWeaver(
+        filename=job["filename"],
+        purpose=job["purpose"],
+        paragraph_prompt=job["paragraph_prompt"],
+        table_prompt=job["table_prompt"],
+        mode=job["mode"],
+        openai_model_name=job["openai_model_name"],
+        concurrency=job["concurrency"],
+        batch_tokens=job["batch_tokens"],
+        cache_path=job["cache_path"],
+        granularity=job["granularity"],
+        fast_model_name=job["fast_model_name"],
+        schedule=job["schedule"]
+    )
+
+
+def weave_one(job: dict) -> dict:
+    """
+    Weaves a single document, returning its manifest record (never raises)
+    """
+    start = time.time()
+    record = {"input": job["filename"], "output": job["output_fn"]}
+    try:
+        result = _make_weaver(job).weave_document(
+            output_fn=job["output_fn"],
+            journal_path=f"{job['output_fn']}.journal.jsonl" if job["resume"] else None,
+            resume=job["resume"]
+        )
+        record["status"] = "ok"
+        for key in RESULT_SUMMARY_KEYS:
+            if key in result:
+                record[key] = result[key]
+    except Exception as e:  # pylint: disable=broad-except
+        log.error("Failed Weaving %s: %r", job["filename"], e)
+        record["status"] = "failed"
+        record["error"] = repr(e)
+        record["traceback"] = traceback.format_exc()
+    record["seconds"] = round(time.time() - start, 3)
+    return record
+
+
+def plan_one(job: dict) -> dict:
+    """
+    Plans a single document, returning its manifest record (never raises)
+    """
+    start = time.time()
+    record = {"input": job["filename"], "output": job["output_fn"]}
+    try:
+        record["plan"] = _make_weaver(job).plan(
+            concurrency=job["concurrency"],
+            requests_per_minute=job["requests_per_minute"],
+            tokens_per_minute=job["tokens_per_minute"]
+        )
+        record["status"] = "ok"
+    except Exception as e:  # pylint: disable=broad-except
+        log.error("Failed Planning %s: %r", job["filename"], e)
+        record["status"] = "failed"
+        record["error"] = repr(e)
+        record["traceback"] = traceback.format_exc()
+    record["seconds"] = round(time.time() - start, 3)
+    return record
+
+
+def write_manifest(records: list[dict], manifest_fn: str):
+    """
+    Writes records as a JSON list (.json) or as JSON lines
+    """
+    with open(manifest_fn, "w", encoding="utf-8") as f:
+        if manifest_fn.endswith(".json"):
+            json.dump(records, f, indent=2, ensure_ascii=False)
+        else:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Argument parser for the docx-weaver command
+    """
+    parser = argparse.ArgumentParser(
+        prog="docx-weaver",
+        description="Convert, translate or review many Word documents with DocxWeaver"
+    )
+    parser.add_argument("inputs", nargs="+", help="Directories, .docx files or glob patterns")
+    parser.add_argument(
+        "--mode", required=True,
+        choices=["comments_only", "transform_only", "transform_and_comments"]
+    )
+    parser.add_argument("--purpose", required=True, help="Purpose used in all prompts")
+    parser.add_argument("--paragraph-prompt", required=True)
+    parser.add_argument("--table-prompt", default=None)
+    parser.add_argument(
+        "--model", default="gpt-4o", choices=["gpt-4-turbo", "gpt-3.5-turbo", "gpt-4o"]
+    )
+    parser.add_argument(
+        "--fast-model", default=None, choices=["gpt-4-turbo", "gpt-3.5-turbo", "gpt-4o"],
+        help="Cheaper model tried first for short/simple segments"
+    )
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--suffix", default="-woven", help="Appended to output file names")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="Worker processes"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=16,
+        help="Max requests in flight, across all workers"
+    )
+    parser.add_argument("--batch-tokens", type=int, default=None)
+    parser.add_argument(
+        "--schedule", default="lpt", choices=["fifo", "lpt", "deadline"],
+        help="Order requests are sent in: document order, longest first or by latest start"
+    )
+    parser.add_argument("--cache-path", default=None, help="SQLite cache shared by all workers")
+    parser.add_argument(
+        "--granularity", default="run", choices=["run", "paragraph"],
+        help="Transform paragraphs run by run, or whole with their formatting spans marked"
+    )
+    parser.add_argument(
+        "--metrics", default=None,
+        help="Writes the metrics of all documents as JSON (.json) or in the Prometheus text format"
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="Journal each document next to its output and replay the journal of an interrupted run"
+    )
+    parser.add_argument(
+        "--manifest", default=None,
+        help="Manifest path (.jsonl or .json), defaults to OUTPUT_DIR/manifest.jsonl"
+    )
+    parser.add_argument(
+        "--plan", action="store_true",
+        help="Dry run: count the requests, tokens and time of the batch without calling the LLM"
+    )
+    parser.add_argument(
+        "--requests-per-minute", type=int, default=None,
+        help="Request budget of every model for --plan (defaults to the settings)"
+    )
+    parser.add_argument(
+        "--tokens-per-minute", type=int, default=None,
+        help="Token budget of every model for --plan (defaults to the settings)"
+    )
+    parser.add_argument("--log-level", default="WARNING")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    Entry point of the docx-weaver command
+    """
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=args.log_level, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    assert args.workers > 0 and args.concurrency > 0
+
+    filenames = find_documents(args.inputs)
+    if not filenames:
+        log.error("No Documents Found In %s", args.inputs)
+        return 2
+    output_fns = output_filenames(filenames, args.output_dir, args.suffix)
+    if len(set(map(os.path.normcase, output_fns))) < len(output_fns):
+        log.error("Documents Would Be Woven To The Same Output In %s", args.output_dir)
+        return 2
+    for output_fn in output_fns:
+        os.makedirs(os.path.dirname(output_fn) or ".", exist_ok=True)
+    manifest_fn = args.manifest or os.path.join(args.output_dir, "manifest.jsonl")
+    workers = min(args.workers, len(filenames))
+    jobs = [
+        {
+            "filename": filename,
+            "output_fn": output_fn,
+            "purpose": args.purpose,
+            "paragraph_prompt": args.paragraph_prompt,
+            "table_prompt": args.table_prompt,
+            "mode": args.mode,
+            "openai_model_name": args.model,
+            "concurrency": args.concurrency,
+            "batch_tokens": args.batch_tokens,
+            "cache_path": args.cache_path,
+            "granularity": args.granularity,
+            "fast_model_name": args.fast_model,
+            "schedule": args.schedule,
+            "resume": args.resume,
+            "requests_per_minute": args.requests_per_minute,
+            "tokens_per_minute": args.tokens_per_minute,
+        }
+        for filename, output_fn in zip(filenames, output_fns)
+    ]
+
+    # One Limit On Requests In Flight, Shared By All Workers
+    semaphore = multiprocessing.BoundedSemaphore(args.concurrency)
+    start = time.time()
+    records = []
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(semaphore, workers, args.log_level)
+    ) as executor:
+        futures = [executor.submit(plan_one if args.plan else weave_one, job) for job in jobs]
+        for future in as_completed(futures):
+            record = future.result()
+            records.append(record)
+            print(
+                f"[{len(records)}/{len(jobs)}] {record['status']} "
+                f"{record['input']} ({record['seconds']}s)",
+                file=sys.stderr
+            )
+    order = {filename: ix for ix, filename in enumerate(filenames)}
+    records.sort(key=lambda record: order[record["input"]])
+    write_manifest(records, manifest_fn)
+    if args.metrics is not None:
+        metrics.write_metrics(
+            metrics.merge_metrics([record["metrics"] for record in records if "metrics" in record]),
+            args.metrics
+        )
+
+    failed = sum(record["status"] != "ok" for record in records)
+    if args.plan:
+        # The Whole Batch Shares The Concurrency And The Per-Minute Budgets
+        settings = DocxWeaverSettings(openai_model_name=args.model)
+        plans = [record["plan"] for record in records if "plan" in record]
+        batch_plan = planning.merge_plans(
+            plans,
+            concurrency=args.concurrency,
+            requests_per_minute=settings.openai_requests_per_minute
+            if args.requests_per_minute is None
+            else dict.fromkeys(settings.openai_requests_per_minute, args.requests_per_minute),
+            tokens_per_minute=settings.openai_tokens_per_minute
+            if args.tokens_per_minute is None
+            else dict.fromkeys(settings.openai_tokens_per_minute, args.tokens_per_minute)
+        )
+        print(json.dumps(batch_plan, indent=2))
+        print(
+            f"Planned {len(records) - failed}/{len(records)} documents: {batch_plan['requests']} "
+            f"requests, ~{batch_plan['wall_time']['minutes']} minutes, manifest: {manifest_fn}",
+            file=sys.stderr
+        )
+        return 1 if failed else 0
+    print(
+        f"Wove {len(records) - failed}/{len(records)} documents in "
+        f"{time.time() - start:.1f}s, manifest: {manifest_fn}",
+        file=sys.stderr
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
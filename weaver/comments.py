@@ -0,0 +1,117 @@
+"""
+Bulk writing of comments
+
+Commenting through bayoo-docx (run.add_comment) costs more with every comment
+already in the document: each call scans and sorts the ids of the comments
+part to allocate the next one, then walks its children to insert the new
+comment. CommentWriter collects the comments of a weave instead, and flush
+writes them in one pass: ids are allocated once, the new comments are
+appended to the comments part together, and the range markers/references are
+inserted next to their runs, so the cost stays linear in the comments added.
+The elements written are the ones run.add_comment writes.
+"""
+
+from typing import Any
+import datetime
+import logging
+import docx
+from docx.oxml import OxmlElement
+from docx.oxml.comments import CT_Com
+from docx.oxml.ns import qn
+from . import metrics
+
+# Logger
+log = logging.getLogger(__name__)
+
+COMMENT_AUTHOR = "DocxWeaver"
+COMMENT_INITIALS = "WW"
+
+
+def comment_date() -> str:
+    """
+    Date of the comments added now (UTC)
+    """
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d")
+
+
+class CommentWriter:
+    """
+    Comments collected during a weave, written to the document by flush
+    author: str - Author of the comments
+    initials: str - Initials of the author
+    """
+    def __init__(self, author: str = COMMENT_AUTHOR, initials: str = COMMENT_INITIALS):
+        self.author = author
+        self.initials = initials
+        # (part, first run element, last run element, text), in document order
+        self._pending: list[tuple[Any, Any, Any, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, first_run: docx.text.run.Run, last_run: docx.text.run.Run, text: str):
+        """
+        Queues a comment on the runs from first_run to last_run (of the same
+        paragraph)
+        """
+        self._pending.append((
+            last_run.part, first_run._r, last_run._r, text  # pylint: disable=protected-access
+        ))
+
+    def flush(self) -> int:
+        """
+        Writes the queued comments, returning how many were written
+        """
+        if not self._pending:
+            return 0
+        written = len(self._pending)
+        with metrics.timed("comments", comments=written):
+            by_part: dict[Any, list[tuple[Any, Any, str]]] = {}
+            for part, first_r, last_r, text in self._pending:
+                by_part.setdefault(part, []).append((first_r, last_r, text))
+            for part, pending in by_part.items():
+                self._write(part._comments_part.element, pending)  # pylint: disable=protected-access
+            self._pending = []
+        metrics.increment("comments", written)
+        log.debug("Wrote %s Comments", written)
+        return written
+
+    def _write(self, comments_element, pending: list[tuple[Any, Any, str]]):
+        """
+        Appends the comments to the comments part and anchors them on their runs
+        """
+        # Allocate Ids Once, After The Comments Already In The Part
+        ids = [int(value) for value in comments_element.xpath("./w:comment/@w:id")]
+        next_id = max(ids) + 1 if ids else 0
+        date = comment_date()
+        new_comments = []
+        for comment_id, (first_r, last_r, text) in enumerate(pending, start=next_id):
+            comment = CT_Com.new(self.initials, comment_id, date, self.author)
+            comment._add_p(text)  # pylint: disable=protected-access
+            new_comments.append(comment)
+            # Range Around The Runs, Reference At The End Of The Last One
+            range_start = OxmlElement("w:commentRangeStart", {qn("w:id"): str(comment_id)})
+            range_end = OxmlElement("w:commentRangeEnd", {qn("w:id"): str(comment_id)})
+            reference = OxmlElement("w:commentReference", {qn("w:id"): str(comment_id)})
+            first_r.addprevious(range_start)
+            last_r.addnext(range_end)
+            last_r.append(reference)
+        comments_element.extend(new_comments)
+
+
+def add_comment(
+    first_run: docx.text.run.Run,
+    last_run: docx.text.run.Run,
+    text: str,
+    writer: CommentWriter | None = None
+):
+    """
+    Comments the runs from first_run to last_run (of the same paragraph),
+    queued on writer when given, else written right away
+    """
+    if writer is not None:
+        writer.add(first_run, last_run, text)
+        return
+    writer = CommentWriter()
+    writer.add(first_run, last_run, text)
+    writer.flush()
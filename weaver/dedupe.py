@@ -0,0 +1,65 @@
+"""
+Document-wide deduplication of segments
+
+Segments are grouped by their normalized form: the model, purpose and prompt
+together with the prepared text from parse_and_prepare_src_text_transforms.
+Each unique segment is transformed once and the result is fanned out to every
+occurrence, re-applying that occurrence's own punctuation/casing transforms.
+"""
+
+from collections import Counter
+from typing import NamedTuple
+from . import word
+
+
+class SegmentKey(NamedTuple):
+    """
+    Normalized form of a segment, shared by all of its occurrences
+    """
+    model_name: str
+    purpose: str
+    prompt: str
+    src_text: str
+
+
+def prepare_segment(
+    src_text: str,
+    prompt: str,
+    purpose: str,
+    model_name: str
+) -> tuple[SegmentKey, dict]:
+    """
+    Normalizes a segment, returning its key and the transforms to re-apply
+    """
+    prepared_text, transforms_dict = word.parse_and_prepare_src_text_transforms(src_text=src_text)
+    return SegmentKey(model_name, purpose, prompt, prepared_text), transforms_dict
+
+
+class SegmentIndex:
+    """
+    Hash index of the segments in a document and their transformations
+    """
+    def __init__(self):
+        self.occurrences: Counter[SegmentKey] = Counter()
+        self.results: dict[SegmentKey, str | None] = {}
+        # Requests, latency and tokens spent generating each segment (see metrics.usage_scope)
+        self.usage: dict[SegmentKey, dict[str, float]] = {}
+
+    def add(self, key: SegmentKey):
+        """
+        Records an occurrence of a segment
+        """
+        self.occurrences[key] += 1
+
+    def stats(self) -> dict[str, int]:
+        """
+        Occurrence counts for the weave result
+        """
+        total = sum(self.occurrences.values())
+        unique = len(self.occurrences)
+        return {
+            "occurrences": total,
+            "unique": unique,
+            "duplicates": total - unique,
+            "max_repeats": max(self.occurrences.values(), default=0)
+        }
@@ -0,0 +1,452 @@
+"""
+Dispatch of text transformations
+
+The weave calls a transform function once per run. IndexedTransform fans
+each unique (normalized) segment out to all of its occurrences, generating
+it on first use. For concurrent/batched weaving, the unique segments of the
+planned runs are first generated through the async client and the weave
+then reads the results back from the index in document order. They are sent
+by a pool of workers taking batches from one queue, in the order of a
+scheduler (see scheduling). Given a routing.ModelRouter, each segment is
+tried with the models it routes it to.
+Long-running processes (see server) keep one AsyncClientLoop, whose client
+and connection pool are shared by every weave instead of opened per weave.
+Streamed weaves generate in a BackgroundPrefetch, applying each run as soon
+as its segment is ready.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Iterable
+import asyncio
+import collections
+import contextlib
+import contextvars
+import copy
+import functools
+import logging
+import threading
+from tqdm import tqdm
+from . import metrics, scheduling, word
+from .cache import TransformCache
+from .dedupe import SegmentIndex, SegmentKey, prepare_segment
+from .routing import ModelRouter
+from .streaming import WeaveCancelled
+
+# openai (and httpx) Are Imported When The First Client Is Opened
+if TYPE_CHECKING:
+    import openai
+
+# Logger
+log = logging.getLogger(__name__)
+
+
+# Prepared runs from preflight.prepare_segments: src_text -> (prepared text, transforms) or None
+PreparedSegments = dict[str, tuple[str, dict] | None]
+# Called with each segment as soon as it is generated (or read from the cache)
+OnResult = Callable[[SegmentKey, str | None], None]
+# Seconds between checks for an interrupt while waiting for a prefetched segment
+_INTERRUPT_POLL_SECONDS = 0.1
+
+
+class AsyncClientLoop:
+    """
+    Event loop running in a background thread, with an async client kept open
+    on it. Weaves running in any thread submit their requests to it, so they
+    share the client's pooled connections to the LLM endpoint.
+    max_connections: int - Size of the connection pool
+    """
+    def __init__(self, max_connections: int = 64):
+        import httpx  # pylint: disable=import-outside-toplevel
+        import openai  # pylint: disable=import-outside-toplevel,redefined-outer-name
+        assert max_connections > 0
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name="weaver-client-loop", daemon=True
+        )
+        self._thread.start()
+        # Retries are left to the rate limiter
+        self.client = openai.AsyncOpenAI(
+            max_retries=0,
+            http_client=openai.DefaultAsyncHttpxClient(limits=httpx.Limits(
+                max_connections=max_connections, max_keepalive_connections=max_connections
+            ))
+        )
+
+    def run(self, make_coro: Callable[["openai.AsyncOpenAI"], Awaitable[Any]]) -> Any:
+        """
+        Runs make_coro(client) on the loop, blocking until it is done. The
+        caller's context (e.g. its metrics collector) is carried over.
+        """
+        return asyncio.run_coroutine_threadsafe(make_coro(self.client), self.loop).result()
+
+    def close(self):
+        """
+        Closes the client and stops the loop
+        """
+        asyncio.run_coroutine_threadsafe(self.client.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+def prepare_run(
+    src_text: str,
+    prompt: str,
+    purpose: str,
+    model_name: str,
+    prepared: PreparedSegments | None = None
+) -> tuple[SegmentKey, dict] | None:
+    """
+    Key and transforms of a run, or None if it is not transformed. Runs
+    classified up front (prepared) skip the per-run checks.
+    """
+    if prepared is not None and src_text in prepared:
+        segment = prepared[src_text]
+        if segment is None:
+            return None
+        prepared_text, transforms_dict = segment
+        return SegmentKey(model_name, purpose, prompt, prepared_text), dict(transforms_dict)
+    # Try To Parse Cell Values // Check Formats Not Requiring Translation
+    if word.check_formats_not_to_translate(copy.deepcopy(src_text)):
+        return None
+    return prepare_segment(
+        src_text=src_text, prompt=prompt, purpose=purpose, model_name=model_name
+    )
+
+
+def collect_segment_keys(
+    segments: Iterable[tuple[str, str]],
+    purpose: str,
+    model_name: str,
+    prepared: PreparedSegments | None = None
+) -> list[SegmentKey]:
+    """
+    Unique keys of the (src_text, prompt) segments that would reach the LLM,
+    in order of first occurrence
+    """
+    keys: dict[SegmentKey, None] = {}  # Ordered Set
+    for src_text, prompt in segments:
+        run = prepare_run(
+            src_text=src_text, prompt=prompt, purpose=purpose,
+            model_name=model_name, prepared=prepared
+        )
+        if run is not None:
+            keys[run[0]] = None
+    return list(keys)
+
+
+class IndexedTransform:
+    """
+    Stand-in for word.transform_text backed by a SegmentIndex. Results already
+    in the index are reused, other segments are generated (via the cache) and
+    stored for their later occurrences. After each call, `usage` holds what
+    generating the segment cost if this is its first occurrence (else None).
+    Given a BackgroundPrefetch, segments still being generated are waited for.
+    """
+    def __init__(
+        self,
+        index: SegmentIndex,
+        cache: TransformCache | None = None,
+        prepared: PreparedSegments | None = None,
+        router: ModelRouter | None = None,
+        prefetch: "BackgroundPrefetch | None" = None
+    ):
+        self.index = index
+        self.cache = cache
+        self.prepared = prepared
+        self.router = router
+        self.prefetch = prefetch
+        self.usage: dict[str, float] | None = None
+        self._charged: set[SegmentKey] = set()
+
+    def __call__(
+        self,
+        src_text: str,
+        prompt: str,
+        purpose: str,
+        model_name: str
+    ) -> tuple[str, bool, bool]:
+        self.usage = None
+        run = prepare_run(
+            src_text=src_text, prompt=prompt, purpose=purpose,
+            model_name=model_name, prepared=self.prepared
+        )
+        if run is None:
+            return src_text, False, False
+        key, transforms_dict = run
+        self.index.add(key)
+        if key not in self.index.results and self.prefetch is not None:
+            self.prefetch.wait(key)
+        if key not in self.index.results:
+            with metrics.usage_scope() as usage:
+                self.index.results[key] = word.generate_cached_transformation(
+                    src_text=key.src_text,
+                    prompt=prompt,
+                    purpose=purpose,
+                    model_name=model_name,
+                    cache=self.cache,
+                    model_names=None if self.router is None else self.router.cascade(key)
+                )
+            self.index.usage[key] = usage
+        # The First Occurrence Carries The Cost Of The Segment
+        if key not in self._charged:
+            self._charged.add(key)
+            self.usage = self.index.usage.get(key)
+        tgt_text = self.index.results[key]
+        # Catch failed transformation
+        if tgt_text is None:
+            return src_text, False, False
+        tgt_text = word.reapply_src_text_transforms(
+            tgt_text=tgt_text,
+            transforms_dict=transforms_dict
+        )
+        return tgt_text, True, True
+
+
+def pack_batches(
+    keys: list[SegmentKey],
+    batch_tokens: int,
+    router: ModelRouter | None = None
+) -> list[list[SegmentKey]]:
+    """
+    Groups segments sharing a prompt/purpose/model (and route, given a
+    router) into batches whose estimated input tokens stay within batch_tokens
+    """
+    batches: list[list[SegmentKey]] = []
+    open_batches: dict[tuple, tuple[list[SegmentKey], int]] = {}
+    for key in keys:
+        group = (key.model_name, key.purpose, key.prompt)
+        if router is not None:
+            group += tuple(router.cascade(key))
+        tokens = word.count_tokens(key.src_text, key.model_name)
+        batch, batch_size = open_batches.get(group, ([], 0))
+        if batch and batch_size + tokens > batch_tokens:
+            batch, batch_size = [], 0
+        if not batch:
+            batches.append(batch)
+        batch.append(key)
+        open_batches[group] = (batch, batch_size + tokens)
+    return batches
+
+
+async def agenerate_transformations(
+    keys: list[SegmentKey],
+    concurrency: int,
+    batch_tokens: int | None = None,
+    on_result: OnResult | None = None,
+    usage: dict[SegmentKey, dict[str, float]] | None = None,
+    router: ModelRouter | None = None,
+    client: "openai.AsyncOpenAI | None" = None,
+    schedule: str | scheduling.Scheduler = "lpt",
+    cancelled: threading.Event | None = None
+) -> dict[SegmentKey, str | None]:
+    """
+    Generates all segments with `concurrency` workers sending one request at
+    a time, taking batches in the order of the schedule (see scheduling).
+    With batch_tokens, segments are packed into batched prompts of up to that
+    many input tokens, and segments missing from a batch are retried alone.
+    Given a router, batches go to the first model of their route, and
+    segments retried alone go through the whole route. The requests, latency
+    and tokens spent on each segment are added to `usage` (batched requests
+    split evenly between their segments). A client given is used and left
+    open, otherwise one is opened for the call. Once cancelled is set, no
+    new batches are sent, the batches in flight complete and the results so
+    far are returned.
+    """
+    progress = tqdm(total=len(keys))
+    results: dict[SegmentKey, str | None] = {}
+    if batch_tokens is None:
+        batches = [[key] for key in keys]
+    else:
+        batches = pack_batches(keys=keys, batch_tokens=batch_tokens, router=router)
+    queue = collections.deque(scheduling.get_scheduler(schedule)(batches, concurrency))
+
+    async with contextlib.AsyncExitStack() as stack:
+        if client is None:
+            import openai  # pylint: disable=import-outside-toplevel,redefined-outer-name
+            # Retries are left to the rate limiter
+            client = await stack.enter_async_context(openai.AsyncOpenAI(max_retries=0))
+
+        async def _generate(batch: list[SegmentKey]):
+            model_name, purpose, prompt, _ = batch[0]
+            model_names = [model_name] if router is None else router.cascade(batch[0])
+            # Generate All Texts Together (a single text uses the normal prompt)
+            tgt_texts: dict[str, str | None] = {}
+            with metrics.usage_scope() as batch_usage:
+                if len(batch) > 1:
+                    tgt_texts = await word.agenerate_batch_transformation(
+                        segments={str(ix): key.src_text for ix, key in enumerate(batch)},
+                        prompt=prompt,
+                        purpose=purpose,
+                        model_name=model_names[0],
+                        client=client
+                    )
+            for ix, key in enumerate(batch):
+                with metrics.usage_scope() as key_usage:
+                    if str(ix) in tgt_texts:
+                        results[key] = tgt_texts[str(ix)]
+                    else:
+                        # Missing/Failed In Batch, Retry On Its Own
+                        results[key] = await word.agenerate_cascaded_transformation(
+                            src_text=key.src_text,
+                            prompt=prompt,
+                            purpose=purpose,
+                            model_names=model_names,
+                            client=client
+                        )
+                if usage is not None:
+                    usage[key] = {
+                        name: value + batch_usage[name] / len(batch)
+                        for name, value in key_usage.items()
+                    }
+                if on_result is not None:
+                    on_result(key, results[key])
+            progress.update(len(batch))
+
+        async def _work():
+            while queue and not (cancelled is not None and cancelled.is_set()):
+                await _generate(queue.popleft())
+
+        try:
+            await asyncio.gather(*[_work() for _ in range(min(concurrency, len(batches)))])
+        finally:
+            progress.close()
+    log.debug("Generated %s Segments In %s Batches", len(keys), len(batches))
+    return results
+
+
+def generate_transformations(
+    keys: list[SegmentKey],
+    concurrency: int,
+    cache: TransformCache | None = None,
+    batch_tokens: int | None = None,
+    on_result: OnResult | None = None,
+    usage: dict[SegmentKey, dict[str, float]] | None = None,
+    router: ModelRouter | None = None,
+    client_loop: AsyncClientLoop | None = None,
+    schedule: str | scheduling.Scheduler = "lpt",
+    cancelled: threading.Event | None = None
+) -> dict[SegmentKey, str | None]:
+    """
+    Blocking wrapper around agenerate_transformations, serving what it can from
+    the cache. Runs on client_loop when given, else in a worker thread when
+    called from a running event loop (e.g. notebooks). on_result is called
+    with every segment as it completes.
+    """
+    results: dict[SegmentKey, str | None] = {}
+    if cache is not None:
+        for key in keys:
+            tgt_text = cache.get(
+                model_name=key.model_name, purpose=key.purpose,
+                prompt=key.prompt, src_text=key.src_text
+            )
+            if tgt_text is not None:
+                results[key] = tgt_text
+                if on_result is not None:
+                    on_result(key, tgt_text)
+    make_coro = functools.partial(
+        agenerate_transformations,
+        keys=[key for key in keys if key not in results],
+        concurrency=concurrency,
+        batch_tokens=batch_tokens,
+        on_result=on_result,
+        usage=usage,
+        router=router,
+        schedule=schedule,
+        cancelled=cancelled
+    )
+    if client_loop is not None:
+        generated = client_loop.run(lambda client: make_coro(client=client))
+    else:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            generated = asyncio.run(make_coro())
+        else:
+            # The Worker Thread Records Into The Same Metrics (see metrics.current)
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                generated = executor.submit(
+                    contextvars.copy_context().run, asyncio.run, make_coro()
+                ).result()
+    if cache is not None:
+        for key, tgt_text in generated.items():
+            if isinstance(tgt_text, str):
+                cache.put(
+                    model_name=key.model_name, purpose=key.purpose,
+                    prompt=key.prompt, src_text=key.src_text, tgt_text=tgt_text
+                )
+    results.update(generated)
+    return results
+
+
+class BackgroundPrefetch:
+    """
+    Generates segments in a background thread (carrying over the caller's
+    context, e.g. its metrics collector), storing each in the index as soon as
+    it is ready, so runs can be applied while the others are generated
+    index: SegmentIndex - Index the results are stored in
+    generate: Callable[[OnResult, threading.Event], dict[SegmentKey, str | None]] -
+        Generates the segments (e.g. with generate_transformations), calling
+        on_result with each and stopping once the event is set
+    interrupt: threading.Event | None - Event set by the consumer of the weave
+        to abandon it (e.g. streaming.WeaveStream.cancelled): waits raise
+        WeaveCancelled and no new requests are sent (those in flight complete)
+    """
+    def __init__(
+        self,
+        index: SegmentIndex,
+        generate: Callable[[OnResult, threading.Event], dict[SegmentKey, str | None]],
+        interrupt: threading.Event | None = None
+    ):
+        self.index = index
+        self.interrupt = interrupt
+        self.cancelled = threading.Event()
+        self._generate = generate
+        self._ready = threading.Condition()
+        self._done = False
+        self._error: BaseException | None = None
+        self._thread = threading.Thread(
+            target=contextvars.copy_context().run, args=(self._run,), name="weaver-prefetch",
+            daemon=True
+        )
+        self._thread.start()
+
+    def _on_result(self, key: SegmentKey, tgt_text: str | None):
+        with self._ready:
+            self.index.results[key] = tgt_text
+            self._ready.notify_all()
+
+    def _run(self):
+        try:
+            results = self._generate(self._on_result, self.cancelled)
+            with self._ready:
+                self.index.results.update(results)
+        except BaseException as e:  # pylint: disable=broad-except
+            self._error = e
+        finally:
+            with self._ready:
+                self._done = True
+                self._ready.notify_all()
+
+    def wait(self, key: SegmentKey):
+        """
+        Blocks until the segment is generated, or generation stopped without
+        it. Raises the error generation failed with, or WeaveCancelled once
+        interrupted.
+        """
+        with self._ready:
+            while key not in self.index.results and not self._done:
+                if self.interrupt is not None and self.interrupt.is_set():
+                    self.cancelled.set()
+                    raise WeaveCancelled()
+                # Interrupts Do Not Notify, Check Them Every So Often
+                self._ready.wait(timeout=_INTERRUPT_POLL_SECONDS)
+            if self._error is not None:
+                raise self._error
+
+    def close(self):
+        """
+        Stops sending requests and waits for those in flight
+        """
+        self.cancelled.set()
+        self._thread.join()
@@ -0,0 +1,129 @@
+"""
+Incremental re-weaving of revised documents
+
+Every woven paragraph (outside tables) and table cell is fingerprinted by the
+content hash of its runs together with the model, purpose and prompt, and the
+transformation output of each run is kept in the weave result. Weaving a
+revision with that result reuses the outputs of every paragraph/cell whose
+fingerprint is unchanged (wherever it moved to), so only new or edited ones
+reach the LLM. Paragraphs woven whole (paragraph granularity) have a single
+output, for their marked text.
+"""
+
+import hashlib
+import json
+import sys
+from typing import TYPE_CHECKING, Any, Callable
+from .results import ResultTable
+
+# pandas Is Only Imported To Read Parquet Tables
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Transformed text of a run, None when it was left as is (skipped or failed, so tried again)
+RunOutput = str | None
+
+
+def fingerprint(texts: list[str], prompt: str, purpose: str, model_name: str) -> str:
+    """
+    Content hash of the runs of a paragraph/cell, in the context they are woven in
+    """
+    payload = json.dumps([model_name, purpose, prompt, texts], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def load_previous(previous: "dict[str, Any] | ResultTable | pd.DataFrame | str") -> dict[str, Any]:
+    """
+    A previous weave result: nested or with a table of runs (see
+    results.ResultTable), a table alone, or the path of a JSON dump of a
+    nested result or of a Parquet table
+    """
+    if isinstance(previous, str):
+        if previous.endswith(".parquet"):
+            import pandas as pd  # pylint: disable=import-outside-toplevel,redefined-outer-name
+            return {"runs": pd.read_parquet(previous)}
+        with open(previous, encoding="utf-8") as f:
+            return json.load(f)
+    if _is_table(previous):
+        return {"runs": previous}
+    return previous
+
+
+def _is_table(value: Any) -> bool:
+    """
+    Whether value is a table of runs: a ResultTable or a DataFrame (which can
+    only be one if pandas was imported)
+    """
+    pd = sys.modules.get("pandas")  # pylint: disable=redefined-outer-name
+    return isinstance(value, ResultTable) or (pd is not None and isinstance(value, pd.DataFrame))
+
+
+def collect_outputs(result: dict[str, Any]) -> dict[str, list[RunOutput]]:
+    """
+    Run outputs of every fingerprinted paragraph/cell of a weave result (or any
+    part of it, e.g. just its "paragraphs"), in document order
+    """
+    outputs: dict[str, list[RunOutput]] = {}
+    table = result.get("runs")
+    if _is_table(table):
+        columns = table.columns if isinstance(table, ResultTable) else table
+        # Rows Are In Document Order, Grouped By Paragraph/Cell
+        units: dict[str, tuple[str, list[RunOutput]]] = {}
+        for unit, unit_fingerprint, output in zip(
+            columns["unit"], columns["fingerprint"], columns["output"]
+        ):
+            units.setdefault(unit, (unit_fingerprint, []))[1].append(
+                output if isinstance(output, str) else None
+            )
+        return dict(units.values())
+
+    def _runs(data: dict) -> list[RunOutput]:
+        return [
+            run.get("output")
+            for _, run in sorted(data.get("runs", {}).items(), key=lambda item: int(item[0]))
+        ]
+
+    def _collect(data: Any):
+        if not isinstance(data, dict):
+            return
+        if "fingerprint" in data:
+            if "paragraphs" in data and "runs" not in data:
+                # Cell, Runs Of Its Own Paragraphs
+                runs = []
+                paragraphs = sorted(data["paragraphs"].items(), key=lambda item: int(item[0]))
+                for _, paragraph in paragraphs:
+                    runs += _runs(paragraph)
+            elif "paragraph" in data:
+                # Paragraph Woven Whole
+                runs = [data["paragraph"].get("output")]
+            else:
+                runs = _runs(data)
+            outputs[data["fingerprint"]] = runs
+        for value in data.values():
+            _collect(value)
+
+    _collect(result)
+    return outputs
+
+
+class ReplayTransform:
+    """
+    Wraps a transform function, returning the reused output of the current run
+    instead when there is one, and keeping the output (and the usage, see
+    dispatch.IndexedTransform) of the last call
+    """
+    def __init__(self, transform_fn: Callable[..., tuple[str, bool, bool]]):
+        self.transform_fn = transform_fn
+        self.replay: RunOutput = None
+        self.output: RunOutput = None
+        self.usage: dict[str, float] | None = None
+
+    def __call__(self, **kwargs) -> tuple[str, bool, bool]:
+        if self.replay is not None:
+            result = (self.replay, True, True)
+            self.usage = None
+        else:
+            result = self.transform_fn(**kwargs)
+            self.usage = getattr(self.transform_fn, "usage", None)
+        self.output = result[0] if result[1] else None
+        return result
@@ -0,0 +1,85 @@
+"""
+Append-only progress journal of a weave
+
+Every run whose transformation is finished is appended to a JSON lines file
+as soon as its output is known, keyed by its location path and the hash of its
+source text (with the model, purpose and prompt). A weave resumed from the
+journal replays the outputs of the runs still matching their entry into the
+freshly loaded document, so only the remaining runs reach the LLM.
+
+Each line is flushed when written, so a killed process loses at most the line
+being written; a truncated last line is ignored when loading.
+"""
+
+import json
+import logging
+import os
+import threading
+
+# Logger
+log = logging.getLogger(__name__)
+
+# (location path, source hash) -> output
+JournalEntries = dict[tuple[tuple[str, ...], str], str]
+
+
+def load_journal(path: str) -> JournalEntries:
+    """
+    Entries of a journal (empty if there is none yet)
+    """
+    entries: JournalEntries = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path, encoding="utf-8") as f:
+        for ix_line, line in enumerate(f):
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                log.warning("Ignoring Truncated Journal Line %s Of %s", ix_line + 1, path)
+                continue
+            entries[(tuple(entry["path"]), entry["source_hash"])] = entry["output"]
+    return entries
+
+
+class Journal:
+    """
+    Writer of a progress journal
+    path: str - Path to the JSON lines file
+    resume: bool - Append to an existing journal instead of starting a new one
+    """
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self.entries = 0
+        self._lock = threading.Lock()
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")  # pylint: disable=consider-using-with
+        # Terminate A Line Truncated By A Crash, So New Entries Start On Their Own
+        if resume and self._file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")
+
+    def record(self, path: tuple[str, ...], source_hash: str, output: str):
+        """
+        Appends the output of a finished run
+        """
+        line = json.dumps(
+            {"path": list(path), "source_hash": source_hash, "output": output}, ensure_ascii=False
+        )
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.entries += 1
+
+    def close(self):
+        """
+        Closes the journal file
+        """
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,374 @@
+"""
+Performance metrics of a weave
+
+A WeaveMetrics collector is made current (through a context variable, so it
+follows asyncio tasks) for the duration of a weave. Instrumented code records
+into whichever collector is current, and does nothing when there is none:
+    - timed(stage) spans: wall time and call counts per stage (traversal,
+      cleanup_bad_runs, pre-flight, generation, comments, save...)
+    - record_request: latency histogram, outcome and usage tokens (including
+      prompt tokens read from the provider's prompt cache) of every API
+      attempt (made by the rate limiter), also broken down by model
+    - increment: plain counters (e.g. cache hits/misses)
+API attempts are also added to the innermost usage_scope, which attributes
+latency and tokens to the segments they were made for.
+Every finished span is also passed to the collector's hooks, e.g. to forward
+it to a tracer. The collected data is returned as a plain dict, which can be
+exported in the Prometheus text format or as JSON.
+"""
+
+from typing import Any, Callable, Iterator, NamedTuple
+import contextlib
+import contextvars
+import json
+import logging
+import threading
+import time
+
+# Logger
+log = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the API latency histogram buckets
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+
+class Span(NamedTuple):
+    """
+    A finished, timed piece of work
+    name: str - Stage name
+    start: float - Wall clock start (time.time())
+    seconds: float - Duration
+    attributes: dict - Extra details given to timed()
+    """
+    name: str
+    start: float
+    seconds: float
+    attributes: dict
+
+
+SpanHook = Callable[[Span], None]
+
+
+class WeaveMetrics:
+    """
+    Collector of the metrics of one weave
+    hooks: list[SpanHook] - Called with every finished span
+    """
+    def __init__(self, hooks: list[SpanHook] | None = None):
+        self.hooks = list(hooks or [])
+        self.stages: dict[str, dict[str, float]] = {}
+        self.counters: dict[str, int] = {}
+        self.requests = {"attempts": 0, "ok": 0, "throttled": 0, "truncated": 0, "errors": 0}
+        self.tokens = {"prompt": 0, "completion": 0, "total": 0, "cached": 0}
+        self.latency = {
+            "buckets": [0] * (len(LATENCY_BUCKETS) + 1), "count": 0, "sum": 0.0, "max": 0.0
+        }
+        self.models: dict[str, dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def activate(self) -> Iterator["WeaveMetrics"]:
+        """
+        Makes this collector the current one within the block
+        """
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def record_span(self, span: Span):
+        """
+        Adds a finished span to its stage and passes it to the hooks
+        """
+        with self._lock:
+            stage = self.stages.setdefault(span.name, {"calls": 0, "seconds": 0.0})
+            stage["calls"] += 1
+            stage["seconds"] += span.seconds
+        for hook in self.hooks:
+            try:
+                hook(span)
+            except Exception:  # pylint: disable=broad-except
+                log.exception("Metrics Hook Failed On %s", span.name)
+
+    def record_request(
+        self,
+        seconds: float,
+        outcome: str,
+        usage=None,
+        model_name: str | None = None
+    ):
+        """
+        Records an API attempt: its latency, outcome (ok, throttled, truncated
+        or error) and the tokens of its completion usage, in total and for
+        its model (when given)
+        """
+        with self._lock:
+            self.requests["attempts"] += 1
+            self.requests["errors" if outcome == "error" else outcome] += 1
+            ix_bucket = next(
+                (ix for ix, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound),
+                len(LATENCY_BUCKETS)
+            )
+            self.latency["buckets"][ix_bucket] += 1
+            self.latency["count"] += 1
+            self.latency["sum"] += seconds
+            self.latency["max"] = max(self.latency["max"], seconds)
+            if usage is not None:
+                for kind in ["prompt", "completion", "total"]:
+                    self.tokens[kind] += getattr(usage, f"{kind}_tokens", None) or 0
+                self.tokens["cached"] += cached_tokens(usage)
+            if model_name is not None:
+                model = self.models.setdefault(model_name, _model_metrics())
+                model["attempts"] += 1
+                model["ok"] += outcome == "ok"
+                model["seconds"] += seconds
+                if usage is not None:
+                    model["prompt_tokens"] += getattr(usage, "prompt_tokens", None) or 0
+                    model["completion_tokens"] += getattr(usage, "completion_tokens", None) or 0
+
+    def increment(self, name: str, amount: int = 1):
+        """
+        Adds to a counter
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        The metrics as a plain (JSON-serializable) dict
+        """
+        with self._lock:
+            return {
+                "stages": {
+                    name: {"calls": stage["calls"], "seconds": round(stage["seconds"], 6)}
+                    for name, stage in self.stages.items()
+                },
+                "requests": dict(self.requests),
+                "tokens": dict(self.tokens),
+                "latency": {
+                    "buckets": dict(zip(
+                        [str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"],
+                        self.latency["buckets"]
+                    )),
+                    "count": self.latency["count"],
+                    "sum": round(self.latency["sum"], 6),
+                    "max": round(self.latency["max"], 6)
+                },
+                "counters": dict(self.counters),
+                "models": {
+                    name: {**model, "seconds": round(model["seconds"], 6)}
+                    for name, model in self.models.items()
+                }
+            }
+
+
+# Collector Of The Weave Running In This Context (if any)
+_current: contextvars.ContextVar[WeaveMetrics | None] = contextvars.ContextVar(
+    "weave_metrics", default=None
+)
+
+
+def current() -> WeaveMetrics | None:
+    """
+    The collector of the weave running in this context
+    """
+    return _current.get()
+
+
+@contextlib.contextmanager
+def timed(name: str, **attributes) -> Iterator[None]:
+    """
+    Times the block as a span of stage `name` in the current collector
+    """
+    collector = _current.get()
+    if collector is None:
+        yield
+        return
+    start = time.time()
+    start_counter = time.perf_counter()
+    try:
+        yield
+    finally:
+        collector.record_span(Span(name, start, time.perf_counter() - start_counter, attributes))
+
+
+# Latency/Tokens Of The Requests Made Within The Innermost usage_scope (if any)
+_usage: contextvars.ContextVar[dict[str, float] | None] = contextvars.ContextVar(
+    "request_usage", default=None
+)
+
+
+@contextlib.contextmanager
+def usage_scope() -> Iterator[dict[str, float]]:
+    """
+    Accumulates the API attempts made within the block: their number, latency
+    and usage tokens
+    """
+    usage = {"requests": 0, "latency": 0.0, "prompt_tokens": 0, "completion_tokens": 0}
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+
+def record_request(seconds: float, outcome: str, usage=None, model_name: str | None = None):
+    """
+    Records an API attempt in the current collector and usage scope
+    """
+    collector = _current.get()
+    if collector is not None:
+        collector.record_request(
+            seconds=seconds, outcome=outcome, usage=usage, model_name=model_name
+        )
+    scope = _usage.get()
+    if scope is not None:
+        scope["requests"] += 1
+        scope["latency"] += seconds
+        if usage is not None:
+            scope["prompt_tokens"] += getattr(usage, "prompt_tokens", None) or 0
+            scope["completion_tokens"] += getattr(usage, "completion_tokens", None) or 0
+
+
+def _model_metrics() -> dict[str, float]:
+    """
+    Empty per-model totals of API attempts
+    """
+    return {"attempts": 0, "ok": 0, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0}
+
+
+def cached_tokens(usage) -> int:
+    """
+    Prompt tokens of a completion usage served from the provider's prompt
+    cache (usage.prompt_tokens_details.cached_tokens, 0 when not reported)
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        return details.get("cached_tokens") or 0
+    return getattr(details, "cached_tokens", None) or 0
+
+
+def increment(name: str, amount: int = 1):
+    """
+    Adds to a counter of the current collector
+    """
+    collector = _current.get()
+    if collector is not None:
+        collector.increment(name, amount)
+
+
+def merge_metrics(datas: list[dict[str, Any]]) -> dict[str, Any]:
+    """
+    Sum of the metrics dicts of several weaves (e.g. every document of a batch)
+    """
+    merged = WeaveMetrics().to_dict()
+    for data in datas:
+        for name, stage in data["stages"].items():
+            total = merged["stages"].setdefault(name, {"calls": 0, "seconds": 0.0})
+            total["calls"] += stage["calls"]
+            total["seconds"] = round(total["seconds"] + stage["seconds"], 6)
+        for section in ["requests", "tokens", "counters"]:
+            for key, count in data[section].items():
+                merged[section][key] = merged[section].get(key, 0) + count
+        for bound, count in data["latency"]["buckets"].items():
+            merged["latency"]["buckets"][bound] += count
+        merged["latency"]["count"] += data["latency"]["count"]
+        merged["latency"]["sum"] = round(merged["latency"]["sum"] + data["latency"]["sum"], 6)
+        merged["latency"]["max"] = max(merged["latency"]["max"], data["latency"]["max"])
+        for name, model in data.get("models", {}).items():
+            total = merged["models"].setdefault(name, _model_metrics())
+            for key, value in model.items():
+                total[key] = round(total[key] + value, 6)
+    return merged
+
+
+def to_json(data: dict[str, Any]) -> str:
+    """
+    Metrics dict (as returned under weave_result["metrics"]) as JSON
+    """
+    return json.dumps(data, indent=2)
+
+
+def to_prometheus(
+    data: dict[str, Any],
+    prefix: str = "docx_weaver",
+    labels: dict[str, str] | None = None
+) -> str:
+    """
+    Metrics dict (as returned under weave_result["metrics"]) in the Prometheus
+    text exposition format
+    """
+    def _labels(**extra) -> str:
+        pairs = {**(labels or {}), **extra}
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs.items()) + "}"
+
+    lines = []
+
+    def _metric(name: str, kind: str, help_text: str, samples: list[tuple[str, float]]):
+        lines.append(f"# HELP {prefix}_{name} {help_text}")
+        lines.append(f"# TYPE {prefix}_{name} {kind}")
+        lines.extend(f"{prefix}_{sample} {value}" for sample, value in samples)
+
+    _metric("stage_seconds_total", "counter", "Time spent per stage", [
+        (f"stage_seconds_total{_labels(stage=name)}", stage["seconds"])
+        for name, stage in data["stages"].items()
+    ])
+    _metric("stage_calls_total", "counter", "Spans per stage", [
+        (f"stage_calls_total{_labels(stage=name)}", stage["calls"])
+        for name, stage in data["stages"].items()
+    ])
+    _metric("requests_total", "counter", "API attempts by outcome", [
+        (f"requests_total{_labels(outcome=outcome)}", count)
+        for outcome, count in data["requests"].items() if outcome != "attempts"
+    ])
+    _metric("tokens_total", "counter", "Tokens from completion usage", [
+        (f"tokens_total{_labels(kind=kind)}", count) for kind, count in data["tokens"].items()
+    ])
+    # Histogram Buckets Are Cumulative
+    cumulative = 0
+    buckets = []
+    for bound, count in data["latency"]["buckets"].items():
+        cumulative += count
+        buckets.append((f"request_latency_seconds_bucket{_labels(le=bound)}", cumulative))
+    _metric("request_latency_seconds", "histogram", "Latency of API attempts", buckets + [
+        (f"request_latency_seconds_sum{_labels()}", data["latency"]["sum"]),
+        (f"request_latency_seconds_count{_labels()}", data["latency"]["count"])
+    ])
+    for name, count in data["counters"].items():
+        _metric(f"{name}_total", "counter", name.replace("_", " ").capitalize(), [
+            (f"{name}_total{_labels()}", count)
+        ])
+    models = data.get("models", {})
+    if models:
+        _metric("model_requests_total", "counter", "API attempts by model and outcome", [
+            (f"model_requests_total{_labels(model=name, outcome=outcome)}", model[key])
+            for name, model in models.items()
+            for outcome, key in [("all", "attempts"), ("ok", "ok")]
+        ])
+        _metric("model_request_seconds_total", "counter", "Latency of API attempts by model", [
+            (f"model_request_seconds_total{_labels(model=name)}", model["seconds"])
+            for name, model in models.items()
+        ])
+        _metric("model_tokens_total", "counter", "Tokens from completion usage by model", [
+            (f"model_tokens_total{_labels(model=name, kind=kind)}", model[f"{kind}_tokens"])
+            for name, model in models.items() for kind in ["prompt", "completion"]
+        ])
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    """
+    Prometheus label value escaping
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def write_metrics(data: dict[str, Any], path: str, labels: dict[str, str] | None = None):
+    """
+    Writes a metrics dict as JSON (.json) or in the Prometheus text format
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(to_json(data) if path.endswith(".json") else to_prometheus(data, labels=labels))
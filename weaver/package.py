@@ -0,0 +1,120 @@
+"""
+Fast saving of woven documents
+
+document.save re-serializes and re-compresses every part of the package,
+including media and fonts the weave never touches. save_document writes the
+package the same way (same parts, relationships and content types), except
+that parts whose bytes are unchanged from the source package (same size and
+CRC) have their compressed data copied from the source as is. Only the parts
+the weave modified (document, headers/footers, notes, comments...) are
+compressed again, so saving costs in proportion to the edited text rather than
+to the size of the media.
+"""
+
+import copy
+import logging
+import os
+import struct
+import zipfile
+import zlib
+from docx.opc.pkgwriter import PackageWriter
+from . import metrics
+
+# Logger
+log = logging.getLogger(__name__)
+
+# Entries read with a data descriptor get their sizes in the copied local header
+DATA_DESCRIPTOR_FLAG = 0x08
+
+
+class _CopyingZipWriter:
+    """
+    Physical package writer (see docx.opc.phys_pkg) copying entries unchanged
+    from the source package instead of compressing them again
+    """
+    def __init__(self, pkg_file: str, source: zipfile.ZipFile):
+        self._zipf = zipfile.ZipFile(  # pylint: disable=consider-using-with
+            pkg_file, "w", compression=zipfile.ZIP_DEFLATED
+        )
+        self._source = source
+        self._source_infos = {info.filename: info for info in source.infolist()}
+        self.stats = {"copied": 0, "copied_bytes": 0, "written": 0, "written_bytes": 0}
+
+    def write(self, pack_uri, blob: bytes):
+        """
+        Writes blob as the entry of pack_uri, copying the source entry when it
+        holds the same bytes
+        """
+        name = pack_uri.membername
+        info = self._source_infos.get(name)
+        if (
+            info is not None
+            and info.file_size == len(blob)
+            and info.compress_type in [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED]
+            and info.CRC == zlib.crc32(blob)
+        ):
+            self._copy(info)
+            self.stats["copied"] += 1
+            self.stats["copied_bytes"] += len(blob)
+            return
+        self._zipf.writestr(name, blob)
+        self.stats["written"] += 1
+        self.stats["written_bytes"] += len(blob)
+
+    def _copy(self, info: zipfile.ZipInfo):
+        """
+        Appends the compressed data of a source entry, without recompressing it
+        """
+        # Data Follows The Local Header, Whose Name/Extra Lengths May Differ From The Central One
+        source_fp = self._source.fp
+        source_fp.seek(info.header_offset)
+        header = source_fp.read(zipfile.sizeFileHeader)
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        source_fp.seek(info.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+        data = source_fp.read(info.compress_size)
+
+        copied = copy.copy(info)
+        copied.flag_bits &= ~DATA_DESCRIPTOR_FLAG
+        copied.extra = b""
+        copied.header_offset = self._zipf.fp.tell()
+        self._zipf.fp.write(copied.FileHeader())
+        self._zipf.fp.write(data)
+        # Register The Entry For The Central Directory Written On Close
+        self._zipf.filelist.append(copied)
+        self._zipf.NameToInfo[copied.filename] = copied
+        self._zipf.start_dir = self._zipf.fp.tell()
+        self._zipf._didModify = True  # pylint: disable=protected-access
+
+    def close(self):
+        """
+        Writes the central directory
+        """
+        self._zipf.close()
+
+
+def save_document(document, output_fn: str, source_fn) -> dict[str, int] | None:
+    """
+    Saves document to output_fn, copying the parts left unchanged from the
+    package it was loaded from (source_fn). Falls back to document.save when
+    the source is not a file path (or is the output itself), returning None.
+    """
+    if not isinstance(source_fn, str) or os.path.abspath(source_fn) == os.path.abspath(output_fn):
+        document.save(output_fn)
+        return None
+
+    package = document.part.package
+    for part in package.parts:
+        part.before_marshal()
+    with zipfile.ZipFile(source_fn) as source:
+        writer = _CopyingZipWriter(output_fn, source)
+        try:
+            # Same Layout As PackageWriter.write
+            PackageWriter._write_content_types_stream(writer, package.parts)  # pylint: disable=protected-access
+            PackageWriter._write_pkg_rels(writer, package.rels)  # pylint: disable=protected-access
+            PackageWriter._write_parts(writer, package.parts)  # pylint: disable=protected-access
+        finally:
+            writer.close()
+    for key, value in writer.stats.items():
+        metrics.increment(f"save_{key}", value)
+    log.debug("Saved %s: %s", output_fn, writer.stats)
+    return writer.stats
@@ -0,0 +1,194 @@
+"""
+Dry-run planning of weaves
+
+DocxWeaver.plan goes through a document as weave_document does (traversal
+with cleanup_bad_runs, the skip rules, deduplication, routing and the cache)
+but sends nothing to the LLM. plan_requests turns the unique segments left
+into the requests the weave would make: one per segment, or one per batch
+with batch_tokens, each to the first model of its route. Prompt tokens are
+counted on the messages that would be sent. Replies are assumed as long as
+their source, in the reply format. Each request reserves its prompt plus
+max_tokens against the tokens-per-minute budget, as the rate limiter does.
+
+project_wall_time bounds the duration of the requests by their latency at a
+given concurrency, and by the requests/tokens per minute of each model (whose
+budgets start full, so the first minute of each is free). Escalations from the
+fast model, retries and throttling are not accounted for.
+"""
+
+from typing import Any, NamedTuple
+import json
+import logging
+from . import dispatch, ratelimit, routing, word
+from .dedupe import SegmentKey
+
+# Logger
+log = logging.getLogger(__name__)
+
+# Assumed latency of a request: a fixed overhead plus the time to generate the
+# reply (see the tokens_per_second of routing.model_report for measured values)
+REQUEST_OVERHEAD_SECONDS = 0.5
+COMPLETION_TOKENS_PER_SECOND = 50.0
+# Counts of a model's requests in a plan, summed by merge_plans
+MODEL_COUNTS = [
+    "requests", "segments", "prompt_tokens", "completion_tokens", "reserved_tokens",
+    "request_seconds"
+]
+# Counts of a plan, summed by merge_plans (parts count their runs, skipped runs and segments)
+SEGMENT_COUNTS = ["runs", "skipped", "segments", "cached", "requests"]
+
+
+class PlannedRequest(NamedTuple):
+    """
+    Request the weave would make
+    """
+    model_name: str
+    segments: int
+    prompt_tokens: int
+    completion_tokens: int
+    max_tokens: int
+
+
+def plan_requests(
+    keys: list[SegmentKey],
+    batch_tokens: int | None = None,
+    router: routing.ModelRouter | None = None
+) -> list[PlannedRequest]:
+    """
+    Requests generating the segments, batched as dispatch.agenerate_transformations
+    would with batch_tokens
+    """
+    if batch_tokens is None:
+        batches = [[key] for key in keys]
+    else:
+        batches = dispatch.pack_batches(keys=keys, batch_tokens=batch_tokens, router=router)
+    requests = []
+    for batch in batches:
+        model_name, purpose, prompt, src_text = batch[0]
+        if router is not None:
+            model_name = router.cascade(batch[0])[0]
+        if len(batch) == 1:
+            messages = word.build_transformation_messages(
+                src_text=src_text, prompt=prompt, purpose=purpose
+            )
+            reply = {"skip": False, "tgt_text": src_text}
+            max_tokens = word.output_token_budget(src_text, model_name)
+        else:
+            segments = {str(ix): key.src_text for ix, key in enumerate(batch)}
+            messages = word.build_batch_transformation_messages(
+                segments=segments, prompt=prompt, purpose=purpose
+            )
+            reply = {"results": [
+                {"id": seg_id, "skip": False, "tgt_text": text} for seg_id, text in segments.items()
+            ]}
+            max_tokens = min(word.MAX_OUTPUT_TOKENS, sum(
+                word.output_token_budget(text, model_name) + word.BATCH_OVERHEAD_TOKENS
+                for text in segments.values()
+            ))
+        requests.append(PlannedRequest(
+            model_name=model_name,
+            segments=len(batch),
+            prompt_tokens=sum(
+                word.count_tokens(message["content"], model_name) for message in messages
+            ),
+            completion_tokens=word.count_tokens(json.dumps(reply, ensure_ascii=False), model_name),
+            max_tokens=max_tokens
+        ))
+    return requests
+
+
+def summarize_requests(
+    requests: list[PlannedRequest],
+    prices: dict[str, tuple[float, float]],
+    tokens_per_second: float = COMPLETION_TOKENS_PER_SECOND
+) -> dict[str, dict[str, Any]]:
+    """
+    Requests, segments, tokens (expected and reserved), request time and cost
+    of each model
+    """
+    assert tokens_per_second > 0
+    models: dict[str, dict[str, Any]] = {}
+    for request in requests:
+        model = models.setdefault(request.model_name, dict.fromkeys(MODEL_COUNTS, 0))
+        model["requests"] += 1
+        model["segments"] += request.segments
+        model["prompt_tokens"] += request.prompt_tokens
+        model["completion_tokens"] += request.completion_tokens
+        model["reserved_tokens"] += request.prompt_tokens + request.max_tokens
+        model["request_seconds"] += (
+            REQUEST_OVERHEAD_SECONDS + request.completion_tokens / tokens_per_second
+        )
+    for name, model in models.items():
+        model["request_seconds"] = round(model["request_seconds"], 3)
+        model["cost"] = routing.token_cost(
+            name, model["prompt_tokens"], model["completion_tokens"], prices=prices
+        )
+    return models
+
+
+def project_wall_time(
+    models: dict[str, dict[str, Any]],
+    concurrency: int,
+    requests_per_minute: dict[str, int],
+    tokens_per_minute: dict[str, int]
+) -> dict[str, Any]:
+    """
+    Projected duration of the requests of each model (see summarize_requests)
+    sent with at most `concurrency` in flight, within the per-minute budgets of
+    each model. Returns the seconds, and which bound they come from: "latency"
+    or "<model>:requests"/"<model>:tokens" for a per-minute budget.
+    """
+    assert concurrency > 0
+    bounds = {"latency": sum(model["request_seconds"] for model in models.values()) / concurrency}
+    for name, model in models.items():
+        for bound, count, per_minute in [
+            ("requests", model["requests"],
+             requests_per_minute.get(name, ratelimit.DEFAULT_REQUESTS_PER_MINUTE)),
+            ("tokens", model["reserved_tokens"],
+             tokens_per_minute.get(name, ratelimit.DEFAULT_TOKENS_PER_MINUTE)),
+        ]:
+            # The Budget Starts Full, The Rest Refills Over Time
+            bounds[f"{name}:{bound}"] = max(0.0, count / per_minute - 1) * 60
+    bound = max(bounds, key=bounds.get)
+    return {
+        "concurrency": concurrency,
+        "seconds": round(bounds[bound], 3),
+        "minutes": round(bounds[bound] / 60, 2),
+        "bound": bound,
+        "bounds": {name: round(seconds, 3) for name, seconds in bounds.items()}
+    }
+
+
+def merge_plans(
+    plans: list[dict[str, Any]],
+    concurrency: int,
+    requests_per_minute: dict[str, int],
+    tokens_per_minute: dict[str, int]
+) -> dict[str, Any]:
+    """
+    Plan of several documents woven together (e.g. a CLI batch), sharing the
+    concurrency and the per-minute budgets
+    """
+    merged: dict[str, Any] = dict.fromkeys(SEGMENT_COUNTS, 0)
+    merged.update({"documents": len(plans), "parts": {}, "models": {}})
+    for plan in plans:
+        for name in SEGMENT_COUNTS:
+            merged[name] += plan[name]
+        for part, counts in plan["parts"].items():
+            merged_counts = merged["parts"].setdefault(part, dict.fromkeys(counts, 0))
+            for name, value in counts.items():
+                merged_counts[name] += value
+        for name, model in plan["models"].items():
+            merged_model = merged["models"].setdefault(name, dict.fromkeys(MODEL_COUNTS, 0))
+            for count in MODEL_COUNTS:
+                merged_model[count] += model[count]
+            merged_model["cost"] = None if model["cost"] is None else (
+                round((merged_model.get("cost") or 0.0) + model["cost"], 6)
+            )
+    merged["wall_time"] = project_wall_time(
+        merged["models"],
+        concurrency=concurrency,
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute
+    )
+    return merged
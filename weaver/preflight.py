@@ -0,0 +1,204 @@
+"""
+Pre-flight classification of all segments of a document at once
+
+The per-run checks (check_formats_not_to_translate, then
+parse_and_prepare_src_text_transforms) reduce to two rules, applied with
+compiled patterns: skip texts with less than two letters (which covers digits
+only and brackets without letters) and short company names. Most texts neither
+start with punctuation/quotes nor end with a colon or semicolon, so their
+preparation is only whitespace bookkeeping, an appended period and
+lower-casing. The remaining texts go through
+parse_and_prepare_src_text_transforms itself. Texts with marked formatting
+spans (whole paragraphs, see word.mark_spans) are checked without their
+markers and otherwise sent as is.
+
+prepare_segments applies the rules text by text (classify_text), without
+copying the texts or importing pandas. classify_segments applies them to a
+whole column of texts with pandas string operations, returning a DataFrame;
+with the time to import pandas aside, it is still about twice as slow per text
+from a thousand to 300k unique texts, so weaves do not use it.
+"""
+
+import re
+import string
+from typing import TYPE_CHECKING, Iterable
+from . import word
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Transform metadata, as returned by word.parse_and_prepare_src_text_transforms
+TRANSFORM_COLUMNS = [
+    "ltab", "rtab", "lnewline", "rnewline", "lspace", "rspace",
+    "outer_quotes", "outer_parens", "outer_triangles", "outer_square_parens",
+    "ltriangle", "rcolon", "rsemicolon", "titled", "appended_period", "lpunct", "rpunct"
+]
+# At least two letters, when they are ASCII (others are counted with str.isalpha)
+TWO_ASCII_LETTERS = re.compile(r"[A-Za-z][^A-Za-z]*[A-Za-z]")
+# Candidates for check_only_company_name (any character upper-casing to the
+# abbreviation's letters), confirmed on the upper-cased words
+CORP_ABBR_CANDIDATE = re.compile(r"[iIı][nN][cC]\.|[cC][oO][rR][pP]\.|[lL][tT][dD]\.|[lL][lL][cC]")
+CORP_ABBR_WORD = re.compile(r"(?<!\S)(?:INC\.|CORP\.|LTD\.|LLC)(?!\S)")
+SIX_WORDS = re.compile(r"\s*(?:\S+\s+){5}\S")
+FOUR_WORDS = re.compile(r"\s*(?:\S+\s+){3}\S")
+PUNCTUATION = re.compile(f"[{re.escape(string.punctuation)}]")
+# Texts needing the full preparation (outer quotes/brackets/punctuation, colons)
+SPECIAL_FIRST = list(string.punctuation + "“")
+SPECIAL_LAST = [":", ";"]
+
+
+def classify_segments(texts: Iterable[str]) -> "pd.DataFrame":
+    """
+    One row per text, with the `skip` mask of check_formats_not_to_translate
+    and, for the other texts, the `prepared_text` and transform columns of
+    parse_and_prepare_src_text_transforms
+    """
+    import pandas as pd  # pylint: disable=import-outside-toplevel,redefined-outer-name
+    src = pd.Series(list(texts), dtype=object)
+    frame = pd.DataFrame({"src_text": src})
+    # Marked Paragraphs Are Checked Without Their Markers
+    marked = src.str.startswith("<s1>")
+    checked = src.where(~marked, src[marked].map(word.strip_span_markers))
+
+    # Less Than Two Letters
+    few_letters = ~checked.str.contains(TWO_ASCII_LETTERS).to_numpy(dtype=bool)
+    few_letters[few_letters] = [sum(map(str.isalpha, text)) <= 1 for text in checked[few_letters]]
+    # Only Company Name
+    company_name = (
+        checked.str.contains(CORP_ABBR_CANDIDATE) & ~checked.str.match(SIX_WORDS)
+    ).to_numpy(dtype=bool)
+    company_name[company_name] = [
+        CORP_ABBR_WORD.search(text.upper()) is not None for text in checked[company_name]
+    ]
+    frame["skip"] = few_letters | company_name
+
+    prepared = _prepare(src[~frame["skip"]])
+    return frame.join(prepared)
+
+
+def _prepare(src: "pd.Series") -> "pd.DataFrame":
+    """
+    parse_and_prepare_src_text_transforms over a column of texts
+    """
+    import pandas as pd  # pylint: disable=import-outside-toplevel,redefined-outer-name
+    stripped = src.str.strip()
+    special = stripped.str[:1].isin(SPECIAL_FIRST) | stripped.str[-1:].isin(SPECIAL_LAST)
+    plain = src[~special]
+
+    # Count Special Cases and Remove Before Running (added back later)
+    data = pd.DataFrame(index=plain.index, columns=TRANSFORM_COLUMNS, dtype=object)
+    data[TRANSFORM_COLUMNS[6:-2]] = False
+    data["ltab"] = plain.str.startswith("\t")
+    data["rtab"] = plain.str.endswith("\t")
+    data["lnewline"] = plain.str.startswith("\n")
+    data["rnewline"] = plain.str.endswith("\n")
+    length = plain.str.len()
+    data["lspace"] = length - plain.str.lstrip().str.len() - data["ltab"] - data["lnewline"]
+    data["rspace"] = length - plain.str.rstrip().str.len() - data["rtab"] - data["rnewline"]
+    data["lpunct"] = data["rpunct"] = None
+    text = stripped[~special]
+
+    # Append Period? (no punctuation at all, so none at the end either)
+    data["appended_period"] = ~text.str.contains(PUNCTUATION) & text.str.match(FOUR_WORDS)
+    text = text.where(~data["appended_period"], text + ".")
+
+    # Check If Entire Input Is UpperCase
+    data["titled"] = text.str.isupper() & ~text.str.contains("US$", regex=False)
+    text = text.where(~data["titled"], text.str.lower())
+    data["prepared_text"] = text
+
+    # Quotes, Brackets, Punctuation And Colons, One By One
+    rows = [word.parse_and_prepare_src_text_transforms(src_text) for src_text in src[special]]
+    special_data = pd.DataFrame(
+        [transforms_dict for _, transforms_dict in rows],
+        index=src.index[special],
+        columns=TRANSFORM_COLUMNS
+    )
+    special_data["prepared_text"] = [prepared_text for prepared_text, _ in rows]
+    return pd.concat([data, special_data]).loc[src.index, ["prepared_text"] + TRANSFORM_COLUMNS]
+
+
+def classify_text(src_text: str) -> tuple[str, dict] | None:
+    """
+    classify_segments for a single text, with the same compiled rules: None
+    if it is not transformed, else its prepared text and transforms dict
+    """
+    # Marked Paragraphs Are Checked Without Their Markers
+    checked = word.strip_span_markers(src_text) if src_text.startswith("<s1>") else src_text
+    # Less Than Two Letters
+    if TWO_ASCII_LETTERS.search(checked) is None and sum(map(str.isalpha, checked)) <= 1:
+        return None
+    # Only Company Name
+    if (
+        CORP_ABBR_CANDIDATE.search(checked) is not None
+        and SIX_WORDS.match(checked) is None
+        and CORP_ABBR_WORD.search(checked.upper()) is not None
+    ):
+        return None
+
+    text = src_text.strip()
+    if text[:1] in SPECIAL_FIRST or text[-1:] in SPECIAL_LAST:
+        return word.parse_and_prepare_src_text_transforms(src_text)
+    transforms_dict: dict = dict.fromkeys(TRANSFORM_COLUMNS, False)
+    transforms_dict["ltab"] = src_text.startswith("\t")
+    transforms_dict["rtab"] = src_text.endswith("\t")
+    transforms_dict["lnewline"] = src_text.startswith("\n")
+    transforms_dict["rnewline"] = src_text.endswith("\n")
+    transforms_dict["lspace"] = (
+        len(src_text) - len(src_text.lstrip())
+        - transforms_dict["ltab"] - transforms_dict["lnewline"]
+    )
+    transforms_dict["rspace"] = (
+        len(src_text) - len(src_text.rstrip())
+        - transforms_dict["rtab"] - transforms_dict["rnewline"]
+    )
+    transforms_dict["lpunct"] = transforms_dict["rpunct"] = None
+    # Append Period? (no punctuation at all, so none at the end either)
+    if PUNCTUATION.search(text) is None and FOUR_WORDS.match(text) is not None:
+        transforms_dict["appended_period"] = True
+        text += "."
+    # Check If Entire Input Is UpperCase
+    if text.isupper() and "US$" not in text:
+        transforms_dict["titled"] = True
+        text = text.lower()
+    return text, transforms_dict
+
+
+def prepare_segments(texts: Iterable[str]) -> dict[str, tuple[str, dict] | None]:
+    """
+    Classifies the unique texts, mapping each to None (not transformed) or to
+    its prepared text and transforms dict
+    """
+    return {src_text: classify_text(src_text) for src_text in dict.fromkeys(texts)}
+
+
+def frame_segments(frame: "pd.DataFrame") -> dict[str, tuple[str, dict] | None]:
+    """
+    prepare_segments' mapping, from the rows of classify_segments
+    """
+    segments: dict[str, tuple[str, dict] | None] = {
+        src_text: None for src_text in frame.loc[frame["skip"], "src_text"]
+    }
+    kept = frame[~frame["skip"]]
+    columns = [
+        [int(value) for value in kept[column]] if column in ["lspace", "rspace"]
+        else kept[column].tolist()
+        for column in TRANSFORM_COLUMNS
+    ]
+    for src_text, prepared_text, *values in zip(
+        kept["src_text"], kept["prepared_text"], *columns
+    ):
+        segments[src_text] = (prepared_text, dict(zip(TRANSFORM_COLUMNS, values)))
+    return segments
+
+
+def preflight_stats(texts: list[str], segments: dict[str, tuple[str, dict] | None]) -> dict:
+    """
+    Skip counts for the weave result, known before any request is made
+    """
+    skipped = sum(segments[text] is None for text in texts)
+    return {
+        "runs": len(texts),
+        "skipped": skipped,
+        "skip_rate": round(skipped / len(texts), 4) if texts else 0.0
+    }
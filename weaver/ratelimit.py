@@ -0,0 +1,652 @@
+"""
+Shared rate limiting and retry scheduling for LLM requests
+
+One RateLimiter is kept per model for the whole process. It budgets
+requests and tokens per minute with token buckets (kept in sync with the
+API's rate-limit headers), backs off with jitter (honouring Retry-After),
+and adapts the number of requests in flight: additive increase on success,
+multiplicative decrease when throttled.
+
+Requests get a hard timeout, and may be hedged: when a request is still
+pending after a quantile (e.g. p95) of the recent latencies, a duplicate is
+sent and the first successful response is used (async losers are cancelled,
+sync ones are left to finish in the background, holding their slot until
+they do). Hedges are capped to a fraction of the requests made, and only
+sent when the budgets and a slot allow it right away.
+"""
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable
+import asyncio
+import logging
+import random
+import re
+import threading
+import time
+from . import metrics
+
+# Logger
+log = logging.getLogger(__name__)
+
+# Budgets used for models that were never configured
+DEFAULT_REQUESTS_PER_MINUTE = 500
+DEFAULT_TOKENS_PER_MINUTE = 30_000
+DEFAULT_MAX_CONCURRENCY = 64
+DEFAULT_REQUEST_TIMEOUT = 120.0
+# Successful request latencies kept for the hedging quantile, and needed before hedging
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+# Errors of parse_fn on a reply that came back but fails validation
+INVALID_RESPONSE_ERRORS = (ValueError, AssertionError, KeyError)
+
+
+class TruncatedResponse(Exception):
+    """
+    Reply cut off at its max_tokens (finish_reason "length"). It is not
+    retried as is: the caller retries with a larger budget instead.
+    usage - Completion usage of the truncated call (tokens paid for nothing)
+    """
+    def __init__(self, usage=None):
+        super().__init__("Response Truncated At max_tokens")
+        self.usage = usage
+
+
+class TokenBucket:
+    """
+    Per-minute budget, refilled continuously. Reservations may overdraw the
+    bucket, in which case the caller waits until the debt is refilled.
+    """
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        """
+        Adds the budget accrued since the last update
+        """
+        elapsed = now - self.updated
+        self.level = min(self.capacity, self.level + elapsed * self.capacity / 60)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """
+        Takes amount from the bucket, returning seconds until it is covered
+        """
+        self.refill(now)
+        self.level -= min(amount, self.capacity)
+        if self.level >= 0:
+            return 0.0
+        return -self.level * 60 / self.capacity
+
+    def covers(self, amount: float, now: float) -> bool:
+        """
+        Whether amount can be taken without waiting
+        """
+        self.refill(now)
+        return self.level >= min(amount, self.capacity)
+
+
+def parse_reset(value: str | None) -> float | None:
+    """
+    Parses rate-limit reset durations such as "1s", "6m0s" or "20ms"
+    """
+    if not value:
+        return None
+    units = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+
+def parse_retry_after(headers) -> float | None:
+    """
+    Seconds to wait from Retry-After(-ms) headers, if given
+    """
+    if headers is None:
+        return None
+    for name, scale in [("retry-after-ms", 0.001), ("retry-after", 1.0)]:
+        try:
+            return float(headers.get(name)) * scale
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def _is_throttled(error: Exception) -> bool:
+    """
+    Whether a failed attempt was refused by the API's rate limits
+    """
+    # openai Is Loaded By Then (the error comes from its client)
+    import openai  # pylint: disable=import-outside-toplevel
+    return isinstance(error, openai.RateLimitError)
+
+
+class RateLimiter:
+    """
+    Scheduler for all requests to one model
+    requests_per_minute: int - Request budget (RPM)
+    tokens_per_minute: int - Token budget (TPM), prompt plus max output tokens
+    max_concurrency: int - Upper bound for the adaptive number of requests in flight
+    max_attempts: int - Attempts per request before giving up
+    request_timeout: float | None - Seconds before a request is abandoned (and retried)
+    hedge_quantile: float | None - Latency quantile after which a pending request
+        is hedged with a duplicate (no hedging if None)
+    hedge_budget: float - Max hedges, as a fraction of the requests made
+    model_name: str | None - Model the requests go to (labels their metrics)
+    """
+    def __init__(
+        self,
+        requests_per_minute: int = DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = DEFAULT_TOKENS_PER_MINUTE,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        max_attempts: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        request_timeout: float | None = DEFAULT_REQUEST_TIMEOUT,
+        hedge_quantile: float | None = None,
+        hedge_budget: float = 0.05,
+        model_name: str | None = None
+    ):
+        assert requests_per_minute > 0 and tokens_per_minute > 0
+        assert max_concurrency > 0 and max_attempts > 0
+        assert hedge_quantile is None or 0 < hedge_quantile < 1
+        assert hedge_budget >= 0
+        self.requests_bucket = TokenBucket(requests_per_minute)
+        self.tokens_bucket = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(max_concurrency)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.request_timeout = request_timeout
+        self.hedge_quantile = hedge_quantile
+        self.hedge_budget = hedge_budget
+        self.model_name = model_name
+        self.latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.counts = {
+            "requests": 0, "throttled": 0, "retried": 0, "failed": 0, "hedged": 0, "hedge_wins": 0
+        }
+        self._lock = threading.Lock()
+
+    def configure(
+        self,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        max_concurrency: int,
+        request_timeout: float | None = DEFAULT_REQUEST_TIMEOUT,
+        hedge_quantile: float | None = None,
+        hedge_budget: float = 0.05
+    ):
+        """
+        Updates the budgets and hedging, keeping counters and in-flight state
+        """
+        with self._lock:
+            self.requests_bucket.capacity = float(requests_per_minute)
+            self.tokens_bucket.capacity = float(tokens_per_minute)
+            self.max_concurrency = max_concurrency
+            self.concurrency = min(self.concurrency, float(max_concurrency))
+            self.request_timeout = request_timeout
+            self.hedge_quantile = hedge_quantile
+            self.hedge_budget = hedge_budget
+
+    def stats(self) -> dict[str, float]:
+        """
+        Request counters and the current adaptive concurrency
+        """
+        with self._lock:
+            return {**self.counts, "concurrency": round(self.concurrency, 2)}
+
+    def _reserve(self, tokens: int) -> float:
+        """
+        Reserves one request and `tokens` tokens, returning the seconds to wait
+        """
+        with self._lock:
+            now = time.monotonic()
+            return max(
+                self.requests_bucket.reserve(1, now),
+                self.tokens_bucket.reserve(tokens, now),
+                self.paused_until - now
+            )
+
+    def _try_enter(self) -> bool:
+        with self._lock:
+            return self._take_slot()
+
+    def _take_slot(self) -> bool:
+        """
+        Takes a slot for a request if one is free (with the lock held)
+        """
+        if self.in_flight >= max(1, int(self.concurrency)):
+            return False
+        # Slot In The Limit Shared By All Worker Processes (if any)
+        if _shared_semaphore is not None and not _shared_semaphore.acquire(False):
+            return False
+        self.in_flight += 1
+        self.counts["requests"] += 1
+        return True
+
+    def _exit(self):
+        with self._lock:
+            self.in_flight -= 1
+            if _shared_semaphore is not None:
+                _shared_semaphore.release()
+
+    def _request_kwargs(self) -> dict[str, float]:
+        """
+        Extra arguments of request_fn (its timeout)
+        """
+        return {} if self.request_timeout is None else {"timeout": self.request_timeout}
+
+    def _hedge_delay(self) -> float | None:
+        """
+        Seconds after which a pending request is hedged, None when hedging is
+        off or there are too few latencies to estimate it
+        """
+        with self._lock:
+            if self.hedge_quantile is None or len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(self.hedge_quantile * len(latencies)))]
+
+    def _start_hedge(self, tokens: int) -> bool:
+        """
+        Takes a slot and reserves the budgets for a hedge, unless hedges are
+        over budget, or the hedge would have to wait for the rate limits or a
+        slot (a refused hedge takes nothing)
+        """
+        with self._lock:
+            if self.counts["hedged"] + 1 > self.hedge_budget * self.counts["requests"]:
+                return False
+            now = time.monotonic()
+            if (
+                self.paused_until > now
+                or not self.requests_bucket.covers(1, now)
+                or not self.tokens_bucket.covers(tokens, now)
+                or not self._take_slot()
+            ):
+                return False
+            self.requests_bucket.reserve(1, now)
+            self.tokens_bucket.reserve(tokens, now)
+            self.counts["hedged"] += 1
+        metrics.increment("hedges")
+        return True
+
+    def _hold_slot(self, futures: list):
+        """
+        Releases the hedge's slot once the primary and the hedge are both
+        done. The call releases the other slot when it returns, while the
+        loser may still be running.
+        """
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def _done(_):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self._exit()
+        for future in futures:
+            future.add_done_callback(_done)
+
+    def _refund_losers(self, tokens: int, futures: list, winner):
+        """
+        Refunds the unused part of the token reservation of each request of a
+        hedge but the winner (refunded by _record_response), from its usage
+        once it is done
+        """
+        def _refund(future):
+            if future.cancelled() or future.exception() is not None:
+                return
+            _, completion, _ = future.result()
+            with self._lock:
+                self._refund_tokens(tokens, getattr(completion, "usage", None))
+        for future in futures:
+            if future is not None and future is not winner:
+                future.add_done_callback(_refund)
+
+    def _refund_tokens(self, tokens: int, usage):
+        """
+        Gives back the part of a reservation of `tokens` that usage did not
+        spend (with the lock held)
+        """
+        if usage is not None and getattr(usage, "total_tokens", None) is not None:
+            refund = tokens - usage.total_tokens
+            self.tokens_bucket.level = min(
+                self.tokens_bucket.capacity, self.tokens_bucket.level + refund
+            )
+
+    def _record_hedge_win(self):
+        with self._lock:
+            self.counts["hedge_wins"] += 1
+        metrics.increment("hedge_wins")
+
+    def _record_latency(self, seconds: float):
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def _request(self, request_fn: Callable[..., Any], tokens: int) -> Any:
+        """
+        Sends request_fn (hedged when it is slow) and parses the raw response
+        """
+        def _send() -> tuple[Any, Any, float]:
+            start = time.perf_counter()
+            raw = request_fn(**self._request_kwargs())
+            return raw, raw.parse(), time.perf_counter() - start
+
+        delay = self._hedge_delay()
+        if delay is None:
+            raw, completion, seconds = _send()
+            self._record_latency(seconds)
+            return raw, completion
+        executor = ThreadPoolExecutor(max_workers=2)
+        try:
+            primary = executor.submit(_send)
+            pending = {primary}
+            hedge = None
+            done, _ = wait(pending, timeout=delay)
+            if not done and self._start_hedge(tokens):
+                hedge = executor.submit(_send)
+                self._hold_slot([primary, hedge])
+                pending.add(hedge)
+            # First Successful Response Wins
+            while True:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                succeeded = [future for future in done if future.exception() is None]
+                if succeeded or not pending:
+                    future = (succeeded or list(done))[0]
+                    raw, completion, seconds = future.result()
+                    self._record_latency(seconds)
+                    if future is not primary:
+                        self._record_hedge_win()
+                    self._refund_losers(tokens, [primary, hedge], winner=future)
+                    return raw, completion
+        finally:
+            # Losers Finish In The Background (bounded by the request timeout)
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _arequest(self, request_fn: Callable[..., Awaitable[Any]], tokens: int) -> Any:
+        """
+        Async version of _request, cancelling the loser of a hedge
+        """
+        async def _send() -> tuple[Any, Any, float]:
+            start = time.perf_counter()
+            raw = await request_fn(**self._request_kwargs())
+            return raw, raw.parse(), time.perf_counter() - start
+
+        delay = self._hedge_delay()
+        if delay is None:
+            raw, completion, seconds = await _send()
+            self._record_latency(seconds)
+            return raw, completion
+        primary = asyncio.ensure_future(_send())
+        pending = {primary}
+        try:
+            hedge = None
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done and self._start_hedge(tokens):
+                hedge = asyncio.ensure_future(_send())
+                self._hold_slot([primary, hedge])
+                pending.add(hedge)
+            # First Successful Response Wins
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                succeeded = [task for task in done if task.exception() is None]
+                if succeeded or not pending:
+                    task = (succeeded or list(done))[0]
+                    raw, completion, seconds = task.result()
+                    self._record_latency(seconds)
+                    if task is not primary:
+                        self._record_hedge_win()
+                    self._refund_losers(tokens, [primary, hedge], winner=task)
+                    return raw, completion
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _record_response(self, headers, tokens: int, usage):
+        """
+        Syncs the buckets with rate-limit headers and actual usage, and grows
+        the concurrency additively
+        """
+        with self._lock:
+            now = time.monotonic()
+            buckets = [(self.requests_bucket, "requests"), (self.tokens_bucket, "tokens")]
+            for bucket, kind in buckets:
+                bucket.refill(now)
+                limit = remaining = None
+                if headers is not None:
+                    limit = headers.get(f"x-ratelimit-limit-{kind}")
+                    remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                if limit is not None and limit.isdigit() and int(limit) > 0:
+                    bucket.capacity = float(limit)
+                if remaining is not None and remaining.isdigit():
+                    bucket.level = min(bucket.level, float(remaining))
+                    if int(remaining) == 0:
+                        reset = parse_reset(headers.get(f"x-ratelimit-reset-{kind}"))
+                        if reset is not None:
+                            self.paused_until = max(self.paused_until, now + reset)
+            # Refund The Unused Part Of The Token Reservation
+            self._refund_tokens(tokens, usage)
+            self.concurrency = min(
+                float(self.max_concurrency), self.concurrency + 1 / max(self.concurrency, 1)
+            )
+
+    def _record_error(self, error: Exception, attempt: int) -> float:
+        """
+        Classifies a failed attempt, returning the seconds to wait before the
+        next one. Raises the error again if it is not worth retrying.
+        """
+        import openai  # pylint: disable=import-outside-toplevel
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if isinstance(error, openai.RateLimitError):
+            retry_after = parse_retry_after(error.response.headers)
+            delay = max(backoff, retry_after or 0.0)
+            with self._lock:
+                self.counts["throttled"] += 1
+                self.concurrency = max(1.0, self.concurrency / 2)
+                # Retry-After Holds Back Every Request, Not Just This One
+                if retry_after is not None:
+                    self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            log.debug("Throttled, Waiting %.2fs (Concurrency = %.1f)", delay, self.concurrency)
+            return delay
+        if isinstance(error, openai.APIStatusError) and error.status_code < 500:
+            if error.status_code not in [408, 409]:
+                raise error
+        elif not isinstance(
+            error, (openai.APIStatusError, openai.APIConnectionError) + INVALID_RESPONSE_ERRORS
+        ):
+            raise error
+        return backoff
+
+    def _record_failure(self, error: Exception):
+        with self._lock:
+            self.counts["failed"] += 1
+        metrics.increment("failed_requests")
+        log.warning("Request Failed After %s Attempts: %r", self.max_attempts, error)
+
+    def call(
+        self,
+        request_fn: Callable[[], Any],
+        parse_fn: Callable[[Any], Any],
+        tokens: int,
+        retry_invalid: bool = True
+    ) -> Any:
+        """
+        Runs request_fn (returning a raw response, given the request timeout)
+        within the budgets, hedging slow attempts, retrying
+        failed/throttled attempts, and returns parse_fn of the parsed response.
+        ValueErrors from parse_fn (e.g. malformed json replies) are retried as well
+        unless retry_invalid is off (e.g. when a stronger model can take over),
+        TruncatedResponse is raised to the caller at once.
+        """
+        error: Exception | None = None
+        for attempt in range(self.max_attempts):
+            if attempt > 0:
+                with self._lock:
+                    self.counts["retried"] += 1
+                metrics.increment("retries")
+            time.sleep(self._reserve(tokens))
+            while not self._try_enter():
+                time.sleep(0.01)
+            start = time.perf_counter()
+            usage = None
+            try:
+                raw, completion = self._request(request_fn, tokens)
+                usage = getattr(completion, "usage", None)
+                self._record_response(raw.headers, tokens, usage)
+                result = parse_fn(completion)
+                metrics.record_request(time.perf_counter() - start, "ok", usage, self.model_name)
+                return result
+            except TruncatedResponse:
+                metrics.record_request(
+                    time.perf_counter() - start, "truncated", usage, self.model_name
+                )
+                raise
+            except Exception as e:  # pylint: disable=broad-except
+                error = e
+                metrics.record_request(
+                    time.perf_counter() - start,
+                    "throttled" if _is_throttled(e) else "error",
+                    usage,
+                    self.model_name
+                )
+            finally:
+                self._exit()
+            if not retry_invalid and isinstance(error, INVALID_RESPONSE_ERRORS):
+                raise error
+            try:
+                delay = self._record_error(error, attempt)
+            except Exception:
+                self._record_failure(error)
+                raise
+            if attempt < self.max_attempts - 1:
+                time.sleep(delay)
+        assert error is not None
+        self._record_failure(error)
+        raise error
+
+    async def acall(
+        self,
+        request_fn: Callable[[], Awaitable[Any]],
+        parse_fn: Callable[[Any], Any],
+        tokens: int,
+        retry_invalid: bool = True
+    ) -> Any:
+        """
+        Async version of call
+        """
+        error: Exception | None = None
+        for attempt in range(self.max_attempts):
+            if attempt > 0:
+                with self._lock:
+                    self.counts["retried"] += 1
+                metrics.increment("retries")
+            await asyncio.sleep(self._reserve(tokens))
+            while not self._try_enter():
+                await asyncio.sleep(0.01)
+            start = time.perf_counter()
+            usage = None
+            try:
+                raw, completion = await self._arequest(request_fn, tokens)
+                usage = getattr(completion, "usage", None)
+                self._record_response(raw.headers, tokens, usage)
+                result = parse_fn(completion)
+                metrics.record_request(time.perf_counter() - start, "ok", usage, self.model_name)
+                return result
+            except TruncatedResponse:
+                metrics.record_request(
+                    time.perf_counter() - start, "truncated", usage, self.model_name
+                )
+                raise
+            except Exception as e:  # pylint: disable=broad-except
+                error = e
+                metrics.record_request(
+                    time.perf_counter() - start,
+                    "throttled" if _is_throttled(e) else "error",
+                    usage,
+                    self.model_name
+                )
+            finally:
+                self._exit()
+            if not retry_invalid and isinstance(error, INVALID_RESPONSE_ERRORS):
+                raise error
+            try:
+                delay = self._record_error(error, attempt)
+            except Exception:
+                self._record_failure(error)
+                raise
+            if attempt < self.max_attempts - 1:
+                await asyncio.sleep(delay)
+        assert error is not None
+        self._record_failure(error)
+        raise error
+
+
+# Process-Wide Limiters, One Per Model
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+# Set in worker processes of a pool sharing one API budget (see join_process_pool)
+_shared_semaphore = None  # pylint: disable=invalid-name
+_process_share = 1.0  # pylint: disable=invalid-name
+
+
+def join_process_pool(semaphore, workers: int):
+    """
+    Makes this process one of `workers` processes sharing a single API budget.
+    semaphore (a multiprocessing.BoundedSemaphore) caps the requests in flight
+    across all of them, and per-minute budgets are split evenly.
+    """
+    global _shared_semaphore, _process_share  # pylint: disable=global-statement
+    assert workers > 0
+    _shared_semaphore = semaphore
+    _process_share = 1 / workers
+
+
+def get_rate_limiter(model_name: str) -> RateLimiter:
+    """
+    Returns the shared limiter for a model, creating it with default budgets
+    """
+    with _limiters_lock:
+        if model_name not in _limiters:
+            _limiters[model_name] = RateLimiter(model_name=model_name)
+        return _limiters[model_name]
+
+
+def configure_rate_limiter(
+    model_name: str,
+    requests_per_minute: int,
+    tokens_per_minute: int,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    request_timeout: float | None = DEFAULT_REQUEST_TIMEOUT,
+    hedge_quantile: float | None = None,
+    hedge_budget: float = 0.05
+) -> RateLimiter:
+    """
+    Sets the budgets and hedging of the shared limiter for a model (this
+    process's share of the budgets when part of a pool)
+    """
+    limiter = get_rate_limiter(model_name)
+    limiter.configure(
+        requests_per_minute=max(1, int(requests_per_minute * _process_share)),
+        tokens_per_minute=max(1, int(tokens_per_minute * _process_share)),
+        max_concurrency=max_concurrency,
+        request_timeout=request_timeout,
+        hedge_quantile=hedge_quantile,
+        hedge_budget=hedge_budget
+    )
+    return limiter
+
+
+def rate_limit_stats() -> dict[str, dict[str, float]]:
+    """
+    Stats of every shared limiter, by model
+    """
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {model_name: limiter.stats() for model_name, limiter in limiters.items()}
@@ -0,0 +1,74 @@
+"""
+Columnar weave results
+
+The default weave result nests a dict per section, table, row, cell,
+paragraph and run. With weave_document(results="table") the runs are instead
+appended, as they are woven, to a ResultTable: one row per run, stored as one
+list per column. It converts to a pandas DataFrame (and from there to Parquet
+or Arrow) for analytics.
+"""
+
+from typing import TYPE_CHECKING, Any, Iterator
+
+# pandas Is Only Imported For The Conversions
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Columns of a ResultTable
+#   path: Location of the run, or of the paragraph woven whole at paragraph
+#       granularity (the keys of its nested result entry, joined by "/")
+#   part: Story of the run (body, header, footer, footnotes, endnotes)
+#   unit: Location of the paragraph (outside tables) or table cell of the run
+#   fingerprint: Content hash of that paragraph/cell (see incremental.fingerprint)
+#   original/translation: Run text before/after the weave
+#   output: Transformed text (None if the run was left as is)
+#   translated: Whether the run was transformed
+#   requests/latency/prompt_tokens/completion_tokens: Cost of generating the
+#       run's segment, carried by its first occurrence (batched requests are
+#       split evenly between their segments)
+RESULT_COLUMNS = [
+    "path", "part", "unit", "fingerprint", "original", "translation", "output", "translated",
+    "requests", "latency", "prompt_tokens", "completion_tokens"
+]
+# Cost columns, zero for runs that made no request
+USAGE_COLUMNS = ["requests", "latency", "prompt_tokens", "completion_tokens"]
+
+
+class ResultTable:
+    """
+    Append-only table of woven runs, stored column-wise
+    """
+    def __init__(self):
+        self.columns: dict[str, list] = {name: [] for name in RESULT_COLUMNS}
+
+    def append(self, **row):
+        """
+        Appends a run (missing usage columns are zero)
+        """
+        for name in USAGE_COLUMNS:
+            row.setdefault(name, 0)
+        for name, column in self.columns.items():
+            column.append(row[name])
+
+    def __len__(self) -> int:
+        return len(self.columns["path"])
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        """
+        Rows as dicts
+        """
+        for values in zip(*self.columns.values()):
+            yield dict(zip(self.columns, values))
+
+    def to_frame(self) -> "pd.DataFrame":
+        """
+        The table as a DataFrame
+        """
+        import pandas as pd  # pylint: disable=import-outside-toplevel,redefined-outer-name
+        return pd.DataFrame(self.columns, columns=RESULT_COLUMNS)
+
+    def to_parquet(self, path: str):
+        """
+        Writes the table to a Parquet file (needs pyarrow or fastparquet)
+        """
+        self.to_frame().to_parquet(path, index=False)
@@ -0,0 +1,135 @@
+"""
+Routing of segments between a fast model and the configured one
+
+Most runs of a document are short: headings, labels, table cells, header and
+footer lines, numbers with a word or two. A ModelRouter sends such segments to
+a fast, cheap model first, and everything else to the configured model. The
+features are those of the skip classifier (see preflight.classify_segments):
+the length of the segment in tokens, how much of it is letters, and the part
+it comes from. A segment is only routed to the fast model when all of its
+occurrences qualify, and the fast model's reply escalates to the configured
+model when it fails or does not validate (see
+word.generate_cascaded_transformation).
+
+model_report turns the per-model metrics of a weave into its share of the
+calls, latency, throughput and cost (see token_cost).
+"""
+
+from typing import Any
+import logging
+from . import word
+from .dedupe import SegmentKey
+
+# Logger
+log = logging.getLogger(__name__)
+
+# Max tokens of a segment sent to the fast model (doubled outside the body text)
+MAX_FAST_TOKENS = 16
+# Segments with fewer letters than this share of their characters (numbers,
+# amounts, codes...) go to the fast model whatever their length
+MIN_LETTER_RATIO = 0.5
+# Parts whose segments are short by nature
+SHORT_PARTS = ["header", "footer", "footnotes", "endnotes"]
+
+
+class ModelRouter:
+    """
+    Chooses the models each segment is tried with
+    model_name: str - Configured model, tried last
+    fast_model_name: str - Model tried first for simple segments
+    max_fast_tokens: int - Max tokens of a simple body segment
+    """
+    def __init__(
+        self,
+        model_name: str,
+        fast_model_name: str,
+        max_fast_tokens: int = MAX_FAST_TOKENS
+    ):
+        assert max_fast_tokens > 0
+        self.model_name = model_name
+        self.fast_model_name = fast_model_name
+        self.max_fast_tokens = max_fast_tokens
+        self.simple: dict[SegmentKey, bool] = {}
+
+    def add(self, key: SegmentKey, part: str, in_table: bool):
+        """
+        Records an occurrence of a segment, in the part/table it was found in
+        """
+        self.simple[key] = self.simple.get(key, True) and self.is_simple(
+            key.src_text, part, in_table
+        )
+
+    def is_simple(self, src_text: str, part: str, in_table: bool) -> bool:
+        """
+        Whether a (prepared) segment can be left to the fast model. Paragraphs
+        with marked formatting spans never are.
+        """
+        if word.is_marked(src_text):
+            return False
+        letters = sum(map(str.isalpha, src_text))
+        if letters < MIN_LETTER_RATIO * len(src_text.strip()):
+            return True
+        max_tokens = self.max_fast_tokens * (2 if in_table or part in SHORT_PARTS else 1)
+        return word.count_tokens(src_text, self.fast_model_name) <= max_tokens
+
+    def cascade(self, key: SegmentKey) -> list[str]:
+        """
+        Models to try for a segment, in order
+        """
+        if self.simple.get(key, False):
+            return [self.fast_model_name, self.model_name]
+        return [self.model_name]
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Routing counts for the weave result
+        """
+        fast = sum(self.simple.values())
+        return {
+            "fast_model": self.fast_model_name,
+            "segments": len(self.simple),
+            "fast_segments": fast,
+            "fast_share": round(fast / len(self.simple), 4) if self.simple else 0.0
+        }
+
+
+def model_report(
+    models: dict[str, dict[str, float]],
+    prices: dict[str, tuple[float, float]]
+) -> dict[str, dict[str, float]]:
+    """
+    Share of the calls, mean latency, throughput (completion tokens per second
+    of request time) and cost of each model, from the "models" section of the
+    weave metrics. prices maps a model to its (input, output) price in dollars
+    per million tokens, models without a price have no cost.
+    """
+    attempts = sum(model["attempts"] for model in models.values())
+    report = {}
+    for name, model in models.items():
+        report[name] = {
+            "calls": model["attempts"],
+            "call_share": round(model["attempts"] / attempts, 4) if attempts else 0.0,
+            "mean_latency": round(model["seconds"] / model["attempts"], 6)
+            if model["attempts"] else 0.0,
+            "tokens_per_second": round(model["completion_tokens"] / model["seconds"], 2)
+            if model["seconds"] else 0.0
+        }
+        report[name]["cost"] = token_cost(
+            name, model["prompt_tokens"], model["completion_tokens"], prices=prices
+        )
+    return report
+
+
+def token_cost(
+    model_name: str,
+    prompt_tokens: float,
+    completion_tokens: float,
+    prices: dict[str, tuple[float, float]]
+) -> float | None:
+    """
+    Cost in dollars of tokens of a model (None for models without a price)
+    """
+    if model_name not in prices:
+        return None
+    input_price, output_price = prices[model_name]
+    return round((prompt_tokens * input_price + completion_tokens * output_price) / 1e6, 6)
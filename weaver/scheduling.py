@@ -0,0 +1,92 @@
+"""
+Scheduling of the transformation work queue
+
+Prefetched segments (see dispatch.agenerate_transformations) are sent by a
+fixed pool of workers taking batches from one queue, whichever part of the
+document (body, tables, headers, footers, notes) they come from. A scheduler
+orders that queue, the weave still applies the results in document order.
+    - fifo: Document order. A long clause near the end of the document is sent
+      last, and the weave ends up waiting on it alone.
+    - lpt: Longest estimated output first (longest processing time first),
+      keeping every worker busy until the end, which minimizes the makespan.
+    - deadline: Latest start first. Each batch is due when a document-order
+      weave at full concurrency would reach it, and should start its estimated
+      duration before that: long segments are moved forward, short ones stay
+      around their place, so the start of the document is ready early.
+Any callable taking the batches (in document order) and the concurrency, and
+returning them in the order to send them, can be used as a scheduler.
+"""
+
+from typing import Callable
+import logging
+from . import word
+from .dedupe import SegmentKey
+
+# Logger
+log = logging.getLogger(__name__)
+
+# Orders batches of segments (given in document order) for a number of workers
+Scheduler = Callable[[list[list[SegmentKey]], int], list[list[SegmentKey]]]
+
+
+def estimate_output_tokens(batch: list[SegmentKey]) -> int:
+    """
+    Expected reply tokens of a batch: its segments come back about as long as
+    they are sent, in their JSON wrapper
+    """
+    return sum(
+        word.count_tokens(key.src_text, key.model_name) + word.OUTPUT_OVERHEAD_TOKENS
+        for key in batch
+    )
+
+
+def schedule_fifo(
+    batches: list[list[SegmentKey]],
+    concurrency: int  # pylint: disable=unused-argument
+) -> list[list[SegmentKey]]:
+    """
+    Batches in document order
+    """
+    return list(batches)
+
+
+def schedule_lpt(
+    batches: list[list[SegmentKey]],
+    concurrency: int  # pylint: disable=unused-argument
+) -> list[list[SegmentKey]]:
+    """
+    Longest batches first (ties keep their document order)
+    """
+    return sorted(batches, key=estimate_output_tokens, reverse=True)
+
+
+def schedule_deadline(batches: list[list[SegmentKey]], concurrency: int) -> list[list[SegmentKey]]:
+    """
+    Batches by latest start: when a document-order weave at full concurrency
+    would be done with them, minus their own duration (in output tokens)
+    """
+    latest_starts = []
+    due = 0.0
+    for batch in batches:
+        tokens = estimate_output_tokens(batch)
+        due += tokens / concurrency
+        latest_starts.append(due - tokens)
+    order = sorted(range(len(batches)), key=latest_starts.__getitem__)
+    return [batches[ix] for ix in order]
+
+
+SCHEDULERS: dict[str, Scheduler] = {
+    "fifo": schedule_fifo,
+    "lpt": schedule_lpt,
+    "deadline": schedule_deadline,
+}
+
+
+def get_scheduler(schedule: str | Scheduler) -> Scheduler:
+    """
+    Scheduler of a name in SCHEDULERS, or the scheduler itself
+    """
+    if callable(schedule):
+        return schedule
+    assert schedule in SCHEDULERS, f"Unknown Schedule: {schedule}"
+    return SCHEDULERS[schedule]
@@ -0,0 +1,425 @@
+"""
+Local HTTP service weaving uploaded documents
+
+    docx-weaver-server --port 8080 --workers 4 --queue-size 32 --cache-path weaver-cache.sqlite
+
+Settings are loaded (and the OpenAI key read) once at startup. Uploaded
+documents are queued, up to queue_size (further uploads are refused with a
+503), and woven by a pool of worker threads. The workers share the process'
+rate limiters, one async client with pooled connections to the LLM endpoint
+(see dispatch.AsyncClientLoop) and the transformation cache, so a job starts
+without any setup and all of them stay within the same limits. Pointing
+OPENAI_BASE_URL (or --base-url) at a local mock endpoint serves without an
+API key, e.g. for tests: a placeholder key is set when none is (see
+use_endpoint).
+
+    POST /jobs?mode=...&purpose=...&paragraph_prompt=...  (body: the .docx)
+        -> 202 {"id": ..., "status": "queued"}
+    GET /jobs/<id> -> status of the job, with its weave summary once done
+    GET /jobs/<id>/output -> the woven .docx
+    DELETE /jobs/<id> -> forgets a finished job and deletes its files
+    GET /health -> queue and job counts
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from urllib.parse import parse_qs, urlsplit
+import argparse
+import json
+import logging
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from . import dispatch
+from .cache import TransformCache
+from .cli import RESULT_SUMMARY_KEYS
+from .settings import DocxWeaverSettings
+from .weaver import DocxWeaver
+
+# Logger
+log = logging.getLogger(__name__)
+
+DOCX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+MODELS = ["gpt-4-turbo", "gpt-3.5-turbo", "gpt-4o"]
+# OPENAI_API_KEY set for endpoints other than OpenAI's when none is given
+PLACEHOLDER_API_KEY = "unused"
+# Job parameters (query string of POST /jobs) and their defaults
+JOB_PARAMS = {
+    "mode": None,
+    "purpose": None,
+    "paragraph_prompt": None,
+    "table_prompt": None,
+    "model": None,
+    "fast_model": None,
+    "concurrency": None,
+    "batch_tokens": None,
+    "granularity": "run",
+    "schedule": "lpt",
+}
+
+
+class WeaveService:
+    """
+    Bounded queue of weave jobs and the worker threads running them
+    work_dir: str - Directory holding the input and output of every job
+    workers: int - Jobs woven at once
+    queue_size: int - Jobs waiting at most, further submissions are refused
+    concurrency: int - Max requests in flight per job (jobs may ask for fewer)
+    cache_path: str | None - SQLite cache shared by all jobs (defaults to the
+        CACHE_PATH setting, disabled if neither is set)
+    model_name: str - Model of jobs not asking for one
+    """
+    def __init__(
+        self,
+        work_dir: str,
+        workers: int = 2,
+        queue_size: int = 16,
+        concurrency: int = 16,
+        cache_path: str | None = None,
+        model_name: str = "gpt-4o"
+    ):
+        assert workers > 0 and queue_size > 0 and concurrency > 0
+        assert model_name in MODELS
+        self.work_dir = work_dir
+        self.concurrency = concurrency
+        self.model_name = model_name
+        self.settings = DocxWeaverSettings(openai_model_name=model_name)
+        cache_path = cache_path or self.settings.cache_path
+        self.cache = None if cache_path is None else TransformCache(
+            path=cache_path,
+            max_entries=self.settings.cache_max_entries,
+            ttl=self.settings.cache_ttl
+        )
+        self.client_loop = dispatch.AsyncClientLoop(
+            max_connections=self.settings.openai_max_concurrency
+        )
+        self.jobs: dict[str, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._queue: queue.Queue[str | None] = queue.Queue(maxsize=queue_size)
+        self._workers = [
+            threading.Thread(target=self._work, name=f"weaver-worker-{ix}", daemon=True)
+            for ix in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, data: bytes, params: dict[str, str]) -> dict[str, Any]:
+        """
+        Queues a document for weaving, returning its job. Raises ValueError for
+        invalid parameters and queue.Full when the queue is full.
+        """
+        unknown = set(params) - set(JOB_PARAMS)
+        if unknown:
+            raise ValueError(f"Unknown Parameters: {sorted(unknown)}")
+        params = {**JOB_PARAMS, **params}
+        if params["mode"] not in ["comments_only", "transform_only", "transform_and_comments"]:
+            raise ValueError(f"Invalid Mode: {params['mode']}")
+        if not params["purpose"] or not params["paragraph_prompt"]:
+            raise ValueError("purpose And paragraph_prompt Are Required")
+        if params["model"] not in MODELS + [None] or params["fast_model"] not in MODELS + [None]:
+            raise ValueError(f"Models Must Be One Of {MODELS}")
+        if params["granularity"] not in ["run", "paragraph"]:
+            raise ValueError(f"Invalid Granularity: {params['granularity']}")
+        if params["schedule"] not in ["fifo", "lpt", "deadline"]:
+            raise ValueError(f"Invalid Schedule: {params['schedule']}")
+        for name in ["concurrency", "batch_tokens"]:
+            if params[name] is not None:
+                if not params[name].isdigit() or int(params[name]) == 0:
+                    raise ValueError(f"{name} Must Be A Positive Integer")
+                params[name] = int(params[name])
+        if not data.startswith(b"PK"):
+            raise ValueError("Body Is Not A .docx File")
+
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.work_dir, job_id)
+        os.makedirs(job_dir)
+        with open(os.path.join(job_dir, "input.docx"), "wb") as f:
+            f.write(data)
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "params": params,
+            "input": os.path.join(job_dir, "input.docx"),
+            "output": os.path.join(job_dir, "output.docx"),
+            "submitted_at": time.time()
+        }
+        with self._lock:
+            self.jobs[job_id] = job
+        try:
+            self._queue.put_nowait(job_id)
+        except queue.Full:
+            self.remove(job_id, force=True)
+            raise
+        log.info("Queued Job %s", job_id)
+        return job
+
+    def _work(self):
+        """
+        Worker thread: runs queued jobs until given None
+        """
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            with self._lock:
+                job = self.jobs.get(job_id)
+            if job is not None:
+                self._run(job)
+
+    def _run(self, job: dict[str, Any]):
+        """
+        Weaves the document of a job
+        """
+        params = job["params"]
+        with self._lock:
+            job["status"] = "running"
+            job["started_at"] = time.time()
+        try:
+            weaver = DocxWeaver(
+                filename=job["input"],
+                purpose=params["purpose"],
+                paragraph_prompt=params["paragraph_prompt"],
+                table_prompt=params["table_prompt"],
+                mode=params["mode"],
+                openai_model_name=params["model"] or self.model_name,
+                concurrency=min(params["concurrency"] or self.concurrency, self.concurrency),
+                batch_tokens=params["batch_tokens"],
+                granularity=params["granularity"],
+                fast_model_name=params["fast_model"],
+                schedule=params["schedule"],
+                settings=self.settings,
+                cache=self.cache,
+                client_loop=self.client_loop
+            )
+            result = weaver.weave_document(output_fn=job["output"])
+            update = {
+                "status": "done",
+                "result": {key: result[key] for key in RESULT_SUMMARY_KEYS if key in result}
+            }
+        except Exception as e:  # pylint: disable=broad-except
+            log.error("Job %s Failed: %r", job["id"], e)
+            update = {"status": "failed", "error": repr(e), "traceback": traceback.format_exc()}
+        # Jobs Are Read By The Request Threads, Under The Lock
+        with self._lock:
+            job.update(update, seconds=round(time.time() - job["started_at"], 3))
+
+    def get(self, job_id: str) -> dict[str, Any] | None:
+        """
+        A job, as returned to clients
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            return {key: value for key, value in job.items() if key not in ["input", "output"]}
+
+    def remove(self, job_id: str, force: bool = False) -> bool:
+        """
+        Forgets a job and deletes its files. Queued and running jobs are only
+        removed with force.
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or (job["status"] in ["queued", "running"] and not force):
+                return False
+            del self.jobs[job_id]
+        shutil.rmtree(os.path.join(self.work_dir, job_id), ignore_errors=True)
+        return True
+
+    def stats(self) -> dict[str, int]:
+        """
+        Queue and job counts
+        """
+        with self._lock:
+            statuses = [job["status"] for job in self.jobs.values()]
+        return {
+            "queued": self._queue.qsize(),
+            "queue_size": self._queue.maxsize,
+            "workers": len(self._workers),
+            **{status: statuses.count(status) for status in ["running", "done", "failed"]}
+        }
+
+    def close(self):
+        """
+        Finishes the queued jobs, then stops the workers and the client
+        """
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self.client_loop.close()
+
+
+class WeaveRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API of a WeaveService (self.server.service)
+    """
+    server: "WeaveServer"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        log.debug("%s - %s", self.address_string(), format % args)
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, data: dict[str, Any]):
+        self._send(status, json.dumps(data).encode("utf-8"), "application/json")
+
+    def _route(self) -> tuple[list[str], dict[str, str]]:
+        """
+        Path segments and (single valued) query parameters of the request
+        """
+        url = urlsplit(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        return [part for part in url.path.split("/") if part], params
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Health, status of a job or its woven document
+        """
+        service = self.server.service
+        parts, _ = self._route()
+        if parts == ["health"]:
+            self._send_json(200, {"status": "ok", **service.stats()})
+            return
+        if len(parts) not in [2, 3] or parts[0] != "jobs" or parts[2:] not in [[], ["output"]]:
+            self._send_json(404, {"error": "Not Found"})
+            return
+        job = service.get(parts[1])
+        if job is None:
+            self._send_json(404, {"error": "Unknown Job"})
+        elif len(parts) == 2:
+            self._send_json(200, job)
+        elif job["status"] != "done":
+            self._send_json(409, {"error": f"Job Is {job['status']}", "status": job["status"]})
+        else:
+            with open(os.path.join(service.work_dir, job["id"], "output.docx"), "rb") as f:
+                self._send(200, f.read(), DOCX_CONTENT_TYPE)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """
+        Submits a job
+        """
+        parts, params = self._route()
+        if parts != ["jobs"]:
+            self._send_json(404, {"error": "Not Found"})
+            return
+        data = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        try:
+            job = self.server.service.submit(data, params)
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+        except queue.Full:
+            self._send_json(503, {"error": "Queue Full"})
+        else:
+            self._send_json(202, {"id": job["id"], "status": job["status"]})
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        """
+        Removes a finished job
+        """
+        service = self.server.service
+        parts, _ = self._route()
+        if len(parts) != 2 or parts[0] != "jobs" or service.get(parts[1]) is None:
+            self._send_json(404, {"error": "Not Found"})
+        elif service.remove(parts[1]):
+            self._send_json(200, {"id": parts[1], "status": "deleted"})
+        else:
+            self._send_json(409, {"error": "Job Not Finished"})
+
+
+class WeaveServer(ThreadingHTTPServer):
+    """
+    HTTP server of a WeaveService
+    """
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], service: WeaveService):
+        super().__init__(address, WeaveRequestHandler)
+        self.service = service
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Arguments of the docx-weaver-server command
+    """
+    parser = argparse.ArgumentParser(
+        prog="docx-weaver-server", description="Serve document weaving over a local HTTP API"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=2, help="Jobs woven at once")
+    parser.add_argument("--queue-size", type=int, default=16, help="Jobs waiting at most")
+    parser.add_argument(
+        "--concurrency", type=int, default=16, help="Max requests in flight per job"
+    )
+    parser.add_argument("--model", default="gpt-4o", choices=MODELS, help="Default model of jobs")
+    parser.add_argument("--cache-path", default=None, help="SQLite cache shared by all jobs")
+    parser.add_argument(
+        "--work-dir", default=None, help="Job files (defaults to a temporary directory)"
+    )
+    parser.add_argument(
+        "--base-url", default=None,
+        help="LLM endpoint, e.g. a local mock (sets OPENAI_BASE_URL, and a placeholder "
+        "OPENAI_API_KEY if none is set)"
+    )
+    parser.add_argument("--log-level", default="INFO")
+    return parser
+
+
+def use_endpoint(base_url: str | None):
+    """
+    Points the OpenAI clients at base_url (if given). When OPENAI_BASE_URL is
+    set without OPENAI_API_KEY (e.g. a local mock), the key is set to a
+    placeholder, as the settings and the clients require one.
+    """
+    if base_url is not None:
+        os.environ["OPENAI_BASE_URL"] = base_url
+    if os.environ.get("OPENAI_BASE_URL") and not os.environ.get("OPENAI_API_KEY"):
+        log.info("No OPENAI_API_KEY For %s, Using A Placeholder", os.environ["OPENAI_BASE_URL"])
+        os.environ["OPENAI_API_KEY"] = PLACEHOLDER_API_KEY
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    Entry point of the docx-weaver-server command
+    """
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=args.log_level, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    use_endpoint(args.base_url)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="docx-weaver-")
+    os.makedirs(work_dir, exist_ok=True)
+    service = WeaveService(
+        work_dir=work_dir,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        concurrency=args.concurrency,
+        cache_path=args.cache_path,
+        model_name=args.model
+    )
+    server = WeaveServer((args.host, args.port), service)
+    log.info("Serving On http://%s:%s (Jobs In %s)", args.host, args.port, work_dir)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -16,6 +16,28 @@ class DocxWeaverSettings(BaseSettings):
     """
     openai_api_key: SecretStr
     openai_model_name: Literal["gpt-4-turbo", "gpt-3.5-turbo", "gpt-4o"]
+    # Rate Limits Per Model (kept in sync with the API's rate-limit headers once known)
+    openai_requests_per_minute: dict[str, int] = {
+        "gpt-4-turbo": 500, "gpt-3.5-turbo": 3500, "gpt-4o": 500
+    }
+    openai_tokens_per_minute: dict[str, int] = {
+        "gpt-4-turbo": 30_000, "gpt-3.5-turbo": 60_000, "gpt-4o": 30_000
+    }
+    openai_max_concurrency: int = 64
+    # Fast Model Tried First For Short/Simple Segments (routing disabled unless set)
+    openai_fast_model_name: Literal["gpt-4-turbo", "gpt-3.5-turbo", "gpt-4o"] | None = None
+    # Prices Per Model, In Dollars Per Million (input, output) Tokens
+    openai_model_prices: dict[str, tuple[float, float]] = {
+        "gpt-4-turbo": (10.0, 30.0), "gpt-3.5-turbo": (0.5, 1.5), "gpt-4o": (5.0, 15.0)
+    }
+    # Hard Timeout Per Request, And Hedging Of Requests Slower Than This Latency Quantile
+    openai_request_timeout: float | None = 120.0
+    openai_hedge_quantile: float | None = None
+    openai_hedge_budget: float = 0.05
+    # Transformation Cache (disabled unless a path is given)
+    cache_path: str | None = None
+    cache_max_entries: int = 100_000
+    cache_ttl: float | None = None
     def __init__(self, *a, **kw):
         super().__init__(*a, **kw)
         log.info("DocxWeaver Config: %s", self.model_dump_json())
@@ -0,0 +1,173 @@
+"""
+Streamed weave results
+
+DocxWeaver.stream_document weaves in a background thread and returns a
+WeaveStream, iterated (or async-iterated) for the events of the weave as they
+happen, instead of waiting for the whole result:
+    - {"event": "run", ...}: A run (or paragraph) was woven, with the columns of
+      results.ResultTable and the seconds elapsed since the start of the weave
+    - {"event": "save", "output_fn": ..., "runs": ...}: The document woven so
+      far was saved to output_fn (a ".partial.docx" next to the output)
+    - {"event": "done", ...}: The weave result (see weave_document) without
+      the runs, once the output is saved
+Runs are applied in document order as their segments come back, so
+concurrent/batched requests are sent by latest start (STREAM_SCHEDULE, see
+scheduling) rather than longest first, which would leave the short runs at
+the start of the document for last. Events wait in a bounded queue, so the
+weave pauses while the consumer is behind and nothing is collected for the
+whole document. Leaving the loop early (or closing the stream) cancels the
+weave: no new requests are sent, those already in flight still complete (and
+count against the budgets), and the journal (if any) keeps the runs woven so
+far. Errors of the weave are raised by the iteration.
+"""
+
+from typing import Any, AsyncIterator, Callable, Iterator
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+# Logger
+log = logging.getLogger(__name__)
+
+# Events waiting for the consumer before the weave pauses
+MAX_PENDING_EVENTS = 1000
+# Seconds between partial saves of the document
+SAVE_INTERVAL = 30.0
+# Order streamed weaves send their requests in: the start of the document first
+STREAM_SCHEDULE = "deadline"
+# Seconds between checks for a cancelled stream while the queue is full
+_POLL_SECONDS = 0.1
+
+
+class WeaveCancelled(Exception):
+    """
+    Raised in the weave once its stream is closed
+    """
+
+
+class WeaveStream:
+    """
+    Events of a weave running in a background thread (see module docstring)
+    save_interval: float | None - Seconds between partial saves (None for no
+        partial saves)
+    max_pending: int - Events waiting for the consumer before the weave pauses
+    """
+    def __init__(
+        self,
+        save_interval: float | None = SAVE_INTERVAL,
+        max_pending: int = MAX_PENDING_EVENTS
+    ):
+        assert save_interval is None or save_interval > 0
+        assert max_pending > 0
+        self.save_interval = save_interval
+        self.cancelled = threading.Event()
+        self.started = time.perf_counter()
+        self._events: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._last_save = self.started
+        self._thread: threading.Thread | None = None
+
+    def start(self, weave: Callable[["WeaveStream"], dict[str, Any]]):
+        """
+        Runs weave(stream) in a background thread, ending the stream with the
+        "done" event of its result (or with its error)
+        """
+        def _run():
+            try:
+                try:
+                    result = weave(self)
+                except WeaveCancelled:
+                    raise
+                except BaseException as e:  # pylint: disable=broad-except
+                    self._put(e)
+                    return
+                self.emit({"event": "done", **result})
+                self._put(None)
+            except WeaveCancelled:
+                log.info("Weave Cancelled")
+        self._thread = threading.Thread(target=_run, name="weaver-stream", daemon=True)
+        self._thread.start()
+
+    def elapsed(self) -> float:
+        """
+        Seconds since the stream was created
+        """
+        return round(time.perf_counter() - self.started, 6)
+
+    def check(self):
+        """
+        Raises WeaveCancelled once the stream is closed
+        """
+        if self.cancelled.is_set():
+            raise WeaveCancelled()
+
+    def emit(self, event: dict[str, Any]):
+        """
+        Queues an event for the consumer, waiting while the queue is full.
+        Raises WeaveCancelled once the stream is closed.
+        """
+        self._put(event)
+
+    def _put(self, item: Any):
+        while True:
+            self.check()
+            try:
+                self._events.put(item, timeout=_POLL_SECONDS)
+                return
+            except queue.Full:
+                continue
+
+    def save_due(self) -> bool:
+        """
+        Whether a partial save is due (restarting the interval if so)
+        """
+        if self.save_interval is None:
+            return False
+        now = time.perf_counter()
+        if now - self._last_save < self.save_interval:
+            return False
+        self._last_save = now
+        return True
+
+    def _next(self) -> Any:
+        """
+        Next event, None at the end of the stream (raising the weave's error)
+        """
+        item = self._events.get()
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        try:
+            while (event := self._next()) is not None:
+                yield event
+        finally:
+            self.close()
+
+    async def __aiter__(self) -> AsyncIterator[dict[str, Any]]:
+        try:
+            while (event := await asyncio.to_thread(self._next)) is not None:
+                yield event
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Cancels the weave if it is still running, and waits for it to stop
+        """
+        self.cancelled.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        # Wake Up A Consumer Still Waiting For An Event
+        try:
+            self._events.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def __enter__(self) -> "WeaveStream":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
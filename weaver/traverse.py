@@ -0,0 +1,273 @@
+"""
+Single-pass traversal of every story in a Word document
+
+The body is walked once in document order, descending into tables (nested
+ones included) and text boxes. Section properties met on the way point to the
+header/footer parts, each of which is walked once however many sections link
+to it, followed by the footnotes and endnotes.
+
+Each run is yielded as a WorkItem carrying its part and its location path, the
+keys of its entry in the weave result, e.g.
+    ("tables", "0", "rows", "1", "cells", "2", "paragraphs", "0", "runs", "3")
+Table cells are yielded once more after their content, so cell level work
+(comments) can follow the runs of the cell. At paragraph granularity,
+paragraphs outside tables are yielded whole instead of run by run, with their
+formatting spans marked (see word.mark_spans).
+"""
+
+from typing import Callable, Iterator, Literal, NamedTuple
+import logging
+from docx.opc.constants import CONTENT_TYPE as CT, RELATIONSHIP_TYPE as RT
+from docx.opc.part import PartFactory, XmlPart
+from docx.oxml.ns import qn
+from docx.text.paragraph import Paragraph
+from docx.text.run import Run
+from . import metrics, word
+
+# Logger
+log = logging.getLogger(__name__)
+
+# Endnotes are loaded as plain (binary) parts by python-docx
+PartFactory.part_type_for.setdefault(CT.WML_ENDNOTES, XmlPart)
+
+Part = Literal["body", "header", "footer", "footnotes", "endnotes"]
+Path = tuple[str, ...]
+
+W_P = qn("w:p")
+W_TBL = qn("w:tbl")
+W_TXBX_CONTENT = qn("w:txbxContent")
+# Legacy (VML) copies of drawings, text boxes are read from the current ones
+MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+
+# Result keys of header/footer parts, by reference type
+HEADER_FOOTER_NAMES = {"default": "", "first": "first_page_", "even": "even_page_"}
+
+
+class WorkItem(NamedTuple):
+    """
+    A run to transform (kind="run"), a paragraph to transform whole
+    (kind="paragraph", with no run), or a table cell whose runs were all
+    yielded (kind="cell", with the cell's last paragraph and no run)
+    part: Part - Story the item belongs to
+    path: Path - Location of the item in the weave result
+    paragraph: Paragraph | None - Paragraph of the run / last paragraph of the cell
+    run: Run | None - The run itself
+    cell: Path | None - Location of the innermost table cell holding the item
+    text: str | None - Text to transform: the run's, or the paragraph's with its
+        formatting spans marked
+    """
+    kind: Literal["run", "paragraph", "cell"]
+    part: Part
+    path: Path
+    paragraph: Paragraph | None
+    run: Run | None
+    cell: Path | None
+    text: str | None = None
+
+
+class _Story:
+    """
+    Minimal parent of the proxies created during the traversal (python-docx
+    proxies only ask their parent for the part)
+    """
+    def __init__(self, part):
+        self.part = part
+
+
+def iter_work_items(
+    document,
+    accept_paragraph: Callable[[Part, Paragraph, bool], bool],
+    tables: bool = True,
+    paragraphs: bool = False
+) -> Iterator[WorkItem]:
+    """
+    Walks the document once, yielding the runs of every paragraph accepted by
+    accept_paragraph(part, paragraph, in_table). Accepted paragraphs with
+    anything to transform have their runs cleaned up first (see
+    word.cleanup_bad_runs). Tables are skipped
+    entirely unless `tables` is set. With `paragraphs`, paragraphs outside
+    tables are yielded whole, their runs left as they are.
+    """
+    walker = _Walker(accept_paragraph=accept_paragraph, tables=tables, paragraphs=paragraphs)
+    body = document.element.body
+    story = _Story(document.part)
+    yield from walker.walk(
+        container=body,
+        story=story,
+        part="body",
+        paragraphs_path=("paragraphs",),
+        tables_path=("tables",),
+        rows_key="rows"
+    )
+
+    # Headers/Footers, By Section, Skipping Parts Linked To Earlier Sections
+    seen_parts = set()
+    sect_prs = walker.sect_prs + body.findall(qn("w:sectPr"))
+    for ix_section, sect_pr in enumerate(sect_prs):
+        for reference in sect_pr.iterchildren(qn("w:headerReference"), qn("w:footerReference")):
+            part = document.part.related_parts[reference.get(qn("r:id"))]
+            if part in seen_parts:
+                continue
+            seen_parts.add(part)
+            kind = "header" if reference.tag == qn("w:headerReference") else "footer"
+            name = HEADER_FOOTER_NAMES.get(reference.get(qn("w:type"), "default"), "") + kind
+            # Result Layout Of The Original Section Weave (table rows under "runs")
+            yield from walker.walk(
+                container=part.element,
+                story=_Story(part),
+                part=kind,
+                paragraphs_path=("section_paragraphs", str(ix_section), f"{name}_paragraphs"),
+                tables_path=("section_headers", str(ix_section), f"{name}_tables"),
+                rows_key="runs"
+            )
+
+    # Footnotes/Endnotes, Skipping Separators
+    for part_name, reltype, note_tag in [
+        ("footnotes", RT.FOOTNOTES, "w:footnote"),
+        ("endnotes", RT.ENDNOTES, "w:endnote")
+    ]:
+        try:
+            part = document.part.part_related_by(reltype)
+        except KeyError:
+            continue
+        if not isinstance(part, XmlPart):
+            log.warning("Skipping Unparsed %s Part", part_name)
+            continue
+        story = _Story(part)
+        for note in part.element.iterchildren(qn(note_tag)):
+            if note.get(qn("w:type")) is not None:
+                continue
+            yield from walker.walk(
+                container=note,
+                story=story,
+                part=part_name,
+                paragraphs_path=(part_name, note.get(qn("w:id")), "paragraphs"),
+                tables_path=(part_name, note.get(qn("w:id")), "tables"),
+                rows_key="rows"
+            )
+
+
+class _Walker:
+    """
+    Recursive walk over block containers (body, cells, text boxes, header,
+    footer and note content), collecting section properties on the way
+    """
+    def __init__(
+        self,
+        accept_paragraph: Callable[[Part, Paragraph, bool], bool],
+        tables: bool,
+        paragraphs: bool = False
+    ):
+        self.accept_paragraph = accept_paragraph
+        self.tables = tables
+        self.paragraphs = paragraphs
+        self.sect_prs = []
+
+    def walk(
+        self,
+        container,
+        story: _Story,
+        part: Part,
+        paragraphs_path: Path,
+        tables_path: Path,
+        rows_key: str,
+        cell: Path | None = None
+    ) -> Iterator[WorkItem]:
+        """
+        Yields the items of all paragraphs and tables directly in container,
+        numbering them under paragraphs_path and tables_path
+        """
+        ix_para = 0
+        ix_table = 0
+        for child in container.iterchildren(W_P, W_TBL):
+            if child.tag == W_P:
+                yield from self._walk_paragraph(
+                    p=child, story=story, part=part,
+                    path=paragraphs_path + (str(ix_para),), cell=cell
+                )
+                ix_para += 1
+            else:
+                if self.tables:
+                    yield from self._walk_table(
+                        tbl=child, story=story, part=part,
+                        path=tables_path + (str(ix_table),), rows_key=rows_key
+                    )
+                ix_table += 1
+
+    def _walk_paragraph(
+        self,
+        p,
+        story: _Story,
+        part: Part,
+        path: Path,
+        cell: Path | None
+    ) -> Iterator[WorkItem]:
+        p_pr = p.pPr
+        if p_pr is not None and p_pr.sectPr is not None:
+            self.sect_prs.append(p_pr.sectPr)
+
+        paragraph = Paragraph(p, story)
+        accepted = self.accept_paragraph(part, paragraph, cell is not None)
+        if accepted and self.paragraphs and cell is None:
+            # Whole Paragraph, Runs Are Kept For Their Formatting
+            texts = ["".join(run.text for run in span) for span in word.paragraph_spans(paragraph)]
+            yield WorkItem("paragraph", part, path, paragraph, None, cell, word.mark_spans(texts))
+        elif accepted:
+            # Strip Mixed-Font Runs And Convert Runs Containing them, Where Anything Is Transformed
+            if word.has_text_to_transform(paragraph, cell is not None):
+                with metrics.timed("cleanup_bad_runs"):
+                    word.cleanup_bad_runs(paragraph)
+            for ix_run, run in enumerate(paragraph.runs):
+                yield WorkItem(
+                    "run", part, path + ("runs", str(ix_run)), paragraph, run, cell, run.text
+                )
+
+        # Text Boxes Anchored In This Paragraph
+        for ix_box, txbx in enumerate(_text_boxes(p)):
+            box = path + ("text_boxes", str(ix_box))
+            yield from self.walk(
+                container=txbx, story=story, part=part,
+                paragraphs_path=box + ("paragraphs",), tables_path=box + ("tables",),
+                rows_key="rows"
+            )
+
+    def _walk_table(
+        self,
+        tbl,
+        story: _Story,
+        part: Part,
+        path: Path,
+        rows_key: str
+    ) -> Iterator[WorkItem]:
+        for ix_row, tr in enumerate(tbl.tr_lst):
+            # Cells Are Numbered By Grid Column, Like row.cells
+            ix_col = 0
+            for tc in tr.tc_lst:
+                cell = path + (rows_key, str(ix_row), "cells", str(ix_col))
+                yield from self.walk(
+                    container=tc, story=story, part=part,
+                    paragraphs_path=cell + ("paragraphs",), tables_path=cell + ("tables",),
+                    rows_key="rows", cell=cell
+                )
+                last_p = tc.p_lst[-1] if tc.p_lst else None
+                yield WorkItem(
+                    "cell", part, cell,
+                    None if last_p is None else Paragraph(last_p, story), None, cell
+                )
+                ix_col += tc.grid_span
+
+
+def _text_boxes(p) -> list:
+    """
+    Text box contents anchored in p itself (not in nested paragraphs)
+    """
+    if p.find(f".//{W_TXBX_CONTENT}") is None:
+        return []
+    boxes = []
+    for txbx in p.iter(W_TXBX_CONTENT):
+        ancestor = txbx.getparent()
+        while ancestor is not p and ancestor.tag not in (W_P, MC_FALLBACK):
+            ancestor = ancestor.getparent()
+        if ancestor is p:
+            boxes.append(txbx)
+    return boxes
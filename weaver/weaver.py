@@ -4,12 +4,25 @@ Main Document Weaving Class
 
 from typing import Literal
 import logging
+import os
+import threading
 from tqdm import tqdm
 from docx import Document
-from . import word
+from . import (
+    dispatch, incremental, metrics, package, planning, preflight, ratelimit, routing, scheduling,
+    streaming, traverse, word
+)
+from .cache import TransformCache
+from .comments import CommentWriter
+from .dedupe import SegmentIndex, SegmentKey
+from .journal import Journal, load_journal
+from .results import USAGE_COLUMNS, ResultTable
 from .settings import DocxWeaverSettings
 log = logging.getLogger(__name__)
 
+# Part types of the counts of a plan (runs of table cells count as "tables")
+PLAN_PARTS = {"body": "paragraphs", "header": "headers", "footer": "footers"}
+
 class DocxWeaver:
     """
     Class to Convert/Translate and otherwise mutate Word Documents
@@ -23,6 +36,35 @@ class DocxWeaver:
             - transform_only: Only transform the document inplace
             - transform_and_comments: Transform the document and put original text
             in comments
+    concurrency: int | None - Max concurrent LLM requests. When set, all runs are
+        collected first and transformed concurrently, otherwise runs are
+        transformed one at a time. The output document is the same either way.
+    batch_tokens: int | None - When set, runs are collected first and packed into
+        batched prompts of up to this many input tokens (retrying missing runs
+        one by one). Combine with concurrency to send several batches at once.
+    cache_path: str | None - SQLite file caching transformations across runs and
+        processes (defaults to the CACHE_PATH setting, disabled if neither is set)
+    metrics_hooks: list[metrics.SpanHook] | None - Called with every timed span
+        of a weave (e.g. to forward them to a tracer)
+    granularity: Literal["run", "paragraph"] - Transform paragraphs (outside
+        tables) run by run, or whole in a single call with their formatting
+        spans marked, mapping the result back onto the runs of each span
+    fast_model_name: Literal["gpt-4-turbo", "gpt-3.5-turbo", "gpt-4o"] | None - Cheaper
+        model short/simple segments are sent to first, escalating to the
+        configured model when it fails (defaults to the OPENAI_FAST_MODEL_NAME
+        setting, no routing if neither is set)
+    settings: DocxWeaverSettings | None - Settings already loaded (e.g. by a
+        server weaving many documents), read from the environment if not given
+    cache: TransformCache | None - Cache shared with other weaves, used
+        instead of opening cache_path
+    client_loop: dispatch.AsyncClientLoop | None - Shared loop and async client
+        concurrent/batched requests are sent through, instead of a client
+        opened per weave
+    schedule: Literal["fifo", "lpt", "deadline"] | scheduling.Scheduler - Order
+        concurrent/batched requests are sent in, whatever part of the document
+        they come from: document order, longest first (shortest weave), or by
+        latest start (see scheduling). Results are applied in document order
+        either way.
     """
     def __init__(
         self,
@@ -31,263 +73,790 @@ class DocxWeaver:
         paragraph_prompt: str,
         table_prompt: str | None,
         mode: Literal["comments_only", "transform_only", "transform_and_comments"],
-        openai_model_name: Literal["gpt-4-turbo", "gpt-3.5-turbo", "gpt-4o"] = "gpt-4o"
+        openai_model_name: Literal["gpt-4-turbo", "gpt-3.5-turbo", "gpt-4o"] = "gpt-4o",
+        concurrency: int | None = None,
+        batch_tokens: int | None = None,
+        cache_path: str | None = None,
+        metrics_hooks: list[metrics.SpanHook] | None = None,
+        granularity: Literal["run", "paragraph"] = "run",
+        fast_model_name: Literal["gpt-4-turbo", "gpt-3.5-turbo", "gpt-4o"] | None = None,
+        settings: DocxWeaverSettings | None = None,
+        cache: TransformCache | None = None,
+        client_loop: dispatch.AsyncClientLoop | None = None,
+        schedule: Literal["fifo", "lpt", "deadline"] | scheduling.Scheduler = "lpt"
     ):
         assert mode in ["comments_only", "transform_only", "transform_and_comments"]
         assert isinstance(purpose, str)
         assert isinstance(paragraph_prompt, str)
-        self.settings = DocxWeaverSettings(openai_model_name=openai_model_name)
+        assert concurrency is None or concurrency > 0
+        assert batch_tokens is None or batch_tokens > 0
+        assert granularity in ["run", "paragraph"]
+        assert callable(schedule) or schedule in scheduling.SCHEDULERS
+        if settings is None:
+            self.settings = DocxWeaverSettings(openai_model_name=openai_model_name)
+        else:
+            self.settings = settings.model_copy(update={"openai_model_name": openai_model_name})
+        self.rate_limiter = self._configure_rate_limiter(self.settings.openai_model_name)
+        self.fast_model_name = fast_model_name or self.settings.openai_fast_model_name
+        if self.fast_model_name == self.settings.openai_model_name:
+            self.fast_model_name = None
+        self.fast_rate_limiter = None if self.fast_model_name is None else (
+            self._configure_rate_limiter(self.fast_model_name)
+        )
         self.filename = filename
         self.document = Document(filename)
         self.table_prompt = table_prompt
         self.paragraph_prompt = paragraph_prompt
         self.purpose = purpose
         self.mode = mode
+        self.concurrency = concurrency
+        self.batch_tokens = batch_tokens
+        cache_path = cache_path or self.settings.cache_path
+        self.cache = cache if cache is not None or cache_path is None else TransformCache(
+            path=cache_path,
+            max_entries=self.settings.cache_max_entries,
+            ttl=self.settings.cache_ttl
+        )
+        self.metrics_hooks = metrics_hooks or []
+        self.granularity = granularity
+        self.client_loop = client_loop
+        self.schedule = schedule
 
-    def weave_document(self, output_fn: str):
+    def _configure_rate_limiter(self, model_name: str) -> ratelimit.RateLimiter:
+        """
+        Configures the shared limiter of a model from the settings
+        """
+        return ratelimit.configure_rate_limiter(
+            model_name=model_name,
+            requests_per_minute=self.settings.openai_requests_per_minute.get(
+                model_name, ratelimit.DEFAULT_REQUESTS_PER_MINUTE
+            ),
+            tokens_per_minute=self.settings.openai_tokens_per_minute.get(
+                model_name, ratelimit.DEFAULT_TOKENS_PER_MINUTE
+            ),
+            max_concurrency=self.settings.openai_max_concurrency,
+            request_timeout=self.settings.openai_request_timeout,
+            hedge_quantile=self.settings.openai_hedge_quantile,
+            hedge_budget=self.settings.openai_hedge_budget
+        )
+
+    def weave_document(
+        self,
+        output_fn: str,
+        previous: dict | str | None = None,
+        journal_path: str | None = None,
+        resume: bool = False,
+        results: Literal["nested", "table"] = "nested"
+    ):
         """
         Transforms the entire document
+        previous: dict | str | None - Result of weaving an earlier revision of the
+            document (or the path of its JSON dump). Paragraphs and cells whose
+            content is unchanged reuse its outputs, only the others are sent to
+            the LLM.
+        journal_path: str | None - JSON lines file each finished run is appended
+            to as soon as it is transformed
+        resume: bool - Replay the runs of an existing journal (e.g. of a weave
+            that crashed) instead of transforming them again, and append to it
+        results: Literal["nested", "table"] - Return the woven runs nested by
+            location (under "paragraphs", "tables"...), or as a ResultTable of
+            one row per run under "runs" (see results.ResultTable)
         """
         assert output_fn.endswith(".docx")
+        assert journal_path is not None or not resume
+        assert results in ["nested", "table"]
+        return self._measure_weave(
+            output_fn=output_fn, previous=previous, journal_path=journal_path,
+            resume=resume, results=results
+        )
 
-        # Paragraphs are always translated
-        para_data = self._weave_paragraphs()
-        section_para_data = self._weave_section_paragraphs()
+    def stream_document(
+        self,
+        output_fn: str,
+        previous: dict | str | None = None,
+        journal_path: str | None = None,
+        resume: bool = False,
+        save_interval: float | None = streaming.SAVE_INTERVAL,
+        max_pending: int = streaming.MAX_PENDING_EVENTS,
+        schedule: Literal["fifo", "lpt", "deadline"] | scheduling.Scheduler = (
+            streaming.STREAM_SCHEDULE
+        )
+    ) -> streaming.WeaveStream:
+        """
+        Transforms the entire document in a background thread, returning the
+        stream of its events (see streaming): each run as soon as it is woven,
+        partial saves of the document and the weave result. Nothing is
+        collected for the whole document. With concurrency/batch_tokens, runs
+        are applied in document order as their segments come back, instead of
+        once all of them are generated.
+        save_interval: float | None - Seconds between saves of the document
+            woven so far to a ".partial.docx" next to output_fn (None for none),
+            removed once the output is saved
+        max_pending: int - Events waiting for the consumer before the weave pauses
+        schedule: Literal["fifo", "lpt", "deadline"] | scheduling.Scheduler -
+            Order the requests are sent in, instead of the weaver's schedule:
+            by latest start by default, so the first runs come back early
+        """
+        assert output_fn.endswith(".docx")
+        assert journal_path is not None or not resume
+        assert callable(schedule) or schedule in scheduling.SCHEDULERS
+        stream = streaming.WeaveStream(save_interval=save_interval, max_pending=max_pending)
+        stream.start(lambda stream: self._measure_weave(
+            output_fn=output_fn, previous=previous, journal_path=journal_path,
+            resume=resume, results="nested", stream=stream, schedule=schedule
+        ))
+        return stream
 
-        # Tables and Section Paragraphs/Headers are only run if transforming
-        if self.mode in ["transform_only", "transform_and_comments"]:
-            table_row_data = self._weave_tables()
-            section_header_data = self._weave_section_headers()
-        else:
-            table_row_data = {}
-            section_para_data = {}
-            section_header_data = {}
-        self.document.save(output_fn)
+    def _measure_weave(
+        self,
+        output_fn: str,
+        previous: dict | str | None,
+        journal_path: str | None,
+        resume: bool,
+        results: Literal["nested", "table"],
+        stream: streaming.WeaveStream | None = None,
+        schedule: str | scheduling.Scheduler | None = None
+    ) -> dict:
+        """
+        Weaves the document with a metrics collector active, adding the
+        metrics and model report to the result
+        """
+        # Timings, Requests, Tokens And Cache Hits Of This Weave
+        collector = metrics.WeaveMetrics(hooks=self.metrics_hooks)
+        with collector.activate(), metrics.timed("weave", output_fn=output_fn):
+            weave_result = self._weave_document(
+                output_fn=output_fn, previous=previous, journal_path=journal_path,
+                resume=resume, results=results, stream=stream, schedule=schedule
+            )
+        weave_result["metrics"] = collector.to_dict()
+        log.info("Metrics: %s", weave_result["metrics"])
+        # Calls, Latency, Throughput And Cost Per Model
+        weave_result["models"] = routing.model_report(
+            weave_result["metrics"]["models"], prices=self.settings.openai_model_prices
+        )
+        log.info("Models: %s", weave_result["models"])
+        return weave_result
+
+    def plan(
+        self,
+        concurrency: int | None = None,
+        requests_per_minute: int | None = None,
+        tokens_per_minute: int | None = None,
+        tokens_per_second: float = planning.COMPLETION_TOKENS_PER_SECOND
+    ) -> dict:
+        """
+        Dry run of weave_document: goes through the document the same way
+        (cleaning up its runs in place), but sends nothing to the LLM. Returns
+        the runs, skipped runs and unique segments per part type, the requests
+        and tokens each model would get (see planning), and the projected wall
+        time of the requests.
+        concurrency: int | None - Max requests in flight (defaults to the
+            weaver's concurrency, one at a time if not set)
+        requests_per_minute: int | None - Request budget of every model
+            (defaults to the OPENAI_REQUESTS_PER_MINUTE setting of each)
+        tokens_per_minute: int | None - Token budget of every model (defaults
+            to the OPENAI_TOKENS_PER_MINUTE setting of each)
+        tokens_per_second: float - Assumed generation speed of the replies
+        """
+        concurrency = concurrency or self.concurrency or 1
+        with metrics.timed("traverse"):
+            items = self._plan_work_items()
+        texts = [item.text for item in items if item.kind != "cell"]
+        prepared = preflight.prepare_segments(texts)
+        router = None if self.fast_model_name is None else self._route_segments(items, prepared)
+
+        # Counts Per Part Type, Segments Deduplicated Within The Part And Across The Document
+        plan_data = dict.fromkeys(planning.SEGMENT_COUNTS, 0)
+        parts: dict[str, dict[str, int]] = {}
+        part_keys: dict[str, set[SegmentKey]] = {}
+        keys: dict[SegmentKey, None] = {}  # Ordered Set
+        for item in items:
+            if item.kind == "cell":
+                continue
+            part = "tables" if item.cell is not None else PLAN_PARTS.get(item.part, item.part)
+            counts = parts.setdefault(part, {"runs": 0, "skipped": 0, "segments": 0})
+            counts["runs"] += 1
+            run = dispatch.prepare_run(
+                src_text=item.text,
+                prompt=self._item_prompt(item),
+                purpose=self.purpose,
+                model_name=self.settings.openai_model_name,
+                prepared=prepared
+            )
+            if run is None:
+                counts["skipped"] += 1
+                continue
+            part_keys.setdefault(part, set()).add(run[0])
+            keys[run[0]] = None
+        for part, counts in parts.items():
+            counts["segments"] = len(part_keys.get(part, ()))
+        plan_data["runs"] = len(texts)
+        plan_data["skipped"] = sum(counts["skipped"] for counts in parts.values())
+        plan_data["segments"] = len(keys)
+        if self.cache is not None:
+            cached = [
+                key for key in keys if self.cache.contains(
+                    model_name=key.model_name, purpose=key.purpose,
+                    prompt=key.prompt, src_text=key.src_text
+                )
+            ]
+            plan_data["cached"] = len(cached)
+            for key in cached:
+                del keys[key]
+        requests = planning.plan_requests(
+            list(keys), batch_tokens=self.batch_tokens, router=router
+        )
+        plan_data["requests"] = len(requests)
+        plan_data["parts"] = parts
+        plan_data["models"] = planning.summarize_requests(
+            requests, prices=self.settings.openai_model_prices, tokens_per_second=tokens_per_second
+        )
+        plan_data["wall_time"] = planning.project_wall_time(
+            plan_data["models"],
+            concurrency=concurrency,
+            requests_per_minute=self.settings.openai_requests_per_minute
+            if requests_per_minute is None
+            else dict.fromkeys(plan_data["models"], requests_per_minute),
+            tokens_per_minute=self.settings.openai_tokens_per_minute
+            if tokens_per_minute is None
+            else dict.fromkeys(plan_data["models"], tokens_per_minute)
+        )
+        if router is not None:
+            plan_data["routing"] = router.stats()
+        log.info("Plan: %s", plan_data)
+        return plan_data
+
+    def _weave_document(
+        self,
+        output_fn: str,
+        previous: dict | str | None,
+        journal_path: str | None,
+        resume: bool,
+        results: Literal["nested", "table"],
+        stream: streaming.WeaveStream | None = None,
+        schedule: str | scheduling.Scheduler | None = None
+    ) -> dict:
+        """
+        Body of weave_document, run with its metrics collector active. Given a
+        stream, runs are emitted to it instead of returned. schedule overrides
+        the weaver's schedule when given.
+        """
+        rate_limit_start = self.rate_limiter.stats()
+
+        # Plan: One Pass Over The Document, Collecting The Runs To Transform
+        log.info("Collecting Runs")
+        with metrics.timed("traverse"):
+            items = self._plan_work_items()
+
+        # Incremental: Reuse The Outputs Of Unchanged Paragraphs/Cells
+        fingerprints = self._fingerprint_units(items)
+        reused: dict[int, str] = {}
+        if previous is not None:
+            reused, incremental_data = self._reuse_outputs(
+                items=items,
+                fingerprints=fingerprints,
+                previous_outputs=incremental.collect_outputs(incremental.load_previous(previous))
+            )
+            log.info("Incremental: %s", incremental_data)
+
+        # Journal: Replay Runs Finished Before A Crash
+        run_journal = None
+        if journal_path is not None:
+            source_hashes = {
+                item.path: self._source_hash(item) for item in items if item.kind != "cell"
+            }
+            journal_data = {"path": journal_path, "replayed": 0}
+            if resume:
+                entries = load_journal(journal_path)
+                for ix, item in enumerate(items):
+                    output = entries.get((item.path, source_hashes.get(item.path)))
+                    if output is not None:
+                        reused[ix] = output
+                        journal_data["replayed"] += 1
+                log.info("Replaying %s Runs From %s", journal_data["replayed"], journal_path)
+            run_journal = Journal(path=journal_path, resume=resume)
+        pending = [item for ix, item in enumerate(items) if ix not in reused]
+
+        # Pre-Flight: Classify And Prepare Every Run Left At Once
+        texts = [item.text for item in pending if item.kind != "cell"]
+        with metrics.timed("preflight", runs=len(texts)):
+            prepared = preflight.prepare_segments(texts)
+            preflight_data = preflight.preflight_stats(texts, prepared)
+        log.info("Pre-Flight: %s", preflight_data)
+
+        # Routing: Short/Simple Segments Go To The Fast Model First
+        router = None
+        if self.fast_model_name is not None:
+            router = self._route_segments(pending, prepared)
+
+        # Unique segments are transformed once and fanned out to every occurrence
+        index = SegmentIndex()
+        prefetch = (self.concurrency is not None) | (self.batch_tokens is not None)
+        journal_segments = None
+        if prefetch and run_journal is not None:
+            journal_segments = self._journal_segments(
+                items=pending, prepared=prepared, run_journal=run_journal,
+                source_hashes=source_hashes
+            )
+        background = None
+        partial_fn = output_fn[:-len(".docx")] + ".partial.docx"
+        try:
+            if prefetch and stream is not None:
+                # Streamed: Runs Are Applied As Their Segments Come Back
+                background = dispatch.BackgroundPrefetch(
+                    index=index,
+                    generate=lambda on_result, cancelled: self._prefetch_transformations(
+                        pending, prepared,
+                        on_result=on_result if journal_segments is None
+                        else _chain(journal_segments, on_result),
+                        usage=index.usage,
+                        router=router,
+                        cancelled=cancelled,
+                        schedule=schedule
+                    ),
+                    interrupt=stream.cancelled
+                )
+            elif prefetch:
+                with metrics.timed("prefetch"):
+                    index.results.update(self._prefetch_transformations(
+                        pending, prepared,
+                        on_result=journal_segments,
+                        usage=index.usage,
+                        router=router
+                    ))
+            transform_fn = dispatch.IndexedTransform(
+                index=index, cache=self.cache, prepared=prepared, router=router, prefetch=background
+            )
+            with metrics.timed("apply", items=len(items)):
+                weave_data = self._apply_work_items(
+                    items=items,
+                    transform_fn=transform_fn,
+                    fingerprints=fingerprints,
+                    reused=reused,
+                    # Prefetched runs are journaled as their segments complete
+                    run_journal=None if prefetch else run_journal,
+                    source_hashes=None if run_journal is None else source_hashes,
+                    table=ResultTable() if results == "table" and stream is None else None,
+                    stream=stream,
+                    partial_fn=partial_fn
+                )
+        finally:
+            if background is not None:
+                background.close()
+            if run_journal is not None:
+                run_journal.close()
+        # Only Parts Modified By The Weave Are Compressed Again
+        with metrics.timed("save"):
+            package.save_document(self.document, output_fn=output_fn, source_fn=self.filename)
+        if stream is not None and os.path.exists(partial_fn):
+            os.remove(partial_fn)
         log.info("Finished Weaving Document: %s", output_fn)
-        # output_fn_unzipped = word.unpack_word_document(output_fn=output_fn)
-        # word.rebuild_word_doc_from_zip(
-        #     output_fn=output_fn,
-        #     output_fn_unzipped=output_fn_unzipped
-        # )
+        if previous is not None:
+            weave_data["incremental"] = incremental_data
+        if run_journal is not None:
+            journal_data["recorded"] = run_journal.entries
+            weave_data["journal"] = journal_data
+        weave_data["preflight"] = preflight_data
+        weave_data["segments"] = index.stats()
+        log.info("Segments: %s", weave_data["segments"])
+        if router is not None:
+            weave_data["routing"] = router.stats()
+            log.info("Routing: %s", weave_data["routing"])
+        # Requests Made By This Weave (the limiter is shared by the process)
+        rate_limit_end = self.rate_limiter.stats()
+        weave_data["rate_limit"] = {
+            key: rate_limit_end[key] - rate_limit_start[key]
+            for key in ["requests", "throttled", "retried", "failed", "hedged", "hedge_wins"]
+        }
+        weave_data["rate_limit"]["concurrency"] = rate_limit_end["concurrency"]
+        log.info("Rate Limit: %s", weave_data["rate_limit"])
+        if self.cache is not None:
+            weave_data["cache"] = self.cache.stats()
+            log.info("Transformation Cache: %s", weave_data["cache"])
         return {
             "output_fn": output_fn,
-            "paragraphs": para_data,
-            "tables": table_row_data,
-            "section_paragraphs": section_para_data,
-            "section_headers": section_header_data
+            **weave_data
         }
 
-
-    def _weave_paragraphs(self) -> dict[str, dict]:
+    def _plan_work_items(self) -> list[traverse.WorkItem]:
         """
-        Weave a single paragraph according to the prompt/constructor
+        Runs, paragraphs (at paragraph granularity) and table cells to weave
+        according to the mode, in document order
         """
-        # Translating Paragraphs
-        log.info("Processing Paragraphs")
-        paragraph_data = {}
-        for ix_para, paragraph in tqdm(
-            enumerate(self.document.paragraphs),
-            total=len(self.document.paragraphs)
+        # Tables are only run if transforming
+        tables = (self.mode in ["transform_only", "transform_and_comments"]) & (
+            self.table_prompt is not None
+        )
+        items = []
+        for item in traverse.iter_work_items(
+            self.document, accept_paragraph=self._accept_paragraph, tables=tables,
+            paragraphs=self.granularity == "paragraph"
         ):
-            if paragraph.text in ["", "\xa0", "\n"]:
-                log.debug("No Processing For Paragraph = %s", ix_para)
+            if item.kind == "run" and word.skip_run(item.text, in_table=item.cell is not None):
                 continue
-            else:
-                # Process and Insert Paragraph
-                paragraph_data[str(ix_para)] = {
-                    'type': "paragraph",
-                    "runs": word.transform_paragraph(
-                        paragraph=paragraph,
-                        paragraph_prompt=self.paragraph_prompt,
-                        purpose=self.purpose,
-                        model_name=self.settings.openai_model_name,
-                        mode=self.mode
-                    )
-                }
-        log.info("Finished Processing Paragraphs")
-        return paragraph_data
+            if item.kind == "paragraph" and word.skip_run(word.strip_span_markers(item.text)):
+                continue
+            items.append(item)
+        return items
 
-    def _weave_tables(self) -> dict[str, dict]:
+    def _accept_paragraph(self, part: traverse.Part, paragraph, in_table: bool) -> bool:
         """
-        Translate tables according to the prompt/construcot
+        Whether the runs of a paragraph are woven
         """
-        log.info("Processing Tables")
-        table_data = {}
-        for ix_table, table in tqdm(
-            enumerate(self.document.tables),
-            total=len(self.document.tables)
-        ):
-            # Append Table
-            table_data[str(ix_table)] = {
-                "rows":  word.transform_table(
-                    table,
-                    table_prompt=self.table_prompt,
-                    purpose=self.purpose,
-                    model_name=self.settings.openai_model_name,
-                    write_comments=True if "comments" in self.mode else False,
-                )
-            }
-            log.debug("Finished Processing Table = %s\n", ix_table)
-        log.info("Finished Processing Tables")
-        return table_data
+        text = paragraph.text
+        if in_table:
+            return not word.skip_table_paragraph(text)
+        if part == "body":
+            return text not in word.EMPTY_PARAGRAPH_TEXTS
+        # Notes can't hold comments, so there is nothing to do for them in comments_only
+        if part in ["footnotes", "endnotes"] and self.mode == "comments_only":
+            return False
+        # Headers/Footers
+        return "::::" not in text
 
-    def _weave_section_paragraphs(self) -> dict[str, dict]:
+    def _fingerprint_units(self, items: list[traverse.WorkItem]) -> dict[traverse.Path, str]:
         """
-        Convert/Transform all section paragraphs in the document
+        Content hash of the planned runs of each paragraph (outside tables) and
+        table cell, keyed by its location
         """
-        section_data = {}
-        for ix_section, section in tqdm(
-            enumerate(self.document.sections),
-            total=len(self.document.sections)
-        ):
-            # Translate Headers
-            header_paragraph_data = {}
-            for ix_para, paragraph in enumerate(section.header.paragraphs):
-                if "::::" in paragraph.text:
-                    continue
-                header_paragraph_data[str(ix_para)] = {
-                    "type": "paragraph",
-                    "runs": word.transform_paragraph(
-                        paragraph,
-                        paragraph_prompt=self.paragraph_prompt,
-                        purpose=self.purpose,
-                        model_name=self.settings.openai_model_name,
-                        mode=self.mode,
-                        root_type="header"
-                    )
-                }
-            # Translate Footers
-            footer_paragraph_data = {}
-            for ix_para, paragraph in enumerate(section.footer.paragraphs):
-                if "::::" in paragraph.text:
-                    continue
-                footer_paragraph_data[str(ix_para)] = {
-                    "type": "paragraph",
-                    "runs": word.transform_paragraph(
-                        paragraph,
-                        paragraph_prompt=self.paragraph_prompt,
-                        purpose=self.purpose,
-                        model_name=self.settings.openai_model_name,
-                        mode=self.mode,
-                        root_type="header"
-                    )
-                }
-            # Translate First Page Header/Footer?
-            first_page_header_paragraph_data = {}
-            for ix_para, paragraph in enumerate(section.first_page_header.paragraphs):
-                if "::::" in paragraph.text:
-                    continue
-                first_page_header_paragraph_data[str(ix_para)] = {
-                    "type": "paragraph",
-                    "runs": word.transform_paragraph(
-                        paragraph,
-                        paragraph_prompt=self.paragraph_prompt,
-                        purpose=self.purpose,
-                        model_name=self.settings.openai_model_name,
-                        mode=self.mode,
-                        root_type="header"
-                    )
-                }
-            # Translate Footers
-            first_page_footer_paragraph_data = {}
-            for ix_para, paragraph in enumerate(section.first_page_footer.paragraphs):
-                if "::::" in paragraph.text:
-                    continue
-                first_page_footer_paragraph_data[str(ix_para)] = {
-                    "type": "paragraph",
-                    "runs": word.transform_paragraph(
-                        paragraph,
-                        paragraph_prompt=self.paragraph_prompt,
-                        purpose=self.purpose,
-                        model_name=self.settings.openai_model_name,
-                        mode=self.mode,
-                        root_type="header"
-                    )
-                }
-            # Append Translation Data
-            section_data[str(ix_section)] = {
-                "type": "section",
-                "header_paragraphs": header_paragraph_data,
-                "footer_paragraphs": footer_paragraph_data,
-                "first_page_header_paragraphs": first_page_header_paragraph_data,
-                "first_page_footer_paragraphs": first_page_footer_paragraph_data
-            }
-        log.info("Finished Processing Section Paragraphs")
-        return section_data
+        units: dict[traverse.Path, tuple[str, list[str]]] = {}
+        for item in items:
+            if item.kind != "cell":
+                unit = units.setdefault(_unit_path(item), (self._item_prompt(item), []))
+                unit[1].append(item.text)
+        return {
+            path: incremental.fingerprint(
+                texts=texts,
+                prompt=prompt,
+                purpose=self.purpose,
+                model_name=self.settings.openai_model_name
+            )
+            for path, (prompt, texts) in units.items()
+        }
 
-    def _weave_section_headers(self) -> dict[str, dict]:
+    def _item_prompt(self, item: traverse.WorkItem) -> str:
         """
-        Convert/Transform all section headers in the document
+        Prompt a run/paragraph is woven with (marked paragraphs get the
+        instructions for their markers)
         """
-        section_data = {}
+        if item.cell is not None:
+            return self.table_prompt
+        if item.kind == "paragraph" and word.is_marked(item.text):
+            return self.paragraph_prompt + word.SPAN_MARKER_PROMPT
+        return self.paragraph_prompt
 
-        for ix_section, section in tqdm(
-            enumerate(self.document.sections),
-            total=len(self.document.sections)
-        ):
-            # Translate Headers
-            header_table_data = {}
-            for ix_table, table in enumerate(section.header.tables):
-                header_table_data[str(ix_table)] = {
-                    "type": "table",
-                    "runs": word.transform_table(
-                        table,
-                        table_prompt=self.table_prompt,
-                        purpose=self.purpose,
-                        model_name=self.settings.openai_model_name,
-                        write_comments=True if "comments" in self.mode else False,
-                        root_type="header"
-                    )
-                }
-            # Translate Footers
-            footer_table_data = {}
-            for ix_table, table in enumerate(section.footer.tables):
-                footer_table_data[str(ix_table)] = {
-                    "type": "table",
-                    "runs": word.transform_table(
-                        table,
-                        table_prompt=self.table_prompt,
-                        purpose=self.purpose,
-                        model_name=self.settings.openai_model_name,
-                        write_comments=True if "comments" in self.mode else False,
-                        root_type="header"
+    def _source_hash(self, item: traverse.WorkItem) -> str:
+        """
+        Hash of the source text of a run/paragraph, in the context it is woven in
+        """
+        return incremental.fingerprint(
+            texts=[item.text],
+            prompt=self._item_prompt(item),
+            purpose=self.purpose,
+            model_name=self.settings.openai_model_name
+        )
+
+    @staticmethod
+    def _reuse_outputs(
+        items: list[traverse.WorkItem],
+        fingerprints: dict[traverse.Path, str],
+        previous_outputs: dict[str, list[incremental.RunOutput]]
+    ) -> tuple[dict[int, str], dict[str, int]]:
+        """
+        Previous outputs of the planned runs (by item index) whose paragraph/cell
+        is unchanged, and the counts of the incremental weave
+        """
+        reused: dict[int, str] = {}
+        ix_runs: dict[traverse.Path, int] = {}
+        for ix, item in enumerate(items):
+            if item.kind == "cell":
+                continue
+            unit = _unit_path(item)
+            ix_run = ix_runs[unit] = ix_runs.get(unit, -1) + 1
+            outputs = previous_outputs.get(fingerprints[unit])
+            # Runs left as is are tried again (they may have failed)
+            if outputs is not None and outputs[ix_run] is not None:
+                reused[ix] = outputs[ix_run]
+        return reused, {
+            "units": len(fingerprints),
+            "unchanged": sum(
+                fingerprint in previous_outputs for fingerprint in fingerprints.values()
+            ),
+            "runs": sum(item.kind != "cell" for item in items),
+            "runs_reused": len(reused)
+        }
+
+    def _route_segments(
+        self,
+        items: list[traverse.WorkItem],
+        prepared: dispatch.PreparedSegments
+    ) -> routing.ModelRouter:
+        """
+        Router of the segments of the planned runs, given where they occur
+        """
+        router = routing.ModelRouter(
+            model_name=self.settings.openai_model_name, fast_model_name=self.fast_model_name
+        )
+        for item in items:
+            if item.kind == "cell":
+                continue
+            run = dispatch.prepare_run(
+                src_text=item.text,
+                prompt=self._item_prompt(item),
+                purpose=self.purpose,
+                model_name=self.settings.openai_model_name,
+                prepared=prepared
+            )
+            if run is not None:
+                router.add(run[0], part=item.part, in_table=item.cell is not None)
+        return router
+
+    def _prefetch_transformations(
+        self,
+        items: list[traverse.WorkItem],
+        prepared: dispatch.PreparedSegments,
+        on_result: dispatch.OnResult | None = None,
+        usage: dict[SegmentKey, dict[str, float]] | None = None,
+        router: routing.ModelRouter | None = None,
+        cancelled: threading.Event | None = None,
+        schedule: str | scheduling.Scheduler | None = None
+    ) -> dict[SegmentKey, str | None]:
+        """
+        Generates the unique segments of the planned runs concurrently and/or
+        in batches, until cancelled is set (if given), in the order of
+        schedule (defaults to the weaver's)
+        """
+        keys = dispatch.collect_segment_keys(
+            segments=[
+                (item.text, self._item_prompt(item)) for item in items if item.kind != "cell"
+            ],
+            purpose=self.purpose,
+            model_name=self.settings.openai_model_name,
+            prepared=prepared
+        )
+        concurrency = self.concurrency or 1
+        schedule = self.schedule if schedule is None else schedule
+        log.info(
+            "Transforming %s Unique Segments (Concurrency = %s, Batch Tokens = %s, Schedule = %s)",
+            len(keys), concurrency, self.batch_tokens, schedule
+        )
+        return dispatch.generate_transformations(
+            keys=keys,
+            concurrency=concurrency,
+            cache=self.cache,
+            batch_tokens=self.batch_tokens,
+            on_result=on_result,
+            usage=usage,
+            router=router,
+            client_loop=self.client_loop,
+            schedule=schedule,
+            cancelled=cancelled
+        )
+
+    def _journal_segments(
+        self,
+        items: list[traverse.WorkItem],
+        prepared: dispatch.PreparedSegments,
+        run_journal: Journal,
+        source_hashes: dict[traverse.Path, str]
+    ) -> dispatch.OnResult:
+        """
+        Callback journaling the output of every run of a segment once it is generated
+        """
+        runs: dict[SegmentKey, list[tuple[traverse.Path, dict]]] = {}
+        for item in items:
+            if item.kind == "cell":
+                continue
+            run = dispatch.prepare_run(
+                src_text=item.text,
+                prompt=self._item_prompt(item),
+                purpose=self.purpose,
+                model_name=self.settings.openai_model_name,
+                prepared=prepared
+            )
+            if run is not None:
+                runs.setdefault(run[0], []).append((item.path, run[1]))
+
+        def on_result(key: SegmentKey, tgt_text: str | None):
+            if tgt_text is None:
+                return
+            for path, transforms_dict in runs.get(key, []):
+                run_journal.record(
+                    path=path,
+                    source_hash=source_hashes[path],
+                    output=word.reapply_src_text_transforms(
+                        tgt_text=tgt_text, transforms_dict=dict(transforms_dict)
                     )
-                }
-            # Translate First Page Header/Footer?
-            first_page_header_table_data = {}
-            for ix_table, table in enumerate(section.first_page_header.tables):
-                first_page_header_table_data[str(ix_table)] = {
-                    "type": "table",
-                    "runs": word.transform_table(
-                        table,
-                        table_prompt=self.table_prompt,
-                        purpose=self.purpose,
-                        model_name=self.settings.openai_model_name,
-                        write_comments=True if "comments" in self.mode else False,
-                        root_type="header"
+                )
+        return on_result
+
+    def _apply_work_items(
+        self,
+        items: list[traverse.WorkItem],
+        transform_fn: word.TransformFn,
+        fingerprints: dict[traverse.Path, str],
+        reused: dict[int, str],
+        run_journal: Journal | None = None,
+        source_hashes: dict[traverse.Path, str] | None = None,
+        table: ResultTable | None = None,
+        stream: streaming.WeaveStream | None = None,
+        partial_fn: str | None = None
+    ) -> dict[str, dict]:
+        """
+        Weaves the planned runs in document order, returning the nested weave
+        data (keyed by the location paths of the runs), with the fingerprint of
+        each paragraph/cell and the output of each run. Given a table, runs
+        are appended to it instead, and it is returned under "runs". Given a
+        stream, runs are emitted to it (and nothing is returned), and the
+        document is saved to partial_fn whenever a partial save is due.
+        Comments are collected along the way and written together at the end
+        (or at each partial save).
+        """
+        log.info("Processing Runs")
+        if stream is not None:
+            weave_data = {}
+        elif table is not None:
+            weave_data = {"runs": table}
+        else:
+            weave_data = {
+                "paragraphs": {},
+                "tables": {},
+                "section_paragraphs": {},
+                "section_headers": {}
+            }
+        # Aggregate translation across entire cells, for their comments
+        cells: dict[traverse.Path, dict] = {}
+        comments = CommentWriter()
+        transform_fn = incremental.ReplayTransform(transform_fn)
+        for ix, item in enumerate(tqdm(items)):
+            if item.kind == "cell":
+                if table is None and stream is None:
+                    _nested(weave_data, item.path).setdefault("paragraphs", {})
+                cell = cells.pop(item.path, None)
+                # Add Short Run Containing Comment
+                if cell is not None and cell["part_original"] != "" and item.paragraph is not None:
+                    write_comment = cell["add_comment"] & ("comments" in self.mode) & (
+                        item.part not in word.NO_COMMENT_ROOTS
                     )
-                }
-            # Translate Footers
-            first_page_footer_table_data = {}
-            for ix_table, table in enumerate(section.first_page_footer.tables):
-                first_page_footer_table_data[str(ix_table)] = {
-                    "type": "table",
-                    "runs": word.transform_table(
-                        table,
-                        table_prompt=self.table_prompt,
-                        purpose=self.purpose,
-                        model_name=self.settings.openai_model_name,
-                        write_comments=True if "comments" in self.mode else False,
-                        root_type="header"
+                    word.append_cell_run(
+                        item.paragraph,
+                        comment=cell["total_original"] if write_comment else None,
+                        comments=comments
                     )
+                continue
+
+            transform_fn.replay = reused.get(ix)
+            if item.kind == "paragraph":
+                run_data = word.transform_paragraph_spans(
+                    item.paragraph,
+                    src_text=item.text,
+                    prompt=self._item_prompt(item),
+                    purpose=self.purpose,
+                    model_name=self.settings.openai_model_name,
+                    mode=self.mode,
+                    root_type="paragraph" if item.part == "body" else item.part,
+                    transform_fn=transform_fn,
+                    comments=comments
+                )
+            elif item.cell is None:
+                run_data = word.transform_run(
+                    item.run,
+                    prompt=self.paragraph_prompt,
+                    purpose=self.purpose,
+                    model_name=self.settings.openai_model_name,
+                    mode=self.mode,
+                    root_type="paragraph" if item.part == "body" else item.part,
+                    transform_fn=transform_fn,
+                    comments=comments
+                )
+            else:
+                run_data, should_comment = word.transform_table_run(
+                    item.run,
+                    table_prompt=self.table_prompt,
+                    purpose=self.purpose,
+                    model_name=self.settings.openai_model_name,
+                    transform_fn=transform_fn
+                )
+                cell = cells.setdefault(
+                    item.cell, {"part_original": "", "total_original": "", "add_comment": False}
+                )
+                if run_data["translated"]:  # Record For Comment
+                    cell["part_original"] += run_data["original"]
+                cell["total_original"] += run_data["original"]
+                cell["add_comment"] = should_comment
+
+            # Append Run Data, Typing Paragraphs/Tables As The Original Section Weave Did
+            if stream is None:
+                paragraph_path = item.path if item.kind == "paragraph" else item.path[:-2]
+                paragraph_data = _nested(weave_data, paragraph_path)
+                if item.cell is None:
+                    paragraph_data.setdefault("type", "paragraph")
+                if paragraph_path[0] in ["section_paragraphs", "section_headers"]:
+                    _nested(weave_data, paragraph_path[:2]).setdefault("type", "section")
+                if paragraph_path[0] == "section_headers":
+                    _nested(weave_data, paragraph_path[:4]).setdefault("type", "table")
+            run_data["output"] = transform_fn.output
+            if run_journal is not None and ix not in reused and transform_fn.output is not None:
+                run_journal.record(
+                    path=item.path, source_hash=source_hashes[item.path], output=transform_fn.output
+                )
+            unit = _unit_path(item)
+            if table is not None or stream is not None:
+                row = {
+                    "path": "/".join(item.path),
+                    "part": item.part,
+                    "unit": "/".join(unit),
+                    "fingerprint": fingerprints[unit],
+                    **run_data,
+                    **dict.fromkeys(USAGE_COLUMNS, 0),
+                    **(transform_fn.usage or {})
                 }
-            # Append Translation Data
-            section_data[str(ix_section)] = {
-                "type": "section",
-                "header_tables": header_table_data,
-                "footer_tables": footer_table_data,
-                "first_page_header_tables": first_page_header_table_data,
-                "first_page_footer_tables": first_page_footer_table_data
-            }
-        log.info("Finished Processing Section Headers")
-        return section_data
+                if table is not None:
+                    table.append(**row)
+                    continue
+                stream.emit({"event": "run", **row, "elapsed": stream.elapsed()})
+                if stream.save_due():
+                    comments.flush()
+                    with metrics.timed("partial_save"):
+                        package.save_document(
+                            self.document, output_fn=partial_fn, source_fn=self.filename
+                        )
+                    stream.emit({"event": "save", "output_fn": partial_fn, "runs": ix + 1})
+                continue
+            if item.kind == "paragraph":
+                paragraph_data["paragraph"] = run_data
+            else:
+                paragraph_data.setdefault("runs", {})[item.path[-1]] = run_data
+            _nested(weave_data, unit).setdefault("fingerprint", fingerprints[unit])
+        # All Comments In One Pass (ids, comments part and anchors)
+        comments.flush()
+        log.info("Finished Processing Runs")
+        return weave_data
+
+
+def _chain(*callbacks: dispatch.OnResult) -> dispatch.OnResult:
+    """
+    Callback calling each of the callbacks in turn
+    """
+    def on_result(key: SegmentKey, tgt_text: str | None):
+        for callback in callbacks:
+            callback(key, tgt_text)
+    return on_result
+
+
+def _unit_path(item: traverse.WorkItem) -> traverse.Path:
+    """
+    Location of the paragraph (outside tables) or table cell a run belongs to
+    """
+    if item.kind == "paragraph":
+        return item.path
+    return item.cell if item.cell is not None else item.path[:-2]
+
+
+def _nested(data: dict, path: traverse.Path) -> dict:
+    """
+    Dict at path in nested dicts, creating missing levels
+    """
+    for key in path:
+        data = data.setdefault(key, {})
+    return data
@@ -2,23 +2,126 @@
 Module for all word integration related
 functions
 """
+# pylint: disable=too-many-lines
 
 # General Imports
-from typing import Any, Literal
+from typing import TYPE_CHECKING, Any, Callable, Literal
+import functools
 import logging
 import os
+import re
 import shutil
-import time
 import copy
 import string
 import json
-import pandas as pd
-import openai
 import docx
+from docx.oxml.ns import qn
+from lxml import etree
+from . import metrics, ratelimit
+from .cache import TransformCache
+from .comments import CommentWriter, add_comment
+
+# openai Is Imported On The First Request (it takes longer than the rest of the package)
+if TYPE_CHECKING:
+    import openai
 
 # Logger
 log = logging.getLogger(__name__)
 
+# Signature shared by transform_text and its stand-ins (src_text, prompt, purpose, model_name)
+TransformFn = Callable[..., tuple[str, bool, bool]]
+
+# Paragraphs without anything to transform
+EMPTY_PARAGRAPH_TEXTS = ["", "\xa0", "\n"]
+# Parts that can't hold comments, their runs get the original text appended instead
+NO_COMMENT_ROOTS = ["header", "footer", "footnotes", "endnotes"]
+# Run children written back by run.text, runs with any other child (field codes,
+# drawings, note references, page breaks...) are never merged
+TEXT_RUN_CHILDREN = {
+    qn("w:rPr"), qn("w:t"), qn("w:tab"), qn("w:br"), qn("w:cr"), qn("w:noBreakHyphen"),
+    qn("w:lastRenderedPageBreak")
+}
+# Formatting spans of a paragraph sent whole, e.g. "<s1>Net </s1><s2>revenue</s2>"
+SPAN_MARKER = re.compile(r"<s(\d+)>(.*?)</s\1>", re.DOTALL)
+SPAN_MARKER_TAG = re.compile(r"</?s\d+>")
+# Markers as models sometimes write them back, e.g. "<S1>" or "< /s1 >"
+LOOSE_SPAN_MARKER_TAG = re.compile(r"<\s*(/?)\s*[sS]\s*(\d+)\s*>")
+MARKED_TEXT = re.compile(r"(?:<s(\d+)>.*?</s\1>)+", re.DOTALL)
+# Appended to the paragraph prompt for marked texts
+SPAN_MARKER_PROMPT = (
+    " The text is split into formatting spans marked <s1>...</s1>, <s2>...</s2>, etc. "
+    "Keep every marker, in the order that reads naturally, around the text it formats."
+)
+# Output budget per segment: tokens of the source times OUTPUT_EXPANSION, plus
+# the JSON wrapper. Truncated replies are retried with twice the budget, up to
+# MAX_OUTPUT_TOKENS.
+OUTPUT_EXPANSION = 2.0
+OUTPUT_OVERHEAD_TOKENS = 24
+BATCH_OVERHEAD_TOKENS = 16
+MAX_OUTPUT_TOKENS = 4096
+# Static instructions opening every system prompt (keep them byte-stable, the
+# provider caches prompts by prefix)
+TRANSFORMATION_INSTRUCTIONS = (
+    "You are a tool used to apply user-specified transformations to text. "
+    "The task purpose and prompt are given below, the input text is sent by the user as "
+    "a json of the form {\"src_text\": \"input text\"}. "
+    "Avoid any filler like 'as a consultant' or 'I have reviewed' and be direct by only giving "
+    "the necessary information if you are commenting/reviewing, otherwise just transform the "
+    "text inplace. "
+    "Respond with a json of the form {\"skip\": false, \"tgt_text\": \"your response\"}. "
+    "If you can not respond with something useful, set skip to true and tgt_text to \"\"."
+)
+BATCH_INSTRUCTIONS = (
+    "You are a tool used to apply user-specified transformations to text. "
+    "The task purpose and prompt are given below, the input segments are sent by the user as "
+    "a json of the form {\"segments\": [{\"id\": \"segment id\", \"text\": \"input text\"}]}. "
+    "Avoid any filler like 'as a consultant' or 'I have reviewed' and be direct by only giving "
+    "the necessary information if you are commenting/reviewing, otherwise just transform the "
+    "text inplace. Transform every segment on its own and keep its id. "
+    "Respond with a json of the form "
+    "{\"results\": [{\"id\": \"segment id\", \"skip\": false, \"tgt_text\": \"your response\"}]}. "
+    "If you can not respond with something useful for a segment, set its skip to true and its "
+    "tgt_text to \"\"."
+)
+# Strict JSON schemas of the replies, with an explicit skip flag
+TRANSFORMATION_SCHEMA = {
+    "title": "transformation",
+    "type": "object",
+    "properties": {"skip": {"type": "boolean"}, "tgt_text": {"type": "string"}},
+    "required": ["skip", "tgt_text"],
+    "additionalProperties": False
+}
+BATCH_TRANSFORMATION_SCHEMA = {
+    "title": "batch_transformation",
+    "type": "object",
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string"},
+                    "skip": {"type": "boolean"},
+                    "tgt_text": {"type": "string"}
+                },
+                "required": ["id", "skip", "tgt_text"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["results"],
+    "additionalProperties": False
+}
+# Models constrained to the schemas by the API (structured outputs), others use JSON mode
+STRUCTURED_OUTPUT_MODELS = ["gpt-4o"]
+# Transforms dict leaving a text unchanged (see parse_and_prepare_src_text_transforms)
+NO_TRANSFORMS = {
+    "ltab": False, "rtab": False, "lnewline": False, "rnewline": False, "lspace": 0, "rspace": 0,
+    "outer_quotes": False, "outer_parens": False, "outer_triangles": False,
+    "outer_square_parens": False, "ltriangle": False, "rcolon": False, "rsemicolon": False,
+    "titled": False, "appended_period": False, "lpunct": None, "rpunct": None
+}
+
 
 def transform_table(
     table,
@@ -27,6 +130,8 @@ def transform_table(
     model_name: str,
     write_comments: bool,
     root_type: str = "table",
+    transform_fn: TransformFn | None = None,
+    comments: CommentWriter | None = None,
 ) -> dict[str, dict]:
     """
     Primary function for translation a paragraph into
@@ -35,7 +140,7 @@ def transform_table(
     if table_prompt is None:
         return {}
     row_data = {}
-    transformed_texts = []  # Record For Merged/Duplicates
+    transformed_texts: set[str] = set()  # Record For Merged/Duplicates
     for ix_row, row in enumerate(table.rows):
         row_cell_data = {}
         for ix_row_cell, cell in enumerate(row.cells):
@@ -46,17 +151,12 @@ def transform_table(
             part_original = ""
             total_original = ""
             total_translation = ""
+            should_comment = False
             row_cell_para_data = {}
             for ix_row_cell_para, paragraph in enumerate(cell.paragraphs):
-                if "::::" in paragraph.text:
-                    log.debug("Skipping Already Translated Paragraph")
-                    continue
-                if "Page" in paragraph.text:
+                if skip_table_paragraph(paragraph.text):
                     log.debug("Skipping Already Translated Paragraph")
                     continue
-                if paragraph.text in ["", "\xa0", "\n"]:
-                    log.debug("No Processing For Input Paragraph")
-                    continue
                 if paragraph.text in transformed_texts:
                     continue
                 else:
@@ -66,34 +166,23 @@ def transform_table(
                     # Process Runs
                     row_cell_para_run_data = {}
                     for ix_row_cell_para_run, run in enumerate(paragraph.runs):
-                        if "::::" in run.text:
-                            log.debug("Skipping Already Translated Paragraph")
-                            continue
-                        if run.text.strip() in ["", "\xa0", ".", "$", "●"]:
+                        if skip_run(run.text, in_table=True):
                             continue
                         else:
-                            # Store Comment Text For Later Update
-                            original_text = copy.deepcopy(str(run.text))
-
-                            # Transform Text
-                            run.text, translated, add_comment = transform_text(
-                                src_text=run.text,
-                                prompt=table_prompt,
+                            run_data, should_comment = transform_table_run(
+                                run,
+                                table_prompt=table_prompt,
                                 purpose=purpose,
-                                model_name=model_name
+                                model_name=model_name,
+                                transform_fn=transform_fn
                             )
-                            run.text += f" :::: {run.text} ::::"
-                            if translated:  # Record For Comment
-                                part_original += original_text
-                            total_original += original_text
-                            total_translation += copy.deepcopy(str(run.text))
-                            transformed_texts.append(total_translation.strip())
+                            if run_data["translated"]:  # Record For Comment
+                                part_original += run_data["original"]
+                            total_original += run_data["original"]
+                            total_translation += run_data["translation"]
+                            transformed_texts.add(total_translation.strip())
                         # Append Nested Run Data
-                        row_cell_para_run_data[str(ix_row_cell_para_run)] = {
-                            "original": original_text,
-                            "translation": run.text,
-                            "translated": translated
-                        }
+                        row_cell_para_run_data[str(ix_row_cell_para_run)] = run_data
                     # Append Paragraph
                     row_cell_para_data[str(ix_row_cell_para)] = {
                         "runs": row_cell_para_run_data
@@ -105,26 +194,21 @@ def transform_table(
 
             # Record Last Translation
             if total_translation.strip() != "":
-                transformed_texts.append(total_translation)
+                transformed_texts.add(total_translation)
 
             # Add Short Run Containing Comment
             if part_original != "":
                 if len(cell.paragraphs) == 0:
                     pass
                 else:
-                    # Append Run, And Comment To Avoid Overwriting Formatting
-                    last_para = cell.paragraphs[-1]
-                    last_para.append_runs("")
-                    run = last_para.runs[-1]
-                    if add_comment:
-                        if root_type not in ["header", "footer"]:
-                            if write_comments:
-                                run.add_comment(
-                                    text=total_original,
-                                    author='DocxWeaver',
-                                    initials="WW",
-                                    dtime=pd.Timestamp.now(tz="UTC").strftime("%Y-%m-%d")
-                                )
+                    write_comment = (
+                        should_comment & (root_type not in NO_COMMENT_ROOTS) & write_comments
+                    )
+                    append_cell_run(
+                        cell.paragraphs[-1],
+                        comment=total_original if write_comment else None,
+                        comments=comments
+                    )
         # Append Row
         row_data[str(ix_row)] = {
             "cells": row_cell_data
@@ -132,6 +216,53 @@ def transform_table(
     return row_data
 
 
+def transform_table_run(
+    run: docx.text.run.Run,
+    table_prompt: str,
+    purpose: str,
+    model_name: str,
+    transform_fn: TransformFn | None = None,
+) -> tuple[dict, bool]:
+    """
+    Transforms a run of a table cell in place, marking it as translated.
+    Returns the run data and whether the cell should get a comment.
+    """
+    transform_fn = transform_fn or transform_text
+
+    # Store Comment Text For Later Update
+    original_text = copy.deepcopy(str(run.text))
+
+    # Transform Text
+    run.text, translated, should_comment = transform_fn(
+        src_text=run.text,
+        prompt=table_prompt,
+        purpose=purpose,
+        model_name=model_name
+    )
+    run.text += f" :::: {run.text} ::::"
+    return {
+        "original": original_text,
+        "translation": run.text,
+        "translated": translated
+    }, should_comment
+
+
+def append_cell_run(
+    paragraph: docx.text.paragraph.Paragraph,
+    comment: str | None = None,
+    comments: CommentWriter | None = None
+):
+    """
+    Appends a short run to the last paragraph of a transformed cell, carrying
+    the cell's comment (if any) to avoid overwriting formatting. The comment
+    is queued on comments when given.
+    """
+    paragraph.append_runs("")
+    if comment is not None:
+        run = paragraph.runs[-1]
+        add_comment(run, run, text=comment, writer=comments)
+
+
 def transform_paragraph(
     paragraph: docx.text.paragraph.Paragraph,
     paragraph_prompt: str,
@@ -139,12 +270,13 @@ def transform_paragraph(
     model_name: str,
     mode: Literal["comments_only", "transform_only", "transform_and_comments"],
     root_type: str = "paragraph",
+    transform_fn: TransformFn | None = None,
+    comments: CommentWriter | None = None,
 ) -> dict[str, dict]:
     """
     Primary function for translation a paragraph into
     the tgt language
     """
-
     # Cleanup Paragraph In Place
     cleanup_bad_runs(paragraph)
 
@@ -153,130 +285,353 @@ def transform_paragraph(
     for ix_run, run in enumerate(paragraph.runs):
 
         # Review What Changed Before Jan9, 2020 to try to keep linking.
-        if run.text.strip() in ["", "\xa0", ".", "$", "●"]:
+        if skip_run(run.text):
             continue
         else:
-            # Store Comment Text For Later Update
-            original_text = str(copy.deepcopy(run.text))
-
-            if mode in ["comments_only"]:
-                # Get Translation Only (Comment In this case)
-                comment, translated, _ = transform_text(
-                    src_text=run.text,
-                    prompt=paragraph_prompt,
-                    purpose=purpose,
-                    model_name=model_name
-                )
-            else:
-                # Update To Translate Text
-                run.text, translated, _ = transform_text(
-                    src_text=run.text,
-                    prompt=paragraph_prompt,
-                    purpose=purpose,
-                    model_name=model_name
-                )
-                comment = original_text
-            if translated:  # Record For Comment
-                # Can't Add Comment To Header // Footer
-                if root_type not in ["header", "footer"]:
-                    if mode in ["transform_and_comments", "comments_only"]:
-                        run.add_comment(
-                            text=comment,
-                            author='DocxWeaver',
-                            initials="WW",
-                            dtime=pd.Timestamp.now(tz="UTC").strftime("%Y-%m-%d")
-                        )
-                else:
-                    run.text += f" :::: {original_text} ::::"
-
-            run_data[str(ix_run)] = {
-                "original": original_text,
-                "translation": run.text,
-                "translated": translated,
-            }
+            run_data[str(ix_run)] = transform_run(
+                run,
+                prompt=paragraph_prompt,
+                purpose=purpose,
+                model_name=model_name,
+                mode=mode,
+                root_type=root_type,
+                transform_fn=transform_fn,
+                comments=comments
+            )
     return run_data
 
 
+def transform_run(
+    run: docx.text.run.Run,
+    prompt: str,
+    purpose: str,
+    model_name: str,
+    mode: Literal["comments_only", "transform_only", "transform_and_comments"],
+    root_type: str = "paragraph",
+    transform_fn: TransformFn | None = None,
+    comments: CommentWriter | None = None,
+) -> dict:
+    """
+    Transforms a run of a paragraph in place and/or comments it, according
+    to the mode. Comments are queued on comments when given.
+    """
+    transform_fn = transform_fn or transform_text
+
+    # Store Comment Text For Later Update
+    original_text = str(copy.deepcopy(run.text))
+
+    if mode in ["comments_only"]:
+        # Get Translation Only (Comment In this case)
+        comment, translated, _ = transform_fn(
+            src_text=run.text,
+            prompt=prompt,
+            purpose=purpose,
+            model_name=model_name
+        )
+    else:
+        # Update To Translate Text
+        run.text, translated, _ = transform_fn(
+            src_text=run.text,
+            prompt=prompt,
+            purpose=purpose,
+            model_name=model_name
+        )
+        comment = original_text
+    if translated:  # Record For Comment
+        # Can't Add Comment To Header // Footer
+        if root_type not in NO_COMMENT_ROOTS:
+            if mode in ["transform_and_comments", "comments_only"]:
+                add_comment(run, run, text=comment, writer=comments)
+        else:
+            run.text += f" :::: {original_text} ::::"
+    return {
+        "original": original_text,
+        "translation": run.text,
+        "translated": translated,
+    }
+
+
+def paragraph_spans(paragraph: docx.text.paragraph.Paragraph) -> list[list[docx.text.run.Run]]:
+    """
+    Consecutive runs of a paragraph sharing their formatting (run properties).
+    Runs without text (drawings, fields...) are left out and split spans.
+    """
+    spans: list[list[docx.text.run.Run]] = []
+    last_key = None
+    for run in paragraph.runs:
+        if run.text == "":
+            last_key = None
+            continue
+        r_pr = run._r.rPr  # pylint: disable=protected-access
+        key = b"" if r_pr is None else etree.tostring(r_pr)
+        if spans and key == last_key:
+            spans[-1].append(run)
+        else:
+            spans.append([run])
+        last_key = key
+    return spans
+
+
+def mark_spans(texts: list[str]) -> str:
+    """
+    Text of a paragraph sent whole, its formatting spans marked when there are several
+    """
+    if len(texts) == 1:
+        return texts[0]
+    return "".join(f"<s{ix}>{text}</s{ix}>" for ix, text in enumerate(texts, start=1))
+
+
+def is_marked(text: str) -> bool:
+    """
+    Whether a text is made of marked formatting spans (see mark_spans)
+    """
+    return text.startswith("<s1>") and MARKED_TEXT.fullmatch(text) is not None
+
+
+def strip_span_markers(text: str) -> str:
+    """
+    Text without its formatting span markers
+    """
+    return SPAN_MARKER_TAG.sub("", text) if is_marked(text) else text
+
+
+def normalize_span_markers(text: str) -> str:
+    """
+    Text with its span markers written as mark_spans writes them
+    """
+    return LOOSE_SPAN_MARKER_TAG.sub(r"<\1s\2>", text)
+
+
+def unmark_spans(tgt_text: str, src_texts: list[str]) -> list[str]:
+    """
+    Splits a transformed text back into the formatting spans of its source,
+    raising ValueError when its markers don't round-trip them: each span
+    marked once (in any order), with balanced markers. Text outside markers
+    joins the previous span (the first one at the start). Only whitespace
+    only spans (tabs, spacing) may be dropped, they are kept as they are.
+    """
+    if len(src_texts) == 1:
+        return [tgt_text]
+    tgt_text = normalize_span_markers(tgt_text)
+    texts: list[str | None] = [None] * len(src_texts)
+    ix_last = None
+    position = 0
+    outside = []
+    for match in SPAN_MARKER.finditer(tgt_text):
+        outside.append(tgt_text[position:match.start()])
+        ix = int(match.group(1)) - 1
+        if not 0 <= ix < len(src_texts) or texts[ix] is not None:
+            raise ValueError(f"Unknown Or Repeated Span Marker <s{ix + 1}>")
+        texts[ix] = match.group(2)
+        if ix_last is None:
+            # Text Before The First Marker
+            texts[ix] = outside.pop() + texts[ix]
+        else:
+            texts[ix_last] += outside.pop()
+        ix_last = ix
+        position = match.end()
+    if ix_last is None:
+        raise ValueError("No Span Markers")
+    texts[ix_last] += tgt_text[position:]
+    for ix, (text, src_text) in enumerate(zip(texts, src_texts)):
+        if text is None and src_text.strip() != "":
+            raise ValueError(f"Span <s{ix + 1}> Missing")
+        if text is not None and SPAN_MARKER_TAG.search(text):
+            raise ValueError(f"Unbalanced Span Markers Around <s{ix + 1}>")
+    return [src_text if text is None else text for text, src_text in zip(texts, src_texts)]
+
+
+def check_span_markers(tgt_text: str, src_text: str) -> str:
+    """
+    Transformed text with its span markers normalized, raising ValueError when
+    they don't round-trip the spans of a marked src_text (see unmark_spans)
+    """
+    if not is_marked(src_text):
+        return tgt_text
+    unmark_spans(tgt_text, [match.group(2) for match in SPAN_MARKER.finditer(src_text)])
+    return normalize_span_markers(tgt_text)
+
+
+def transform_paragraph_spans(
+    paragraph: docx.text.paragraph.Paragraph,
+    src_text: str,
+    prompt: str,
+    purpose: str,
+    model_name: str,
+    mode: Literal["comments_only", "transform_only", "transform_and_comments"],
+    root_type: str = "paragraph",
+    transform_fn: TransformFn | None = None,
+    comments: CommentWriter | None = None,
+) -> dict:
+    """
+    Transforms a paragraph in one call, with its formatting spans marked
+    (src_text, see mark_spans), and writes each span of the result back to
+    the runs of the matching span: its first run gets the text, the others
+    are emptied, so every run keeps its properties. Comments cover the whole
+    paragraph, and are queued on comments when given.
+    """
+    transform_fn = transform_fn or transform_text
+    spans = paragraph_spans(paragraph)
+    src_texts = ["".join(run.text for run in span) for span in spans]
+    original_text = "".join(src_texts)
+
+    tgt_text, translated, _ = transform_fn(
+        src_text=src_text,
+        prompt=prompt,
+        purpose=purpose,
+        model_name=model_name
+    )
+    if not translated:
+        return {"original": original_text, "translation": original_text, "translated": False}
+    try:
+        tgt_texts = unmark_spans(tgt_text, src_texts)
+    except ValueError as e:
+        # Markers Mangled (e.g. a reply cached before they were checked), Left As Is
+        log.warning("Span Markers Not Round-Tripped, Paragraph Left As Is: %r", e)
+        return {"original": original_text, "translation": original_text, "translated": False}
+    if mode in ["comments_only"]:
+        comment = "".join(tgt_texts)
+    else:
+        for span, text in zip(spans, tgt_texts):
+            span[0].text = text
+            for run in span[1:]:
+                run.text = ""
+        comment = original_text
+    # Can't Add Comment To Header // Footer
+    if root_type not in NO_COMMENT_ROOTS:
+        if mode in ["transform_and_comments", "comments_only"]:
+            add_comment(spans[0][0], spans[-1][-1], text=comment, writer=comments)
+    else:
+        spans[-1][-1].text += f" :::: {original_text} ::::"
+    return {
+        "original": original_text,
+        "translation": "".join(run.text for span in spans for run in span),
+        "translated": translated,
+    }
+
+
+def skip_run(text: str, in_table: bool = False) -> bool:
+    """
+    Runs left as they are: blanks, lone punctuation and (in tables) runs
+    already marked as translated
+    """
+    if in_table and "::::" in text:
+        return True
+    return text.strip() in ["", "\xa0", ".", "$", "●"]
+
+
+def skip_table_paragraph(text: str) -> bool:
+    """
+    Table paragraphs left as they are: empty, page numbers or already translated
+    """
+    return ("::::" in text) | ("Page" in text) | (text in EMPTY_PARAGRAPH_TEXTS)
+
+
+def is_text_run(run) -> bool:
+    """
+    Whether a run holds nothing but text, tabs and line breaks, i.e. whether
+    setting its text keeps everything it holds
+    """
+    for child in run._r:  # pylint: disable=protected-access
+        if child.tag not in TEXT_RUN_CHILDREN:
+            return False
+        if child.tag == qn("w:br") and child.get(qn("w:type")) in ["page", "column"]:
+            return False
+    return True
+
+
+def has_text_to_transform(para, in_table: bool = False) -> bool:
+    """
+    Whether a paragraph has a run, or text once its runs are merged, that
+    isn't left as it is
+    """
+    texts = [run.text for run in para.runs]
+    return any(
+        not skip_run(text, in_table) and not check_formats_not_to_translate(text)
+        for text in texts + ["".join(texts)]
+    )
+
+
 def cleanup_bad_runs(para):
     """
     Some runs get broken by italics/runs that make weaving
     not possible. This needs better handling, but this hack helps
     for now.
+
+    A run is merged into the previous one unless that one ends a sentence
+    (a period, other than a country abbreviation or before a comma), either
+    is a tab/newline, or the run is a bracketed number or a capital after
+    "U.S.". A run is judged with the text already merged into it, so runs are
+    scanned once from the end, keeping the few characters the rules look at.
+    Runs holding more than text (fields, drawings...) are never merged.
     """
-    def check_country_abbr(para, jx) -> bool:
+    runs = para.runs
+    if len(runs) < 2:
+        return
+    texts = [run.text for run in runs]
+    text_runs = [is_text_run(run) for run in runs]
+
+    def merge_into_previous(jx: int, head: tuple[str, str, str]) -> bool:
         """
-        Check if sentence ends mid-country abbreviation (U. CA., etc)
+        Whether run jx, accumulating text with (first, last, first visible)
+        characters head, joins run jx - 1
         """
-        try:
-            is_country_abbr = (para.runs[jx-1].text.strip().endswith('.') &
-                               para.runs[jx-1].text.strip()[-2].isupper())
-        except Exception: # pylint: disable=broad-except
-            is_country_abbr = False
-        return is_country_abbr
+        first, last, visible = head
+        prev = texts[jx - 1]
+        prev_stripped = prev.strip()
+        if prev_stripped.endswith("."):
+            # Check Country Abbreviations (U. CA., etc) And Special Case With . Then ,
+            is_country_abbr = len(prev_stripped) > 1 and prev_stripped[-2].isupper()
+            if not (is_country_abbr or visible == ","):
+                return False
+        # Not Tab Or Newline
+        if prev in ["\n", "\t"] or first in ["\n", "\t"]:
+            return False
+        if (jx - 1 == 0) and (prev == ""):
+            # Skip Case, No Use In Joining
+            return False
+        if visible == "":
+            return False
+        # Not Bracket Number
+        if first == "(" and last == ")":
+            return False
+        # Check Case Ending With U.S.
+        return not (prev_stripped.endswith("U.S.") and visible.isupper())
 
-    def check_special_end_cases(para, jx) -> bool:
+    def join(chain: list[int]):
         """
-        Check special case with . then ,
+        Writes the text of a chain of runs (last run first) to its first run
         """
-        try:
-            is_special_case = (para.runs[jx-1].text.strip().endswith('.') &
-                               para.runs[jx].text.strip().startswith(','))
-        except Exception: # pylint: disable=broad-except
-            is_special_case = False
-        return is_special_case
+        if len(chain) > 1:
+            runs[chain[-1]].text = "".join(texts[ix] for ix in reversed(chain))
+            for ix in chain[:-1]:
+                para._p.remove(runs[ix]._r)  # Delete Run pylint: disable=protected-access
 
     # Parse In Reverse
-    for jx, _ in reversed(list(enumerate(para.runs))):
-        # Stop At Start
-        if jx == 0:
-            break
-        # If Previous Sentence Does Not End With A Period
-        try:
-            if (
-                (not para.runs[jx - 1].text.strip().endswith("."))
-                | check_country_abbr(para, jx)
-                | check_special_end_cases(para, jx)
-            ) & (para.runs[jx - 1].text not in ["\n", "\t"]):
-                # Not Tab Or Newline
-                if (not para.runs[jx].text.startswith("\t")) & (
-                    not para.runs[jx].text.startswith("\n")
-                ):
-                    if (para.runs[jx].text not in ["\n", "\t"]) & (
-                        para.runs[jx - 1].text not in ["\n", "\t"]
-                    ):
-                        if (jx - 1 == 0) and (para.runs[jx - 1].text == ""):
-                            # Skip Case, No Use In Joining
-                            continue
-                        # Not Bracket Number
-                        if not all(
-                            [
-                                para.runs[jx].text[0] == "(",
-                                para.runs[jx].text[-1] == ")",
-                            ]
-                        ):
-                            # Check Case Ending With U.S.
-                            if not all(
-                                [
-                                    para.runs[jx - 1].text.strip().endswith("U.S."),
-                                    para.runs[jx].text.strip()[0].isupper(),
-                                ]
-                            ):
-                                # Append To Previous
-                                para.runs[jx - 1].text = (
-                                    para.runs[jx - 1].text + para.runs[jx].text
-                                )
-                                para._p.remove(para.runs[jx]._r)  # Delete Run pylint: disable=protected-access
-        except IndexError:
-            continue
-
-    return
+    last_text = texts[-1]
+    chain = [len(runs) - 1]
+    head = (last_text[:1], last_text[-1:], last_text.lstrip()[:1])
+    for jx in range(len(runs) - 1, 0, -1):
+        if text_runs[jx] and text_runs[jx - 1] and merge_into_previous(jx, head):
+            # Append To Previous (read back as written, carriage returns become newlines)
+            prev = texts[jx - 1].replace("\r", "\n")
+            first, last, visible = (char.replace("\r", "\n") for char in head)
+            head = (prev[:1] or first, last or prev[-1:], prev.lstrip()[:1] or visible)
+            chain.append(jx - 1)
+        else:
+            join(chain)
+            prev = texts[jx - 1]
+            chain = [jx - 1]
+            head = (prev[:1], prev[-1:], prev.lstrip()[:1])
+    join(chain)
 
 
 def transform_text(
     src_text: str,
     prompt: str,
     purpose: str,
-    model_name: str
+    model_name: str,
+    cache: TransformCache | None = None
 ) -> tuple[str, bool, bool]:
     """
     This functions runs the translation of an unput run/text. It still needs
@@ -290,11 +645,12 @@ def transform_text(
     # Translate
     orig_src_text = copy.deepcopy(src_text)
     src_text, transforms_dict = parse_and_prepare_src_text_transforms(src_text=src_text)
-    tgt_text = generate_transformation(
+    tgt_text = generate_cached_transformation(
         src_text=src_text,
         prompt=prompt,
         purpose=purpose,
-        model_name=model_name
+        model_name=model_name,
+        cache=cache
     )
     # Catch failed transformation
     if tgt_text is None:
@@ -307,64 +663,421 @@ def transform_text(
     return tgt_text, True, True
 
 
+def generate_cached_transformation(
+    src_text: str,
+    prompt: str,
+    purpose: str,
+    model_name: str,
+    cache: TransformCache | None = None,
+    model_names: list[str] | None = None
+) -> str | None:
+    """
+    generate_transformation, looking up/storing the (prepared) text in the
+    cache when one is given. With model_names, the models are tried in turn
+    (see generate_cascaded_transformation), the result is still cached under
+    model_name.
+    """
+    if cache is not None:
+        tgt_text = cache.get(
+            model_name=model_name, purpose=purpose, prompt=prompt, src_text=src_text
+        )
+        if tgt_text is not None:
+            return tgt_text
+    tgt_text = generate_cascaded_transformation(
+        src_text=src_text,
+        prompt=prompt,
+        purpose=purpose,
+        model_names=model_names or [model_name]
+    )
+    if (cache is not None) & isinstance(tgt_text, str):
+        cache.put(
+            model_name=model_name, purpose=purpose, prompt=prompt,
+            src_text=src_text, tgt_text=tgt_text
+        )
+    return tgt_text
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count for budgeting (~4 characters per token)
+    """
+    return len(text) // 4 + 1
+
+
+@functools.cache
+def get_encoding(model_name: str):
+    """
+    Tokenizer of a model, None when tiktoken or its encoding files are not
+    available (token counts are then estimated)
+    """
+    try:
+        import tiktoken  # pylint: disable=import-outside-toplevel
+        return tiktoken.encoding_for_model(model_name)
+    except Exception as e:  # pylint: disable=broad-except
+        log.warning("No Tokenizer For %s, Estimating Token Counts: %r", model_name, e)
+        return None
+
+
+def count_tokens(text: str, model_name: str) -> int:
+    """
+    Token count of a text for a model
+    """
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def output_token_budget(src_text: str, model_name: str) -> int:
+    """
+    max_tokens for the JSON reply transforming src_text: room for the text to
+    grow (e.g. translating into a more verbose language), plus the JSON wrapper
+    """
+    return min(
+        MAX_OUTPUT_TOKENS,
+        int(count_tokens(src_text, model_name) * OUTPUT_EXPANSION) + OUTPUT_OVERHEAD_TOKENS
+    )
+
+
+def next_output_budget(max_tokens: int, error: ratelimit.TruncatedResponse) -> int | None:
+    """
+    Budget to retry a truncated reply with (None once MAX_OUTPUT_TOKENS was
+    tried), counting the tokens the truncated call wasted
+    """
+    metrics.increment("truncated_requests")
+    metrics.increment("truncated_tokens", getattr(error.usage, "total_tokens", None) or 0)
+    if max_tokens >= MAX_OUTPUT_TOKENS:
+        log.warning("Reply Truncated At The Largest Budget (%s Tokens)", max_tokens)
+        return None
+    return min(MAX_OUTPUT_TOKENS, max_tokens * 2)
+
+
+def completion_content(completions) -> str | None:
+    """
+    Message of a completion, raising TruncatedResponse if it was cut off
+    """
+    choice = completions.choices[0]
+    if choice.finish_reason == "length":
+        raise ratelimit.TruncatedResponse(usage=getattr(completions, "usage", None))
+    return choice.message.content
+
+
+def build_transformation_messages(src_text: str, prompt: str, purpose: str) -> list[dict[str, str]]:
+    """
+    Builds the messages sent for a single transformation: a system prefix
+    that is byte-identical for every segment sharing purpose and prompt (so it
+    can be served from the provider's prompt cache), then the input text
+    """
+    return [
+        {
+            "role": "system",
+            "content": build_system_prompt(TRANSFORMATION_INSTRUCTIONS, prompt, purpose)
+        },
+        {"role": "user", "content": json.dumps({"src_text": src_text}, ensure_ascii=False)}
+    ]
+
+
+def build_system_prompt(instructions: str, prompt: str, purpose: str) -> str:
+    """
+    Static instructions followed by the purpose and prompt of the document
+    """
+    return f"{instructions}\n\nTask Purpose: {purpose}\nPrompt: {prompt}"
+
+
+def response_format(model_name: str, schema: dict[str, Any]) -> dict[str, Any]:
+    """
+    Structured output constrained to schema for models supporting it, plain
+    JSON mode otherwise (replies are validated against schema either way)
+    """
+    if model_name in STRUCTURED_OUTPUT_MODELS:
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": schema["title"], "strict": True, "schema": schema}
+        }
+    return {"type": "json_object"}
+
+
+def parse_transformation_response(message: str | None, src_text: str = "") -> str | None:
+    """
+    Parses the json response of a transformation (see TRANSFORMATION_SCHEMA),
+    raising if it is unusable, including when the span markers of a marked
+    src_text don't round-trip (see check_span_markers). Skipped texts give None.
+    """
+    if message is None:
+        raise ValueError("No Response From OpenAI")
+    message = json.loads(message)
+    if not _matches_result(message, TRANSFORMATION_SCHEMA):
+        raise ValueError("Response Does Not Match The Transformation Schema")
+    if message["skip"]:
+        return None
+    return check_span_markers(message["tgt_text"], src_text)
+
+
+def _matches_result(result: Any, schema: dict[str, Any]) -> bool:
+    """
+    Whether a result object has exactly the properties of schema, with their types
+    """
+    types = {"string": str, "boolean": bool}
+    return (
+        isinstance(result, dict)
+        and result.keys() == schema["properties"].keys()
+        and all(
+            isinstance(result[name], types[prop["type"]])
+            for name, prop in schema["properties"].items()
+        )
+    )
+
+
+@functools.cache
+def get_client() -> "openai.OpenAI":
+    """
+    Shared sync client. Retries are left to the rate limiter.
+    """
+    import openai  # pylint: disable=import-outside-toplevel,redefined-outer-name
+    return openai.OpenAI(max_retries=0)
+
+
 def generate_transformation(
     src_text: str,
     prompt: str,
     purpose: str,
-    model_name: str
+    model_name: str,
+    escalate: bool = False
 ) -> str | None:
     """
-    Generates Text For A Given Prompt
-    """
-    user_prompt = (
-        "You are a tool used to apply user-specified transformations to text. "
-        "The user can specify its purpose, the prompt and the input text. "
-        "Please avoid using any filler like 'as a consultant' or 'I have reviewd' and be direct "
-        "by only giving the necessary information."
-        "if you are commenting/reviewing, otherwise just transform the text inplace."
-        "If you can not respons with something useful, just respond with 'SKIP_REQUEST'."
-        "Please respond with a json of the form {'tgt_text': 'your response'}."
-        f"""
-        Task Purpose: {purpose}
-        Prompt: {prompt}
-        Input Text: {src_text}
-        """
+    Generates Text For A Given Prompt. With escalate, failures are raised
+    instead of returning None (and replies failing validation are not
+    retried), so another model can take over.
+    """
+    messages = build_transformation_messages(src_text=src_text, prompt=prompt, purpose=purpose)
+    prompt_tokens = sum(count_tokens(message["content"], model_name) for message in messages)
+    max_tokens = output_token_budget(src_text, model_name)
+    while max_tokens is not None:
+        try:
+            with metrics.timed("generate", segments=1):
+                return ratelimit.get_rate_limiter(model_name).call(
+                    request_fn=functools.partial(
+                        get_client().chat.completions.with_raw_response.create,
+                        model=model_name,
+                        messages=messages,
+                        max_tokens=max_tokens,
+                        n=1,
+                        stop=None,
+                        response_format=response_format(model_name, TRANSFORMATION_SCHEMA),
+                    ),
+                    parse_fn=lambda completions: parse_transformation_response(
+                        completion_content(completions), src_text=src_text
+                    ),
+                    tokens=prompt_tokens + max_tokens,
+                    retry_invalid=not escalate
+                )
+        except ratelimit.TruncatedResponse as e:
+            max_tokens = next_output_budget(max_tokens, e)
+            if max_tokens is None and escalate:
+                raise
+        except Exception: # pylint: disable=broad-except
+            if escalate:
+                raise
+            return None
+    return None
+
+
+async def agenerate_transformation(
+    src_text: str,
+    prompt: str,
+    purpose: str,
+    model_name: str,
+    client: "openai.AsyncOpenAI",
+    escalate: bool = False
+) -> str | None:
+    """
+    Async version of generate_transformation
+    """
+    messages = build_transformation_messages(src_text=src_text, prompt=prompt, purpose=purpose)
+    prompt_tokens = sum(count_tokens(message["content"], model_name) for message in messages)
+    max_tokens = output_token_budget(src_text, model_name)
+    while max_tokens is not None:
+        try:
+            with metrics.timed("generate", segments=1):
+                return await ratelimit.get_rate_limiter(model_name).acall(
+                    request_fn=functools.partial(
+                        client.chat.completions.with_raw_response.create,
+                        model=model_name,
+                        messages=messages,
+                        max_tokens=max_tokens,
+                        n=1,
+                        stop=None,
+                        response_format=response_format(model_name, TRANSFORMATION_SCHEMA),
+                    ),
+                    parse_fn=lambda completions: parse_transformation_response(
+                        completion_content(completions), src_text=src_text
+                    ),
+                    tokens=prompt_tokens + max_tokens,
+                    retry_invalid=not escalate
+                )
+        except ratelimit.TruncatedResponse as e:
+            max_tokens = next_output_budget(max_tokens, e)
+            if max_tokens is None and escalate:
+                raise
+        except Exception: # pylint: disable=broad-except
+            if escalate:
+                raise
+            return None
+    return None
+
+
+def generate_cascaded_transformation(
+    src_text: str,
+    prompt: str,
+    purpose: str,
+    model_names: list[str]
+) -> str | None:
+    """
+    generate_transformation with each model in turn (e.g. a fast one, then the
+    configured one), escalating to the next when a model fails or its reply
+    fails validation
+    """
+    for model_name in model_names[:-1]:
+        try:
+            return generate_transformation(
+                src_text=src_text, prompt=prompt, purpose=purpose,
+                model_name=model_name, escalate=True
+            )
+        except Exception as e: # pylint: disable=broad-except
+            metrics.increment("escalations")
+            log.debug("Escalating From %s: %r", model_name, e)
+    return generate_transformation(
+        src_text=src_text, prompt=prompt, purpose=purpose, model_name=model_names[-1]
     )
-    for i in range(3):
+
+
+async def agenerate_cascaded_transformation(
+    src_text: str,
+    prompt: str,
+    purpose: str,
+    model_names: list[str],
+    client: "openai.AsyncOpenAI"
+) -> str | None:
+    """
+    Async version of generate_cascaded_transformation
+    """
+    for model_name in model_names[:-1]:
         try:
-            completions = openai.chat.completions.create(
-                    model=model_name,
-                    messages=[{"role":"user","content":user_prompt}],
-                    max_tokens=len(src_text) + 50,
-                    n=1,
-                    stop=None,
-                    response_format={ "type": "json_object" },
+            return await agenerate_transformation(
+                src_text=src_text, prompt=prompt, purpose=purpose,
+                model_name=model_name, client=client, escalate=True
             )
-            message = completions.choices[0].message.content
-            if message is None:
-                raise ValueError("No Response From OpenAI")
-            if "SKIP_REQUEST" in message:
-                return None
-            assert message is not None
-            message = json.loads(message)
-            assert isinstance(message, dict)
-            if "tgt_text" not in message:
-                raise ValueError("No Translation Found")
-            break
+        except Exception as e: # pylint: disable=broad-except
+            metrics.increment("escalations")
+            log.debug("Escalating From %s: %r", model_name, e)
+    return await agenerate_transformation(
+        src_text=src_text, prompt=prompt, purpose=purpose,
+        model_name=model_names[-1], client=client
+    )
+
+
+def build_batch_transformation_messages(
+    segments: dict[str, str],
+    prompt: str,
+    purpose: str
+) -> list[dict[str, str]]:
+    """
+    Builds the messages sent for a batch of transformations (same system
+    prefix layout as build_transformation_messages)
+    """
+    input_segments = [{"id": seg_id, "text": text} for seg_id, text in segments.items()]
+    return [
+        {"role": "system", "content": build_system_prompt(BATCH_INSTRUCTIONS, prompt, purpose)},
+        {"role": "user", "content": json.dumps({"segments": input_segments}, ensure_ascii=False)}
+    ]
+
+
+def parse_batch_transformation_response(
+    message: str | None,
+    segments: dict[str, str] | None = None
+) -> dict[str, str | None]:
+    """
+    Parses the json response of a batch (see BATCH_TRANSFORMATION_SCHEMA),
+    mapping segment id to its text (None for skipped segments). Entries not
+    matching the schema, or not round-tripping the span markers of their
+    segment (when segments are given), are left out.
+    """
+    if message is None:
+        raise ValueError("No Response From OpenAI")
+    message = json.loads(message)
+    if not isinstance(message, dict) or not isinstance(message.get("results"), list):
+        raise ValueError("No Results Found")
+    result_schema = BATCH_TRANSFORMATION_SCHEMA["properties"]["results"]["items"]
+    tgt_texts: dict[str, str | None] = {}
+    for result in message["results"]:
+        if not _matches_result(result, result_schema):
+            continue
+        if result["skip"]:
+            tgt_texts[result["id"]] = None
+            continue
+        try:
+            tgt_texts[result["id"]] = check_span_markers(
+                result["tgt_text"], (segments or {}).get(result["id"], "")
+            )
+        except ValueError as e:
+            log.debug("Leaving Out Segment %s: %r", result["id"], e)
+    return tgt_texts
+
+
+async def agenerate_batch_transformation(
+    segments: dict[str, str],
+    prompt: str,
+    purpose: str,
+    model_name: str,
+    client: "openai.AsyncOpenAI"
+) -> dict[str, str | None]:
+    """
+    Generates Text For Several Segments In One Request. Segments missing
+    from the result failed and should be retried on their own.
+    """
+    messages = build_batch_transformation_messages(
+        segments=segments, prompt=prompt, purpose=purpose
+    )
+    prompt_tokens = sum(count_tokens(message["content"], model_name) for message in messages)
+    max_tokens = min(MAX_OUTPUT_TOKENS, sum(
+        output_token_budget(text, model_name) + BATCH_OVERHEAD_TOKENS for text in segments.values()
+    ))
+    tgt_texts = None
+    while tgt_texts is None and max_tokens is not None:
+        try:
+            with metrics.timed("generate", segments=len(segments)):
+                tgt_texts = await ratelimit.get_rate_limiter(model_name).acall(
+                    request_fn=functools.partial(
+                        client.chat.completions.with_raw_response.create,
+                        model=model_name,
+                        messages=messages,
+                        max_tokens=max_tokens,
+                        n=1,
+                        stop=None,
+                        response_format=response_format(model_name, BATCH_TRANSFORMATION_SCHEMA),
+                    ),
+                    parse_fn=lambda completions: parse_batch_transformation_response(
+                        completion_content(completions), segments=segments
+                    ),
+                    tokens=prompt_tokens + max_tokens
+                )
+        except ratelimit.TruncatedResponse as e:
+            max_tokens = next_output_budget(max_tokens, e)
         except Exception: # pylint: disable=broad-except
-            if i < 2:
-                time.sleep(1)  # wait for 1 second before trying again
-                continue
-            else:
-                return None
-    assert isinstance(message, dict)
-    return message["tgt_text"]
+            return {}
+    if tgt_texts is None:
+        return {}
+    return {seg_id: tgt_texts[seg_id] for seg_id in segments if seg_id in tgt_texts}
 
 
 def parse_and_prepare_src_text_transforms(src_text: str) -> tuple[str, dict[str, Any]]:
     """
     Parse and Prepare the Source Text for Translation
     """
+    # Paragraphs With Marked Formatting Spans Are Sent As Is
+    if is_marked(src_text):
+        return src_text, dict(NO_TRANSFORMS)
+
     # Init
     transforms_dict: dict[str, Any] = {}
 
@@ -473,6 +1186,7 @@ def check_formats_not_to_translate(src_text: str) -> bool:
     Check if a string should not be translated based on
     certain rules
     """
+    src_text = strip_span_markers(src_text)
     # Check only Numbers
     if all([c.isdigit() for c in src_text]):
         return True